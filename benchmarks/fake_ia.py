@@ -0,0 +1,225 @@
+"""Local stand-in for the Internet Archive and the original news websites, for benchmarking the downloader offline.
+
+Serves, on a single port:
+
+- the CDX API, ``/cdx/search/cdx?url=...&output=json``, listing the snapshots of each url
+- the latest archived copy, ``/web/2id_/<url>``, redirecting to the latest snapshot
+- the snapshots, ``/web/<timestamp>id_/<url>``
+- the original websites, any other path, e.g., ``http://127.0.0.2:<port>/news/<id>``: every address in 127.0.0.0/8
+  reaches the server, so each address stands for a different website
+
+Which urls have snapshots is decided by a hash of the url, so that reruns see the same archive, while 429 and 502
+errors are injected at random.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SENTENCES = [
+    'The mayor said that the city would open a new hospital for the people who were in need of care.',
+    'Officials confirmed on Tuesday that the talks between the two governments would continue next week.',
+    'Thousands of residents gathered in the main square to protest against the new tax on fuel.',
+    'The company reported a sharp rise in profits, driven by strong demand for its products abroad.',
+    'Scientists warned that the rising temperatures could threaten the harvest in the coming years.',
+    'The minister told reporters that the government had no plans to change the law before the election.',
+    'Police said the suspect had been arrested after a search that lasted most of the night.',
+    'The team won the final match of the season in front of a crowd of more than forty thousand fans.',
+]
+
+# the timestamps of the snapshots of every url, earliest first, within the default WAYBACK_MACHINE_TIME_RANGE
+SNAPSHOT_TIMESTAMPS = ['20150101000000', '20170101000000', '20190101000000', '20200101000000']
+
+WEB_PATTERN = re.compile(r'^/web/(\d{1,14})(?:id_)?/(.+)$')
+
+
+class FakeIaConfig:
+    """
+    behaviour of the stand-in server
+    :param latency: mean seconds before answering each request to the internet archive
+    :param original_latency: mean seconds before answering each request to an original website
+    :param jitter: relative spread of the latency, e.g., 0.5 for +/- 50%
+    :param rate_429: probability of answering a request to the internet archive with a 429 error
+    :param rate_502: probability of answering a request for a snapshot with a 502 error
+    :param retry_after: the Retry-After header of 429 errors, in seconds
+    :param page_size: approximate size of each page, in bytes
+    :param no_snapshot_rate: share of urls without any snapshot, left to the retry phases
+    """
+
+    def __init__(self, latency=0.05, original_latency=0.1, jitter=0.5, rate_429=0.0, rate_502=0.0, retry_after=1,
+                 page_size=20000, no_snapshot_rate=0.1):
+        self.latency = latency
+        self.original_latency = original_latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_502 = rate_502
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self.no_snapshot_rate = no_snapshot_rate
+
+
+def has_snapshots(url, config):
+    """
+    :param url: the original url
+    :param config: a `FakeIaConfig`
+    :return: whether the stand-in archive holds snapshots of `url`
+    """
+    return zlib.crc32(url.encode('utf8')) % 1000 >= config.no_snapshot_rate * 1000
+
+
+def has_latest_copy(url, config):
+    """
+    :param url: the original url
+    :param config: a `FakeIaConfig`
+    :return: whether the stand-in archive serves a latest archived copy of `url`; as on the internet archive, half of
+             the urls without snapshots listed by the CDX API still have one
+    """
+    return zlib.crc32(url.encode('utf8')) % 1000 >= config.no_snapshot_rate * 500
+
+
+def get_page(url, config):
+    """
+    :param url: the url of the page
+    :param config: a `FakeIaConfig`
+    :return: an html page of about `config.page_size` bytes, whose text is unique to `url`
+    """
+    rng = random.Random(url)
+    paragraphs = []
+    size = 0
+    while size < config.page_size:
+        paragraph = '<p>{}</p>'.format(' '.join(rng.choice(SENTENCES) for _ in range(5)))
+        paragraphs.append(paragraph)
+        size += len(paragraph)
+    return ('<html><head><title>{0}</title></head><body><article><h1>{0}</h1>{1}</article></body></html>'
+            .format(url, ''.join(paragraphs))).encode('utf8')
+
+
+class FakeIaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = FakeIaConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b'', content_type='text/html', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def wait(self, latency):
+        if latency > 0:
+            time.sleep(latency * random.uniform(1 - self.config.jitter, 1 + self.config.jitter))
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        config = self.config
+        parsed = urlparse(self.path)
+        archive = parsed.path.startswith('/cdx/') or parsed.path.startswith('/web/') or parsed.path == '/robots.txt'
+        if not archive:
+            self.wait(config.original_latency)
+            return self.send(200, get_page('http://{}{}'.format(self.headers.get('Host'), self.path), config))
+        self.wait(config.latency)
+        if random.random() < config.rate_429:
+            return self.send(429, headers=[('Retry-After', str(config.retry_after))])
+        if parsed.path.startswith('/cdx/'):
+            return self.do_cdx(parse_qs(parsed.query))
+        match = WEB_PATTERN.match(self.path)
+        if match is None:
+            return self.send(404)
+        timestamp, url = match.groups()
+        if not has_latest_copy(url, config):
+            return self.send(404)
+        if len(timestamp) < 14:
+            # the latest archived copy
+            return self.send(302, headers=[('Location', '/web/{}id_/{}'.format(SNAPSHOT_TIMESTAMPS[-1], url))])
+        if random.random() < config.rate_502:
+            return self.send(502)
+        return self.send(200, get_page(url, config))
+
+    def do_cdx(self, query):
+        url = query.get('url', [''])[0]
+        rows = [['timestamp', 'original', 'statuscode', 'digest']]
+        if has_snapshots(url, self.config):
+            limit = int(query.get('limit', [len(SNAPSHOT_TIMESTAMPS)])[0])
+            rows += [[timestamp, url, '200', 'DIGEST{}'.format(i)]
+                     for i, timestamp in enumerate(SNAPSHOT_TIMESTAMPS[:limit])]
+        self.send(200, json.dumps(rows).encode('utf8'), content_type='application/json')
+
+
+def serve(config, host='0.0.0.0', port=0):
+    """
+    starts the stand-in server in a daemon thread
+    :param config: a `FakeIaConfig`
+    :param host: the address to listen on; 0.0.0.0 also answers the addresses in 127.0.0.0/8
+    :param port: the port to listen on, or 0 for any free port
+    :return: the running `ThreadingHTTPServer`; its port is `server.server_address[1]`
+    """
+    handler = type('ConfiguredFakeIaHandler', (FakeIaHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    """
+    :param parser: an `argparse.ArgumentParser`, to which the fields of `FakeIaConfig` are added as arguments
+    :return: None
+    """
+    defaults = FakeIaConfig()
+    parser.add_argument('--latency', type=float, default=defaults.latency,
+                        help='mean seconds before answering each request to the internet archive')
+    parser.add_argument('--original_latency', type=float, default=defaults.original_latency,
+                        help='mean seconds before answering each request to an original website')
+    parser.add_argument('--jitter', type=float, default=defaults.jitter,
+                        help='relative spread of the latency, e.g., 0.5 for +/- 50%%')
+    parser.add_argument('--rate_429', type=float, default=defaults.rate_429,
+                        help='probability of a 429 error for each request to the internet archive')
+    parser.add_argument('--rate_502', type=float, default=defaults.rate_502,
+                        help='probability of a 502 error for each request for a snapshot')
+    parser.add_argument('--retry_after', type=int, default=defaults.retry_after,
+                        help='the Retry-After header of 429 errors, in seconds')
+    parser.add_argument('--page_size', type=int, default=defaults.page_size,
+                        help='approximate size of each page, in bytes')
+    parser.add_argument('--no_snapshot_rate', type=float, default=defaults.no_snapshot_rate,
+                        help='share of urls without any snapshot')
+
+
+def get_config(args):
+    """
+    :param args: the arguments parsed by a parser set up with `add_config_arguments`
+    :return: a `FakeIaConfig`
+    """
+    return FakeIaConfig(latency=args.latency, original_latency=args.original_latency, jitter=args.jitter,
+                        rate_429=args.rate_429, rate_502=args.rate_502, retry_after=args.retry_after,
+                        page_size=args.page_size, no_snapshot_rate=args.no_snapshot_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8765, help='the port to listen on')
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = serve(get_config(args), port=args.port)
+    print('serving on port', server.server_address[1])
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
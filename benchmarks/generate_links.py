@@ -0,0 +1,75 @@
+"""Synthetic links file, in the format of sample_data.csv, whose links point to the websites of `fake_ia.py`."""
+import argparse
+import csv
+import random
+
+COLUMNS = ['pair_id', 'lang1', 'lang2', 'link1', 'link2', 'overall', 'geo', 'ent', 'time', 'nar', 'style', 'tone']
+
+# the languages of the task, weighted roughly as in the released data
+LANGUAGES = ['en', 'de', 'es', 'pl', 'tr', 'ar', 'fr', 'it', 'ru', 'zh']
+LANGUAGE_WEIGHTS = [40, 15, 10, 8, 6, 6, 5, 4, 3, 3]
+
+
+def get_domain(index, port):
+    """
+    :param index: the index of the website
+    :param port: the port of the stand-in server
+    :return: the scheme and netloc of the website, an address in 127.0.0.0/8 that reaches the stand-in server
+    """
+    return 'http://127.{}.{}.{}:{}'.format(index // 62500 % 250, index // 250 % 250, index % 250 + 1, port)
+
+
+def generate_links(path, pairs, domains=100, port=8765, seed=0, articles_per_pair=1.5, shared_link_rate=0.02,
+                   query_rate=0.1):
+    """
+    writes a links file of `pairs` pairs; as in the released data, the same article appears in several pairs, some
+    articles share their link up to tracking parameters, and some links have query strings
+    :param path: the path to the links file
+    :param pairs: how many pairs to write
+    :param domains: across how many websites to spread the articles
+    :param port: the port of the stand-in server
+    :param seed: seed of the random generator, so that the same arguments write the same file
+    :param articles_per_pair: how many distinct articles per pair, at most 2
+    :param shared_link_rate: share of articles whose link is the link of another article, with a tracking parameter
+    :param query_rate: share of links with a query string
+    :return: None
+    """
+    rng = random.Random(seed)
+    article_count = max(2, int(pairs * articles_per_pair))
+    first_id = 1000000000
+    langs = rng.choices(LANGUAGES, weights=LANGUAGE_WEIGHTS, k=article_count)
+
+    def get_link(index):
+        # decided by the index alone, so that each article keeps its link across pairs
+        article_rng = random.Random('{}-{}'.format(seed, index))
+        if index > 0 and article_rng.random() < shared_link_rate:
+            link = get_link(article_rng.randrange(index))
+            return link + ('&' if '?' in link else '?') + 'utm_source=benchmark'
+        link = '{}/news/{}'.format(get_domain(article_rng.randrange(domains), port), first_id + index)
+        if article_rng.random() < query_rate:
+            link += '?id={}'.format(index)
+        return link
+
+    with open(path, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for _ in range(pairs):
+            index1, index2 = rng.sample(range(article_count), 2)
+            scores = [rng.choice([1, 1.5, 2, 2.5, 3, 3.5, 4]) for _ in COLUMNS[5:]]
+            writer.writerow(['{}_{}'.format(first_id + index1, first_id + index2), langs[index1], langs[index2],
+                             get_link(index1), get_link(index2)] + scores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--out', default='benchmark_links.csv', help='the path to the links file')
+    parser.add_argument('--pairs', type=int, default=1000, help='how many pairs to write')
+    parser.add_argument('--domains', type=int, default=100, help='across how many websites to spread the articles')
+    parser.add_argument('--port', type=int, default=8765, help='the port of the stand-in server')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    args = parser.parse_args()
+    generate_links(args.out, args.pairs, domains=args.domains, port=args.port, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
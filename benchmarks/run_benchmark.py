@@ -0,0 +1,134 @@
+"""Runs the downloader on a synthetic links file against the local stand-in of `fake_ia.py`, and reports its throughput.
+
+Reports the articles downloaded per second, the wall time of each phase, as recorded in `<dump_dir>/.metrics.json`,
+and the peak resident memory of the downloader and its worker processes. Arguments after `--` are passed on to the
+downloader, e.g., `-- --mode streaming --parser_processes 4`.
+"""
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_ia
+from generate_links import generate_links
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the downloader arguments of the benchmark, unless given after `--`
+DEFAULT_DOWNLOADER_ARGS = ['--concurrent_requests', '16', '--download_delay', '0', '--retry_delay', '0',
+                           '--log_level', 'WARNING']
+
+
+def get_phase_seconds(dump_dir):
+    """
+    :param dump_dir: the root folder where articles are saved
+    :return: dict mapping each phase to its wall time in seconds
+    """
+    path = os.path.join(dump_dir, '.metrics.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf8') as f:
+        counters = json.load(f)['counters']
+    return {counter['labels']['phase']: counter['value'] for counter in counters
+            if counter['name'] == 'phase_seconds_total'}
+
+
+def get_downloaded_counts(dump_dir):
+    """
+    :param dump_dir: the root folder where articles are saved
+    :return: dict mapping each phase to the number of articles downloaded in that phase
+    """
+    connection = sqlite3.connect(os.path.join(dump_dir, '.state.sqlite3'))
+    try:
+        return dict(connection.execute("SELECT phase, count(*) FROM articles WHERE status = 'downloaded' "
+                                       "GROUP BY phase").fetchall())
+    finally:
+        connection.close()
+
+
+def run_benchmark(work_dir, pairs, domains, config, downloader_args):
+    """
+    :param work_dir: folder for the links file and the downloaded articles
+    :param pairs: how many pairs in the links file
+    :param domains: across how many websites to spread the articles
+    :param config: a `fake_ia.FakeIaConfig`
+    :param downloader_args: the command line arguments of the downloader, besides --links_file and --dump_dir
+    :return: dict of results
+    """
+    server = fake_ia.serve(config)
+    port = server.server_address[1]
+    try:
+        links_file = os.path.join(work_dir, 'links.csv')
+        dump_dir = os.path.join(work_dir, 'articles')
+        generate_links(links_file, pairs, domains=domains, port=port)
+        env = dict(os.environ, SEMEVAL_8_2022_IA_URL='http://127.0.0.1:{}'.format(port),
+                   PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'semeval_8_2022_ia_downloader.cli', '--links_file', links_file,
+                        '--dump_dir', dump_dir, '--retry_log', os.path.join(work_dir, 'inaccessible_urls.csv')] +
+                       downloader_args, env=env, cwd=work_dir, check=True)
+        wall_seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    downloaded = get_downloaded_counts(dump_dir)
+    return {
+        'pairs': pairs,
+        'domains': domains,
+        'config': vars(config),
+        'downloader_args': downloader_args,
+        'wall_seconds': wall_seconds,
+        'downloaded': sum(downloaded.values()),
+        'downloaded_per_phase': downloaded,
+        'articles_per_second': sum(downloaded.values()) / wall_seconds,
+        'phase_seconds': get_phase_seconds(dump_dir),
+        # in kilobytes on Linux; the largest of the downloader and of its worker processes
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def print_report(results):
+    print()
+    print('pairs               {}'.format(results['pairs']))
+    print('articles downloaded {}'.format(results['downloaded']))
+    print('wall time           {:.1f} s'.format(results['wall_seconds']))
+    print('articles/s          {:.2f}'.format(results['articles_per_second']))
+    print('peak RSS            {:.1f} MB'.format(results['peak_rss_kb'] / 1024))
+    for phase in sorted(set(results['phase_seconds']) | set(results['downloaded_per_phase'])):
+        seconds = results['phase_seconds'].get(phase)
+        print('  {:<18}{:>10}  {:6d} articles'.format(phase, '' if seconds is None else '{:.1f} s'.format(seconds),
+                                                      results['downloaded_per_phase'].get(phase, 0)))
+
+
+def main():
+    argv = sys.argv[1:]
+    downloader_args = DEFAULT_DOWNLOADER_ARGS
+    if '--' in argv:
+        downloader_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pairs', type=int, default=1000, help='how many pairs in the links file')
+    parser.add_argument('--domains', type=int, default=100, help='across how many websites to spread the articles')
+    parser.add_argument('--work_dir', default=None,
+                        help='folder for the links file and the downloaded articles (default: a temporary folder)')
+    parser.add_argument('--report', default=None, help='path to a json file to save the results to')
+    fake_ia.add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.work_dir is None:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = run_benchmark(work_dir, args.pairs, args.domains, fake_ia.get_config(args), downloader_args)
+    else:
+        os.makedirs(args.work_dir, exist_ok=True)
+        results = run_benchmark(args.work_dir, args.pairs, args.domains, fake_ia.get_config(args), downloader_args)
+    print_report(results)
+    if args.report:
+        with open(args.report, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,91 +4,137 @@ import json
 import os
 import os.path
 import pathlib
+import re
 import sys
 import time
-from multiprocessing import Pool
-from urllib.parse import urlparse, urljoin
-
-import pandas as pd
-import requests
-import tqdm
-from newspaper import Article, Config
-from requests import RequestException
-
-from scrapy.crawler import CrawlerProcess
-from scrapy.utils.project import get_project_settings
-
-RESOLVE_FQDN_LIST = ['feedproxy.google.com']
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlparse, urljoin
+
+# pandas, newspaper3k, scrapy and requests are imported by the functions that need them, so that `--help` and
+# `status` start without loading them
+from semeval_8_2022_ia_downloader.gating import DEFAULT_CONTENT_TYPES, DEFAULT_MAX_SIZE, parse_content_types
+from semeval_8_2022_ia_downloader.metrics import BYTES_BUCKETS, CHARS_BUCKETS, METRICS_FILENAME, MetricsWriter, \
+    get_metrics, write_metrics
+from semeval_8_2022_ia_downloader.profiling import enable_profiling, record_parse_time, write_report
+from semeval_8_2022_ia_downloader.state import STATE_FILENAME, get_content_hash, get_plan_index, get_state_index
+from semeval_8_2022_ia_downloader.storage import COMPRESSION_EXTENSIONS, LAYOUTS, configure_storage, get_storage
+
+# the internet archive, or a stand-in for it, e.g., the local server of the benchmarks
+IA_URL = os.environ.get('SEMEVAL_8_2022_IA_URL', 'https://web.archive.org').rstrip('/')
+WAYBACK_PREFIX = IA_URL + '/web/'
+# the shortest timestamp matching any capture: the waybackmachine serves the latest one
+# https://en.wikipedia.org/wiki/Help:Using_the_Wayback_Machine#Latest_archive_copy
+WAYBACK_LATEST_TIMESTAMP = '2'
+# the timestamp of an archived copy, optionally followed by its mode, e.g., /web/20200101000000id_/<url>
+WAYBACK_TIMESTAMP_PATTERN = re.compile(r'^/web/(\d{1,14})(?:[a-z]{2}_)?/')
+WAYBACK_TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+CDX_ENDPOINT = IA_URL + '/cdx/search/cdx'
+# how many seconds to wait for the server in the retry phases and streaming mode
+REQUEST_TIMEOUT = 60
+
+# bumped whenever the fields extracted by `parse_article` change; together with the version of newspaper3k, it tells
+# `reparse` which articles to extract again, see `get_extractor_version`
+EXTRACTOR_FIELDS_VERSION = 1
+
+
+def __getattr__(name):
+    # names that used to be imported from `plan` at the top of this module
+    if name == 'RESOLVE_FQDN_LIST':
+        from semeval_8_2022_ia_downloader.plan import RESOLVE_FQDN_LIST
+        return RESOLVE_FQDN_LIST
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 def get_local_path_for_article(article_id, dump_dir, extension='.json'):
     """
-    maps the `article_id` to the path where the article should be stored
+    maps the `article_id` to the path where the article is stored, whatever its compression, or where it should be
+    stored if it was not downloaded yet
     :param article_id: the id of the article
     :param dump_dir: the root folder where to save articles
     :param extension: the extension for the file that should contain the article
     :return: the path to the file
     """
-    dirname = article_id[-2:]
-    filename = article_id + extension
-    filepath = os.path.join(dump_dir, dirname, filename)
-    return filepath
+    storage = get_storage(dump_dir)
+    found = storage.find(article_id, extension)
+    if found is not None:
+        return found[0]
+    return storage.get_path(article_id, extension)
+
+
+def read_article(article_id, dump_dir, extension='.json'):
+    """
+    reads a downloaded article, whatever its compression
+    :param article_id: the id of the article
+    :param dump_dir: the root folder where articles are saved
+    :param extension: ".json" for the parsed article, or ".html" for the raw html
+    :return: the dict saved as json, or the html as bytes, or None if the article was not downloaded
+    """
+    data = get_storage(dump_dir).read(article_id, extension)
+    if data is None or extension != '.json':
+        return data
+    return json.loads(data)
 
 
-def parse_input(location):
+def parse_input(location, dump_dir=None, shard=None):
     """
     parses the csv file containing the articles to download
     :param location: the path to the input file
+    :param dump_dir: the root folder where to save articles; if given, the parsed input is cached as a plan next to
+           `dump_dir` and reused by later calls, see `plan.load_plan`, and its links are resolved only by the planning
+           step of `download`
+    :param shard: pair `(index, count)` to keep only the articles of shard `index` out of `count`, see `parse_shard`,
+           or None to keep all articles
     :return: generator of triplets `(article_id, article_link, article_lang)` containing respectively the id
-             of the article, the link to the article, and the language of the article
+             of the article, the link to the article, and the language of the article; articles sharing their link
+             with an earlier article are left out, see `plan.materialize_aliases`
     """
-    df = pd.read_csv(location, index_col='pair_id', encoding='utf8')
-
-    df.rename(columns={"url1_lang": "lang1", "url2_lang": "lang2"}, inplace=True)  # patch for different release format
-    all_links = set(df.link1.unique())
-    all_links.update(set(df.link2.unique()))
-
-    # https://stackoverflow.com/a/36806159
-    # Query parameters are parsed as additional parameters to the API rather than as part of the url
-
-    for pair_id, row in df.iterrows():
-        for article_id, article_link, article_lang in zip(pair_id.split('_'),
-                                                          row[['link1', 'link2']].values,
-                                                          row[['lang1', 'lang2']].values, ):
-            domain = urlparse(article_link).netloc
-            if domain in RESOLVE_FQDN_LIST:
-                # resolve link if e.g., coming from news aggregators like feedproxy.google.com
-                try:
-                    r = requests.head(article_link, allow_redirects=True)
-                    article_link = r.url
-                except (TimeoutError, RequestException) as e:
-                    print(e)
-                    continue
-            yield article_id, article_link, article_lang
+    from semeval_8_2022_ia_downloader.plan import build_plan, load_plan, resolve_plan
+
+    if dump_dir is None:
+        plan = build_plan(location, shard)
+        resolve_plan(plan)
+    else:
+        plan = load_plan(location, dump_dir, shard=shard)
+    # links that cannot be resolved, e.g., from news aggregators like feedproxy.google.com, are skipped
+    plan = plan[plan['resolved_link'].notna() & (plan['fetch_id'] == plan['article_id'])]
+    yield from plan[['article_id', 'resolved_link', 'lang']].itertuples(index=False, name=None)
 
 
-def get_remaining_articles(location, dump_dir, min_text_length=0):
+def get_remaining_articles(location, dump_dir, min_text_length=0, shard=None):
     """
     finds the articles that need downloading
     :param location: the path to the input file
     :param dump_dir: the root folder where to save articles
     :param min_text_length: include articles that have been downloaded, but for which the `text` entry in the
            corresponding json file is at most `min_text_length` characters
+    :param shard: pair `(index, count)` to keep only the articles of shard `index` out of `count`, see `parse_shard`
     :return: generator of triplets `(article_id, article_link, article_lang)` containing respectively the id
              of the article, the link to the article, and the language of the article
     """
-    for article_id, article_link, article_lang in parse_input(location):
-        filepath = get_local_path_for_article(article_id, dump_dir)
-        if not os.path.exists(filepath):
+    completed_ids = get_state_index(dump_dir).get_completed_ids(min_text_length)
+    for article_id, article_link, article_lang in parse_input(location, dump_dir, shard):
+        if article_id not in completed_ids:
             yield article_id, article_link, article_lang
-        else:
-            with open(filepath, encoding='utf8') as f:
-                article_json = json.loads(f.read())
-                if ('text' not in article_json) or (len(article_json['text'].strip()) <= min_text_length):
-                    yield article_id, article_link, article_lang
 
 
-def parse_article(dump_dir, article_id, article_link, article_lang, html=None, article_config=None):
+def parse_shard(value):
+    """
+    parses the --shard argument
+    :param value: "i/N" for shard i out of N, from 0 to N - 1
+    :return: pair `(i, N)`
+    """
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected i/N, e.g., 0/4, not {!r}'.format(value))
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError('expected 0 <= i < N, not {!r}'.format(value))
+    return index, count
+
+
+def parse_article(dump_dir, article_id, article_link, article_lang, html=None, article_config=None, phase=None,
+                  save_html=True, skip_identical=True):
     """
     downloads the article, saves the html, uses newspaper3k to parse the article, saves the output as json
     :param dump_dir: the root folder where to save articles
@@ -98,10 +144,16 @@ def parse_article(dump_dir, article_id, article_link, article_lang, html=None, a
     :param html: the html of the article, if already downloaded; if None, will download again
     :param article_config: newspaper3k configuration for downloading the article, see:
             https://newspaper.readthedocs.io/en/latest/user_guide/advanced.html#parameters-and-configurations
-    :return: None
+    :param phase: the download phase, recorded in the state index of `dump_dir`
+    :param save_html: whether to save the html, e.g., False if it is already saved
+    :param skip_identical: whether to reuse the output of a previous parse of byte-identical html, rather than parse
+           and save the html again
+    :return: the dict saved as json
     """
-    filepath = get_local_path_for_article(article_id=article_id, dump_dir=dump_dir, extension='.html')
-    pathlib.Path(os.path.dirname(filepath)).mkdir(parents=True, exist_ok=True)
+    from newspaper import Article
+
+    storage = get_storage(dump_dir)
+    state_index = get_state_index(dump_dir)
     article = Article(article_link, language=article_lang, config=article_config)
 
     if html is None:
@@ -112,9 +164,31 @@ def parse_article(dump_dir, article_id, article_link, article_lang, html=None, a
         article.html = html
         article.download_state = 2
 
-    with open(filepath, 'wb') as f:
-        f.write(article.html)
+    metrics = get_metrics()
+    metrics.observe('html_bytes', len(article.html), buckets=BYTES_BUCKETS, phase=str(phase))
+    content_hash = get_content_hash(article.html)
+    extractor_version = get_extractor_version(offline=article_config is not None and not article_config.fetch_images)
+    duplicate = state_index.find_by_content_hash(content_hash, article_id, extractor_version) \
+        if skip_identical else None
+    article_dict = read_article(duplicate['article_id'], dump_dir) if duplicate is not None else None
+    if article_dict is not None:
+        if duplicate['article_id'] != article_id:
+            # same page under another link: share the stored html, and only the fields derived from the link differ
+            article_dict.update(source_url=article.source_url, url=article.url)
+            storage.copy(duplicate['article_id'], article_id, '.html')
+            storage.write(article_id, '.json', json.dumps(article_dict).encode('utf8'))
+        state_index.record_success(article_id, phase, duplicate['text_length'], content_hash, extractor_version)
+        metrics.inc('articles_reused_total', phase=str(phase))
+        return article_dict
+
+    if save_html:
+        with metrics.timer('write_seconds', phase=str(phase)):
+            storage.write(article_id, '.html', article.html, url=article_link)
+    start = time.perf_counter()
     article.parse()
+    parse_seconds = time.perf_counter() - start
+    metrics.observe('parse_seconds', parse_seconds, phase=str(phase))
+    record_parse_time(get_article_domain(article_link), parse_seconds, article_link)
     article_dict = dict(source_url=article.source_url,
                         url=article.url,
                         title=article.title,
@@ -137,56 +211,175 @@ def parse_article(dump_dir, article_id, article_link, article_lang, html=None, a
                         canonical_link=article.canonical_link
                         )
 
-    filepath = get_local_path_for_article(article_id=article_id, dump_dir=dump_dir, extension='.json')
-    with open(filepath, 'w') as f:
-        f.write(json.dumps(article_dict))
+    with metrics.timer('write_seconds', phase=str(phase)):
+        storage.write(article_id, '.json', json.dumps(article_dict).encode('utf8'))
+    state_index.record_success(article_id, phase, len(article.text.strip()), content_hash, extractor_version)
+    metrics.observe('text_chars', len(article.text.strip()), buckets=CHARS_BUCKETS, phase=str(phase))
+    return article_dict
 
 
-def rescrape_original(args):
+def get_extractor_version(offline=False):
     """
-    scrapes an article
-    :param args: tuple `article_id, article_link, article_lang, article_config, dump_dir, retry_wait` where
-           retry_wait specifies how many seconds to wait after each requests, and the other parameters are defined in
-           `parse_article'
-    :return: None
+    :param offline: whether newspaper3k extracts without fetching images, as in `reparse`; `top_image` and the other
+           fields derived from images may then differ
+    :return: the version of the extraction of `parse_article`, recorded with each article, e.g., "1/newspaper3k-0.2.8",
+             or "1/newspaper3k-0.2.8+offline"
     """
-    article_id, article_link, article_lang, article_config, dump_dir, retry_wait = args
-    try:
-        parse_article(dump_dir, article_id, article_link, article_lang, html=None,
-                      article_config=article_config)
-    except Exception as e:
-        print(e)
-        print('cannot download from', article_link)
-    time.sleep(retry_wait)
+    # imported here, rather than reading the metadata of the distribution, which may be missing, when this module is
+    # imported
+    import newspaper
+    return '{}/newspaper3k-{}{}'.format(EXTRACTOR_FIELDS_VERSION, newspaper.__version__, '+offline' if offline else '')
 
 
-def rescrape_wayback(args):
+def get_rate_limit_key(url):
     """
-    scrapes an article from the waybackmachine, retrieving the latest archived copy
-    :param args: tuple `article_id, article_link, article_lang, article_config, dump_dir, retry_wait` where
-           retry_wait specifies how many seconds to wait after each requests, and the other parameters are defined in
-           `parse_article'
-    :return: None
+    maps a url to the rate limit it counts against: the internet archive limits CDX queries and snapshot downloads
+    separately, although both are served by web.archive.org
+    :param url: the url
+    :return: the host of the url, followed by the endpoint for CDX queries and snapshots
     """
-    article_id, article_link, article_lang, article_config, dump_dir, retry_wait = args
-    try:
-        # resolve the latest archived copy
-        # https://en.wikipedia.org/wiki/Help:Using_the_Wayback_Machine#Latest_archive_copy
-        wayback_prefix = 'https://web.archive.org/web/'
-        wayback_link = wayback_prefix + article_link
-        response = requests.head(wayback_link, allow_redirects=True)
-        # specify the version of the archived copy as "id_":
-        # id_ Identity - perform no alterations of the original resource, return it as it was archived.
-        # https://en.wikipedia.org/wiki/Help:Using_the_Wayback_Machine#Specific_archive_copy
-        wayback_link = response.url[:42] + 'id_' + response.url[42:]
-        rescrape_original((article_id, wayback_link, article_lang, article_config, dump_dir, retry_wait))
-    except Exception as e:
-        print(e)
-        print('cannot download from wayback url', wayback_link)
+    parsed = urlparse(url)
+    for endpoint in ('/cdx/', '/web/'):
+        if parsed.path.startswith(endpoint):
+            return parsed.netloc + endpoint.rstrip('/')
+    return parsed.netloc
 
 
-def main():
-    """console script for semeval_8_2022_ia_downloader; run with --help to read about the available runtime arguments.
+def get_endpoint(url):
+    """
+    classifies the requests of the downloader by the server that handles them
+    :param url: the URL of the request
+    :return: "cdx" for the CDX server, "web" for archived copies on the waybackmachine, "original" for the original
+             source website
+    """
+    key = get_rate_limit_key(url)
+    if key.endswith('/cdx'):
+        return 'cdx'
+    if key.endswith('/web'):
+        return 'web'
+    return 'original'
+
+
+def get_cdx_time_range(time_range):
+    """
+    formats a time range for CDX queries
+    :param time_range: a time or pair of times, in any of the formats accepted by the `WAYBACK_MACHINE_TIME_RANGE`
+           setting of scrapy-wayback-machine: datetime, unix timestamp, or timestamp YYYYmmddHHMMSS, possibly truncated
+    :return: pair of timestamps in the format YYYYmmddHHMMSS
+    """
+    if type(time_range) not in [tuple, list]:
+        time_range = (time_range, time_range)
+    timestamps = []
+    for time_ in time_range:
+        if isinstance(time_, datetime):
+            timestamps.append(time_.strftime(WAYBACK_TIMESTAMP_FORMAT))
+        elif 10 ** 8 < int(time_) < 10 ** 13:
+            timestamps.append(datetime.fromtimestamp(int(time_), timezone.utc).strftime(WAYBACK_TIMESTAMP_FORMAT))
+        else:
+            timestamps.append(str(int(time_)).ljust(14, '0'))
+    return tuple(timestamps)
+
+
+def get_cdx_link(article_link, time_range):
+    """
+    builds the CDX query listing the snapshots of a url that `get_first_snapshots` may select; the CDX server returns
+    them sorted by timestamp
+    https://github.com/internetarchive/wayback/tree/master/wayback-cdx-server#filtering
+    :param article_link: the URL of the article
+    :param time_range: pair of timestamps, see `get_cdx_time_range`
+    :return: the link of the CDX query
+    """
+    return CDX_ENDPOINT + '?' + urlencode([('url', article_link)] + get_cdx_params(time_range))
+
+
+def get_cdx_params(time_range):
+    """
+    :param time_range: pair of timestamps, see `get_cdx_time_range`
+    :return: list of query parameters for the CDX server, see `get_cdx_link`; the server drops redirects, which are
+             never downloaded, and the snapshots after the time range, but not those before it, as the snapshot live
+             when the time range starts is selected too
+    """
+    return [('output', 'json'), ('fl', 'timestamp,original,statuscode,digest'), ('filter', '!statuscode:3..'),
+            ('to', time_range[1])]
+
+
+def get_first_snapshots(snapshots, time_range, limit):
+    """
+    selects the snapshots to download from a CDX listing, as `FirstSnapshotMiddleware.filter_snapshots` does with the
+    rules of scrapy-wayback-machine: the snapshot live when the time range starts, if the url was captured again in
+    the time range, and the snapshots in the time range whose content changed; of these, the earliest HTTP 200 ones
+    :param snapshots: list of dicts mapping the fields of the CDX listing to their value, sorted by timestamp
+    :param time_range: pair of timestamps, see `get_cdx_time_range`
+    :param limit: the maximum number of snapshots to select
+    :return: list of the selected snapshots, earliest first
+    """
+    selected = []
+    initial_snapshot = None
+    last_digest = None
+    for snapshot in snapshots:
+        timestamp, status = snapshot['timestamp'], snapshot['statuscode']
+        # invalid timestamps, bot detections, e.g., status "-", and redirects, whose target is captured too
+        if len(timestamp) != 14 or not timestamp.isdigit() or len(status) != 3 or status.startswith('3'):
+            continue
+        if not selected:
+            if timestamp > time_range[0]:
+                if initial_snapshot is not None:
+                    selected.append(initial_snapshot)
+                    last_digest = initial_snapshot['digest']
+            else:
+                initial_snapshot = snapshot
+        if timestamp < time_range[0]:
+            continue
+        if timestamp > time_range[1]:
+            break
+        if snapshot['digest'] == last_digest:
+            continue
+        last_digest = snapshot['digest']
+        selected.append(snapshot)
+    return [snapshot for snapshot in selected if snapshot['statuscode'] == '200'][:limit]
+
+
+def get_wayback_link(article_link, timestamp=WAYBACK_LATEST_TIMESTAMP):
+    """
+    maps a url to the link of its archived copy closest to `timestamp`, in identity mode: "id_" returns the resource as
+    it was archived, without the alterations of the waybackmachine
+    https://en.wikipedia.org/wiki/Help:Using_the_Wayback_Machine#Specific_archive_copy
+    :param article_link: the URL of the article
+    :param timestamp: a timestamp in the format YYYYmmddHHMMSS, possibly truncated
+    :return: the link of the archived copy
+    """
+    return '{}{}id_/{}'.format(WAYBACK_PREFIX, timestamp, article_link)
+
+
+def get_wayback_timestamp(wayback_link):
+    """
+    parses the timestamp of an archived copy
+    :param wayback_link: the link of the archived copy, e.g., https://web.archive.org/web/20200101000000id_/<url>
+    :return: the timestamp of the archived copy as a string, or None if `wayback_link` is not a link to an archived copy
+    """
+    parsed = urlparse(wayback_link)
+    if parsed.netloc != urlparse(WAYBACK_PREFIX).netloc:
+        return None
+    match = WAYBACK_TIMESTAMP_PATTERN.search(parsed.path)
+    return match and match.group(1)
+
+
+def get_article_domain(article_link):
+    """
+    :param article_link: the URL of the article, or of its archived copy
+    :return: the host of the original source website, without "www."
+    """
+    if get_wayback_timestamp(article_link) is not None:
+        # the original url follows the timestamp and mode of the archived copy
+        path = urlparse(article_link).path
+        article_link = article_link[article_link.index(path) + WAYBACK_TIMESTAMP_PATTERN.search(path).end():]
+    host = urlparse(article_link).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def download(argv=None):
+    """downloads the articles listed in a links file; run with --help to read about the available runtime arguments.
+    :param argv: the command line arguments, by default `sys.argv[1:]`
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('--dump_dir', action="store", default="articles", help='dump folder path', required=False)
@@ -194,6 +387,14 @@ def main():
                         required=True,
                         metavar="INFILE")
 
+    parser.add_argument("--mode", action="store", default="phases", choices=["phases", "streaming"],
+                        help="""how to go through the sources of each article:
+                        - "phases": download all articles from the IA's CDX server first, then retry the missing ones
+                        from each fallback source in turn (see --retry)
+                        - "streaming": move each article through the fallback sources on its own, sharing one
+                        scheduler among all articles
+                        """,
+                        required=False)
     parser.add_argument("--retry", action="store", default="original",
                         help="""when articles are inaccessible from the IA, do:
                         - "original": try downloading from the original source URL
@@ -207,21 +408,88 @@ def main():
                         --retry=original and the article is inaccessible also from the original source""",
                         required=False)
     parser.add_argument("--retry_delay", action="store", default=3, type=int,
-                        help="how many seconds to wait after each requests if --retry=original",
+                        help="how many seconds to wait after each requests to the same host if --retry=original",
                         required=False)
     parser.add_argument("--retry_min_chars", action="store", default=50, type=int,
                         help="""include articles that have been downloaded, but for which the `text` entry in the
                          corresponding json file is at most `min_text_length` characters""",
                         required=False)
 
+    parser.add_argument("--resolve_concurrency", action="store", default=16, type=int,
+                        help="number of links from news aggregators (e.g., feedproxy.google.com) resolved in parallel",
+                        required=False)
+    parser.add_argument("--resolve_timeout", action="store", default=30, type=int,
+                        help="how many seconds to wait when resolving links from news aggregators",
+                        required=False)
+
+    parser.add_argument("--compression", action="store", default=None, choices=sorted(COMPRESSION_EXTENSIONS),
+                        help="""how to compress the files of the articles saved from now on; articles already saved
+                        are read whatever their compression (default: as set by the previous run on --dump_dir, else
+                        "none"); "zstd" requires the zstandard package""",
+                        required=False)
+    parser.add_argument("--zstd_dict", action="store", default=None,
+                        help="dictionary trained with `zstd --train` on sample articles, to compress with zstd",
+                        required=False)
+    parser.add_argument("--layout", action="store", default=None, choices=LAYOUTS,
+                        help="""how to save the articles from now on; articles already saved are read whatever their
+                        layout (default: as set by the previous run on --dump_dir, else "tree"):
+                        - "tree": two files per article, <id>.html and <id>.json, in dump_dir/<id[-2:]>/
+                        - "packed": raw html appended to WARC files, and parsed articles to JSON lines files, in
+                        dump_dir/packs/, indexed by article id in dump_dir/.state.sqlite3
+                        """,
+                        required=False)
+
     parser.add_argument("--log_level", action="store", default="INFO", help="scrapy log verbosity level",
                         required=False)
     parser.add_argument("--concurrent_requests", action="store", default=1, type=int,
-                        help="number of parallel requests",
+                        help="number of parallel requests (sockets)",
+                        required=False)
+    parser.add_argument("--per_host_concurrency", action="store", default=0, type=int,
+                        help="""number of parallel requests to the same host if --retry=original (default: as many as
+                        --concurrent_requests)""",
+                        required=False)
+    parser.add_argument("--parser_processes", action="store", default=0, type=int,
+                        help="number of processes parsing articles downloaded from the IA (default: one per core)",
                         required=False)
     parser.add_argument("--download_delay", action="store", default=1, type=int,
                         help="download delay between requests to the IA",
                         required=False)
+    parser.add_argument("--adaptive_throttle", action="store_true",
+                        help="""adapt the concurrency and delay of CDX queries, snapshot downloads and original sources
+                        to the responses: start from --concurrent_requests and --download_delay (--retry_delay in the
+                        retry phases), increase the concurrency additively while responses are fast, and halve it
+                        on 429 and 5xx errors and timeouts""",
+                        required=False)
+    parser.add_argument("--max_concurrent_requests", action="store", default=0, type=int,
+                        help="""hard ceiling of the concurrency with --adaptive_throttle (default: four times
+                        --concurrent_requests)""",
+                        required=False)
+    parser.add_argument("--crawl_processes", action="store", default=1, type=int,
+                        help="""number of scrapy crawler processes of Phase 1, each downloading its own partition of the
+                        articles; --concurrent_requests, --download_delay and --parser_processes are divided statically
+                        among them, so that they send as many requests to the IA as a single process, and with
+                        --adaptive_throttle each process adapts its own share to its own responses; the backoffs after
+                        429 errors are shared by all processes""",
+                        required=False)
+
+    parser.add_argument("--max_snapshots", action="store", default=3, type=int,
+                        help="""how many snapshots of each article to try in Phase 1, from the earliest one, before
+                        leaving the article to the retry phases""",
+                        required=False)
+
+    parser.add_argument("--content_types", action="store", default=','.join(DEFAULT_CONTENT_TYPES),
+                        help="""comma-separated media types downloaded as articles, matched as prefixes of the
+                        Content-Type header, or "" to download any; other responses are rejected before their body is
+                        downloaded, and not downloaded again""",
+                        required=False)
+    parser.add_argument("--max_size", action="store", default=DEFAULT_MAX_SIZE, type=int,
+                        help="""largest page downloaded as an article, in bytes, or 0 for no limit; larger responses
+                        are rejected as soon as their Content-Length, or the body read so far, exceeds it""",
+                        required=False)
+    parser.add_argument("--retry_rejected", action="store_true",
+                        help="""download again the articles rejected by previous runs, e.g., after changing
+                        --content_types or --max_size""",
+                        required=False)
 
     parser.add_argument("--user_agent", action="store",
                         default='semeval_8_2022_ia_downloader (+http://www.euagendas.org/semeval2022)',
@@ -229,119 +497,421 @@ def main():
                         help="user agent to identify the script with the IA and original source website",
                         required=False)
 
-    args = parser.parse_args()
+    parser.add_argument("--shard", action="store", default=None, type=parse_shard,
+                        help="""download only shard i out of N, e.g., 0/4 to 3/4 on four machines, each with its own
+                        --dump_dir; articles are assigned to shards by a hash of their id, before any link is resolved,
+                        and the dump folders of all shards are combined with the `merge` command""",
+                        required=False)
+    parser.add_argument("--metrics_interval", action="store", default=30, type=int,
+                        help="""how many seconds between writes of the counters and latency histograms of the run to
+                        dump_dir/.metrics.json and, in the Prometheus textfile format, dump_dir/.metrics.prom""",
+                        required=False)
+    parser.add_argument("--profile", action="store_true",
+                        help="""profile the main process, including the scrapy reactor and the downloader threads of
+                        the retry phases and streaming mode, every crawler process (--crawl_processes) and every parser
+                        process, and time the parsing of each website; the report is written to
+                        dump_dir/profile.txt""",
+                        required=False)
+
+    args = parser.parse_args(argv)
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    from semeval_8_2022_ia_downloader.plan import load_plan, materialize_aliases
+
     retry_strategy = args.retry
     retry_wait = args.retry_delay
     retry_log = args.retry_log
     min_text_length = args.retry_min_chars
 
-    article_config = Config()
-    article_config.browser_user_agent = args.user_agent
-    article_config.request_timeout = 60
-
     pathlib.Path(args.dump_dir).mkdir(parents=True, exist_ok=True)
+    configure_storage(args.dump_dir, args.compression, args.zstd_dict, args.layout)
+    if args.retry_rejected:
+        print('forgot', get_state_index(args.dump_dir).clear_rejections(), 'rejected articles')
+    content_types = parse_content_types(args.content_types)
+    if args.profile:
+        # before any worker process is started, so that they profile themselves too
+        enable_profiling(args.dump_dir)
+    # counters and latency histograms of the run, for tuning concurrency
+    metrics_writer = MetricsWriter(os.path.join(args.dump_dir, METRICS_FILENAME), args.metrics_interval).start()
+
+    print('Planning: compiling', args.links_file)
+    load_plan(args.links_file, args.dump_dir, concurrency=args.resolve_concurrency, timeout=args.resolve_timeout,
+              shard=args.shard, resolve=True)
 
-    print('Phase 1: scrape after querying the internet archive\'s CDX server')
     # The path seen from root, ie. from main.py
     settings_file_path = 'semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.settings'
     os.environ.setdefault('SCRAPY_SETTINGS_MODULE', settings_file_path)
+    crawl_settings = {
+        'LOG_LEVEL': args.log_level,
+        'CONCURRENT_REQUESTS': args.concurrent_requests,
+        'DOWNLOAD_DELAY': args.download_delay,
+        'USER_AGENT': args.user_agent,
+        'PARSER_PROCESSES': args.parser_processes,
+        'WAYBACK_MACHINE_MAX_SNAPSHOTS': args.max_snapshots,
+        'ARTICLE_CONTENT_TYPES': content_types,
+        'ARTICLE_MAX_SIZE': args.max_size,
+    }
+    throttle = None
+    if args.adaptive_throttle:
+        # imported here, as only adaptive throttling needs it
+        from semeval_8_2022_ia_downloader.throttle import AimdController
+        # of the retry phases and streaming mode, where the original websites keep their politeness delay
+        throttle = AimdController(args.concurrent_requests, delay=retry_wait,
+                                  max_concurrency=args.max_concurrent_requests or None,
+                                  min_delays={'original': retry_wait})
+        # the downloader slots of Phase 1 start from --concurrent_requests, and the engine allows up to the ceiling
+        crawl_settings.update({
+            'ADAPTIVE_THROTTLE_ENABLED': True,
+            'ADAPTIVE_THROTTLE_START_CONCURRENCY': args.concurrent_requests,
+            'ADAPTIVE_THROTTLE_MAX_CONCURRENCY': throttle.max_concurrency,
+            'CONCURRENT_REQUESTS': throttle.max_concurrency,
+            'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrent_requests,
+        })
     scrapy_settings = get_project_settings()
-    scrapy_settings.set('LOG_LEVEL', args.log_level)
-    scrapy_settings.set('CONCURRENT_REQUESTS', args.concurrent_requests)
-    scrapy_settings.set('DOWNLOAD_DELAY', args.download_delay)
-    scrapy_settings.set('USER_AGENT', args.user_agent)
-
-    process = CrawlerProcess(scrapy_settings)
-    process.crawl('IaArticle', links_file=args.links_file,
-                  dump_dir=args.dump_dir,
-                  min_text_length=args.retry_min_chars
-                  )
-    process.start()  # the script will block here until the crawling is finished
+    scrapy_settings.setdict(crawl_settings)
+
+    # imported here, as the fetch engine parses articles with the functions of this module
+    from semeval_8_2022_ia_downloader.fetcher import FetchEngine, SOURCE_WAYBACK, SOURCE_ORIGINAL, STEP_CDX, \
+        STEP_WAYBACK, STEP_WAYBACK_NOQUERY, STEP_ORIGINAL
+
+    # articles are downloaded over keep-alive connections, and parsed in a pool of worker processes
+    fetch_engine = FetchEngine(args.dump_dir,
+                               concurrency=args.concurrent_requests,
+                               per_host_concurrency=args.per_host_concurrency,
+                               delay=retry_wait,
+                               parser_processes=args.parser_processes,
+                               user_agent=args.user_agent,
+                               timeout=REQUEST_TIMEOUT,
+                               languages=sorted(load_plan(args.links_file, args.dump_dir,
+                                                          shard=args.shard)['lang'].dropna().unique()),
+                               throttle=throttle,
+                               content_types=content_types,
+                               max_size=args.max_size)
+
+    if args.mode == 'streaming':
+        print('Streaming: download each article from the first source of the fallback chain that works')
+        steps = [STEP_CDX]
+        if retry_strategy == 'original':
+            steps += [STEP_WAYBACK, STEP_WAYBACK_NOQUERY, STEP_ORIGINAL]
+        with get_metrics().stopwatch('phase_seconds_total', phase='streaming'):
+            fetch_engine.run_chain(list(get_remaining_articles(args.links_file, args.dump_dir, min_text_length,
+                                                               args.shard)),
+                                   steps,
+                                   cdx_time_range=get_cdx_time_range(scrapy_settings.get('WAYBACK_MACHINE_TIME_RANGE')),
+                                   max_snapshots=args.max_snapshots,
+                                   min_text_length=min_text_length,
+                                   desc='downloading articles')
+    else:
+        print('Phase 1: scrape after querying the internet archive\'s CDX server')
+        spider_kwargs = dict(links_file=args.links_file,
+                             dump_dir=args.dump_dir,
+                             min_text_length=args.retry_min_chars,
+                             shard=args.shard
+                             )
+        if args.crawl_processes > 1:
+            # imported here, as only crawling in several processes needs it
+            from semeval_8_2022_ia_downloader.crawl import crawl_partitions
+            total = sum(1 for _ in get_remaining_articles(args.links_file, args.dump_dir, min_text_length, args.shard))
+            with get_metrics().stopwatch('phase_seconds_total', phase='cdx'):
+                crawl_stats = crawl_partitions(crawl_settings, spider_kwargs, args.crawl_processes, total=total)
+            print('crawled', {key: crawl_stats[key] for key in sorted(crawl_stats)
+                              if key.startswith(('item_', 'response_', 'downloader/response_status_count'))})
+        else:
+            process = CrawlerProcess(scrapy_settings)
+            process.crawl('IaArticle', **spider_kwargs)
+            with get_metrics().stopwatch('phase_seconds_total', phase='cdx'):
+                process.start()  # the script will block here until the crawling is finished
 
     if retry_strategy == 'ignore':
         # terminate here if there is no wish to attempt re-downloading missing articles
         pass
     elif retry_strategy == 'original':
-        # otherwise, try logging or downloading articles again
-        print('Phase 2: rescrape using the internet archive\'s /web/ endpoint')
-
-        # try scraping from wayback
-        remaining_articles = list(get_remaining_articles(args.links_file,
-                                                         args.dump_dir,
-                                                         min_text_length))
-        wayback_pool = Pool(processes=args.concurrent_requests)
-        for _ in tqdm.tqdm(wayback_pool.imap_unordered(rescrape_wayback, [(article_id,
-                                                                           article_link,
-                                                                           article_lang,
-                                                                           article_config,
-                                                                           args.dump_dir,
-                                                                           retry_wait) for (article_id,
-                                                                                            article_link,
-                                                                                            article_lang) in
-                                                                          remaining_articles]),
-                           desc='downloading inaccessible articles from the web archive',
-                           total=len(remaining_articles)):
-            pass
-        wayback_pool.close()
-        wayback_pool.join()
-
-        print('Phase 3: rescrape using the internet archive\'s /web/ endpoint, after stripping url query parameters')
-        # try scraping from wayback, stripping query parameters
-        remaining_articles = list(map(lambda x: (x[0], urljoin(x[1], urlparse(x[1]).path), x[2]),
-                                      filter(lambda x: len(urlparse(x[1]).query) > 0,
-                                             get_remaining_articles(args.links_file,
-                                                                    args.dump_dir,
-                                                                    min_text_length))))
-        wayback_noquery_pool = Pool(processes=args.concurrent_requests)
-        for _ in tqdm.tqdm(wayback_noquery_pool.imap_unordered(rescrape_wayback, [(article_id,
-                                                                                   article_link,
-                                                                                   article_lang,
-                                                                                   article_config,
-                                                                                   args.dump_dir,
-                                                                                   retry_wait) for (article_id,
-                                                                                                    article_link,
-                                                                                                    article_lang) in
-                                                                                  remaining_articles]),
-                           desc='downloading articles without query parameters from the web archive',
-                           total=len(remaining_articles)):
-            pass
-        wayback_noquery_pool.close()
-        wayback_noquery_pool.join()
-
-        # try scraping from the original source
-        print('Phase 4: rescrape from the original source')
-        remaining_articles = list(get_remaining_articles(args.links_file,
-                                                         args.dump_dir,
-                                                         min_text_length))
-        original_pool = Pool(processes=args.concurrent_requests)
-        for _ in tqdm.tqdm(original_pool.imap_unordered(rescrape_original, [(article_id,
-                                                                             article_link,
-                                                                             article_lang,
-                                                                             article_config,
-                                                                             args.dump_dir,
-                                                                             retry_wait) for (article_id,
-                                                                                              article_link,
-                                                                                              article_lang) in
-                                                                            remaining_articles]),
-                           desc='downloading inaccessible articles from the original source',
-                           total=len(remaining_articles)):
-            pass
-        original_pool.close()
-        original_pool.join()
+        if args.mode != 'streaming':
+            # otherwise, try logging or downloading articles again
+            print('Phase 2: rescrape using the internet archive\'s /web/ endpoint')
+
+            # try scraping from wayback
+            remaining_articles = [(article_id, article_link, article_lang, 'wayback')
+                                  for article_id, article_link, article_lang in get_remaining_articles(
+                                      args.links_file, args.dump_dir, min_text_length, args.shard)]
+            with get_metrics().stopwatch('phase_seconds_total', phase='wayback'):
+                fetch_engine.run(remaining_articles, SOURCE_WAYBACK,
+                                 desc='downloading inaccessible articles from the web archive')
+
+            print('Phase 3: rescrape using the internet archive\'s /web/ endpoint, after stripping url query '
+                  'parameters')
+            # try scraping from wayback, stripping query parameters
+            remaining_articles = [(article_id, urljoin(article_link, urlparse(article_link).path), article_lang,
+                                   'wayback_noquery')
+                                  for article_id, article_link, article_lang in get_remaining_articles(
+                                      args.links_file, args.dump_dir, min_text_length, args.shard)
+                                  if len(urlparse(article_link).query) > 0]
+            with get_metrics().stopwatch('phase_seconds_total', phase='wayback_noquery'):
+                fetch_engine.run(remaining_articles, SOURCE_WAYBACK,
+                                 desc='downloading articles without query parameters from the web archive')
+
+            # try scraping from the original source
+            print('Phase 4: rescrape from the original source')
+            remaining_articles = [(article_id, article_link, article_lang, 'original')
+                                  for article_id, article_link, article_lang in get_remaining_articles(
+                                      args.links_file, args.dump_dir, min_text_length, args.shard)]
+            with get_metrics().stopwatch('phase_seconds_total', phase='original'):
+                fetch_engine.run(remaining_articles, SOURCE_ORIGINAL,
+                                 desc='downloading inaccessible articles from the original source')
 
         # log missing articles
-        missing_links = [link for _, link, _ in get_remaining_articles(args.links_file, args.dump_dir, 0)]
+        missing_links = [link for _, link, _ in get_remaining_articles(args.links_file, args.dump_dir, 0, args.shard)]
         with open(retry_log, 'w+', encoding='utf-8') as f:
             f.write('\n'.join(missing_links))
 
     elif retry_strategy == 'log':
         print('logging inaccessible articles to', retry_log)
         remaining_links = [article_link
-                           for _, article_link, _ in get_remaining_articles(args.links_file, args.dump_dir)]
+                           for _, article_link, _ in get_remaining_articles(args.links_file, args.dump_dir,
+                                                                            shard=args.shard)]
         with open(retry_log, 'a+', encoding='utf-8') as f:
             f.write('\n'.join(remaining_links))
+
+    # articles that share their link with an earlier article were not downloaded, but are stored from its download
+    aliases = materialize_aliases(load_plan(args.links_file, args.dump_dir, shard=args.shard), args.dump_dir)
+    print('stored', aliases, 'articles sharing their link with another article')
+    metrics_writer.stop()
+    if args.profile:
+        print('profile written to', write_report(args.dump_dir))
+    return 0
+
+
+def convert(argv=None):
+    """rewrites the articles of a dump folder with another layout or compression, in place.
+    :param argv: the command line arguments, by default `sys.argv[2:]`
+    """
+    parser = argparse.ArgumentParser(prog='semeval_8_2022_ia_downloader convert')
+    parser.add_argument('--dump_dir', action="store", default="articles", help='dump folder path', required=False)
+    parser.add_argument("--layout", action="store", default=None, choices=LAYOUTS,
+                        help="the layout to convert to (default: unchanged)", required=False)
+    parser.add_argument("--compression", action="store", default=None, choices=sorted(COMPRESSION_EXTENSIONS),
+                        help="the compression to convert to (default: unchanged)", required=False)
+    parser.add_argument("--zstd_dict", action="store", default=None,
+                        help="dictionary trained with `zstd --train` on sample articles, to compress with zstd",
+                        required=False)
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the articles in their previous layout, rather than deleting them once converted",
+                        required=False)
+    args = parser.parse_args(argv)
+    import tqdm
+
+    configure_storage(args.dump_dir, args.compression, args.zstd_dict, args.layout)
+    storage = get_storage(args.dump_dir)
+    converted = 0
+    for article_id in tqdm.tqdm(list(storage.iter_article_ids('.json')), desc='converting articles'):
+        url = None
+        for extension in ['.json', '.html']:
+            data = storage.read(article_id, extension)
+            if extension == '.json' and data is not None:
+                # recorded with the raw html in the packed layout
+                url = json.loads(data).get('url')
+            located = storage.locate(article_id, extension)
+            if data is None or located is not None and located[1] == storage.compression:
+                # missing, or already stored with the new layout and compression
+                continue
+            storage.write(article_id, extension, data, url=url)
+            if not args.keep:
+                storage.fallback.delete(article_id, extension)
+        converted += 1
+    print('converted', converted, 'articles in', args.dump_dir)
     return 0
 
 
+def reparse(argv=None):
+    """extracts the articles again from the html saved in a dump folder, in parallel and without any network access.
+    :param argv: the command line arguments, by default `sys.argv[2:]`
+    """
+    parser = argparse.ArgumentParser(prog='semeval_8_2022_ia_downloader reparse')
+    parser.add_argument('--dump_dir', action="store", default="articles", help='dump folder path', required=False)
+    parser.add_argument("--links_file", action="store", default="sample_data.csv",
+                        help="File listing the articles, for their language", required=True, metavar="INFILE")
+    parser.add_argument("--parser_processes", action="store", default=0, type=int,
+                        help="number of processes parsing articles (default: one per core)", required=False)
+    parser.add_argument("--force", action="store_true",
+                        help="""extract all articles, including those whose html and extractor version did not change
+                        since their last extraction""",
+                        required=False)
+    parser.add_argument("--profile", action="store_true",
+                        help="""profile every parser process, and time the parsing of each website; the report is
+                        written to dump_dir/profile.txt""",
+                        required=False)
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable_profiling(args.dump_dir)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    import tqdm
+
+    from semeval_8_2022_ia_downloader.plan import build_plan
+    # imported here, as the workers parse articles with the functions of this module
+    from semeval_8_2022_ia_downloader.workers import init_worker, reparse_article_task
+
+    # links from news aggregators are not resolved, as they are only used when the saved article lacks its url
+    plan = build_plan(args.links_file)
+    stored_ids = set(get_storage(args.dump_dir).iter_article_ids('.html'))
+    tasks = [(args.dump_dir, article_id, article_link, article_lang, args.force)
+             for article_id, article_link, article_lang in plan[['article_id', 'link', 'lang']].itertuples(
+                 index=False, name=None)
+             if article_id in stored_ids]
+    languages = sorted(plan['lang'].dropna().unique())
+    outcomes = Counter()
+    with ProcessPoolExecutor(max_workers=args.parser_processes or os.cpu_count(), initializer=init_worker,
+                             initargs=(languages,)) as executor:
+        for outcome, metrics in tqdm.tqdm(executor.map(reparse_article_task, tasks, chunksize=16), total=len(tasks),
+                                          desc='reparsing articles'):
+            outcomes[outcome] += 1
+            get_metrics().merge(metrics)
+    print('reparsed', dict(outcomes), 'with extractor', get_extractor_version(offline=True))
+    write_metrics(os.path.join(args.dump_dir, METRICS_FILENAME + '-reparse'))
+    if args.profile:
+        print('profile written to', write_report(args.dump_dir))
+    return 0
+
+
+def export(argv=None):
+    """exports the articles of a dump folder, and optionally the pairs of the input file, to columnar files.
+    :param argv: the command line arguments, by default `sys.argv[2:]`
+    """
+    # imported here, as exporting requires the optional pyarrow package
+    from semeval_8_2022_ia_downloader.export import ARTICLE_FIELDS, DEFAULT_FIELDS, FORMATS, FORMAT_PARQUET, \
+        export_articles, export_pairs
+
+    parser = argparse.ArgumentParser(prog='semeval_8_2022_ia_downloader export')
+    parser.add_argument('--dump_dir', action="store", default="articles", help='dump folder path', required=False)
+    parser.add_argument("--links_file", action="store", default="sample_data.csv", help="File listing the articles",
+                        required=True, metavar="INFILE")
+    parser.add_argument("--output", action="store", default="articles.parquet",
+                        help="path to the exported articles, one row per article", required=False)
+    parser.add_argument("--pairs_output", action="store", default=None,
+                        help="""path to the exported pairs of --links_file, with their similarity columns and the row
+                        of each of their articles in --output (default: do not export pairs)""",
+                        required=False)
+    parser.add_argument("--format", action="store", default=FORMAT_PARQUET, choices=FORMATS,
+                        help="""format of the exported files: "parquet", or "arrow" for the Arrow IPC file format,
+                        which readers can memory-map""",
+                        required=False)
+    parser.add_argument("--fields", action="store", default=','.join(DEFAULT_FIELDS),
+                        help="comma-separated fields of the articles to export, among: {}".format(
+                            ', '.join(ARTICLE_FIELDS)),
+                        required=False)
+    parser.add_argument("--batch_size", action="store", default=1000, type=int,
+                        help="number of articles held in memory at a time", required=False)
+    args = parser.parse_args(argv)
+
+    rows = export_articles(args.links_file, args.dump_dir, args.output, fields=args.fields.split(','),
+                           file_format=args.format, batch_size=args.batch_size)
+    print('exported', len(rows), 'articles to', args.output)
+    if args.pairs_output is not None:
+        count = export_pairs(args.links_file, args.pairs_output, rows, file_format=args.format)
+        print('exported', count, 'pairs to', args.pairs_output)
+    return 0
+
+
+def status(argv=None):
+    """counts the downloaded, short, failed and missing articles of a dump folder, per language and website, from its
+    state database alone, e.g., for monitoring a running download.
+    :param argv: the command line arguments, by default `sys.argv[2:]`
+    """
+    parser = argparse.ArgumentParser(prog='semeval_8_2022_ia_downloader status')
+    parser.add_argument('--dump_dir', action="store", default="articles", help='dump folder path', required=False)
+    parser.add_argument("--by", action="store", default="lang",
+                        help="""comma-separated columns to count articles by, among "lang" and "domain", or "" for the
+                        totals only""",
+                        required=False)
+    parser.add_argument("--min_chars", action="store", default=50, type=int,
+                        help="""count downloaded articles whose `text` is at most `min_chars` characters as short, as
+                        with --retry_min_chars""",
+                        required=False)
+    parser.add_argument("--limit", action="store", default=0, type=int,
+                        help="number of rows to print, largest first (default: all)", required=False)
+    parser.add_argument("--json", action="store_true", help="print the counts as json lines", required=False)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(os.path.join(args.dump_dir, STATE_FILENAME)):
+        print('no download state in', args.dump_dir, file=sys.stderr)
+        return 1
+    group_by = [column for column in args.by.split(',') if column]
+    rows = get_plan_index(args.dump_dir).get_status_counts(group_by, args.min_chars)
+    if not rows or not rows[0]['total']:
+        print('no plan in', args.dump_dir, '- run a download first', file=sys.stderr)
+        return 1
+    count_columns = ['total', 'downloaded', 'short_text', 'failed', 'rejected', 'missing']
+    if group_by:
+        totals = {column: 'total' for column in group_by}
+        totals.update({column: sum(row[column] for row in rows) for column in count_columns})
+        rows = rows[:args.limit or len(rows)] + [totals]
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+        return 0
+    row_format = ''.join('{{:<{}}} '.format(40 if column == 'domain' else 8) for column in group_by) + \
+        ' '.join('{:>10}' for _ in count_columns)
+    print(row_format.format(*group_by, *count_columns))
+    for row in rows:
+        print(row_format.format(*[str(row[column]) for column in group_by], *[row[column] for column in count_columns]))
+    return 0
+
+
+def merge(argv=None):
+    """merges the dump folders of the shards of a links file, see --shard, and their failure logs, into a single dump
+    folder; files are hard linked rather than copied where possible, and articles merged before are left as is.
+    :param argv: the command line arguments, by default `sys.argv[2:]`
+    """
+    # imported here, as only merging needs it
+    from semeval_8_2022_ia_downloader.merge import merge_dump, merge_retry_logs
+
+    parser = argparse.ArgumentParser(prog='semeval_8_2022_ia_downloader merge')
+    parser.add_argument('--dump_dir', action="store", default="articles", help='path of the merged dump folder',
+                        required=False)
+    parser.add_argument("--shard_dirs", action="store", nargs='+', required=True,
+                        help="the dump folders of the shards, merged in this order")
+    parser.add_argument("--retry_logs", action="store", nargs='*', default=[],
+                        help="the failure logs of the shards, see --retry_log of the download", required=False)
+    parser.add_argument("--retry_log", action="store", default="inaccessible_urls.csv",
+                        help="path of the merged failure log, written if --retry_logs are given", required=False)
+    args = parser.parse_args(argv)
+
+    totals = Counter()
+    for shard_dir in args.shard_dirs:
+        if not os.path.exists(os.path.join(shard_dir, STATE_FILENAME)):
+            print('no download state in', shard_dir, file=sys.stderr)
+            return 1
+        outcomes = merge_dump(shard_dir, args.dump_dir)
+        print('merged', shard_dir, dict(outcomes))
+        totals.update(outcomes)
+    print('merged', len(args.shard_dirs), 'dump folders into', args.dump_dir, dict(totals))
+    if args.retry_logs:
+        count = merge_retry_logs(args.retry_logs, args.retry_log)
+        print('merged', count, 'inaccessible links into', args.retry_log)
+    return 0
+
+
+# subcommands, run as `semeval_8_2022_ia_downloader <command> ...`; without a subcommand, articles are downloaded
+COMMANDS = {
+    'download': download,
+    'convert': convert,
+    'reparse': reparse,
+    'export': export,
+    'status': status,
+    'merge': merge,
+}
+
+
+def main():
+    """console script for semeval_8_2022_ia_downloader; run with --help to read about the available runtime arguments,
+    or with `<command> --help` for the commands in `COMMANDS`.
+    """
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+    return download(sys.argv[1:])
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
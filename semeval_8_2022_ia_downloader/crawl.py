@@ -0,0 +1,139 @@
+"""Phase 1 over several scrapy crawler processes, each with its own reactor, downloading a partition of the articles."""
+import multiprocessing
+import os
+import queue
+from collections import Counter
+
+from tqdm import tqdm
+
+from semeval_8_2022_ia_downloader.metrics import get_metrics
+from semeval_8_2022_ia_downloader.profiling import start_profiler, stop_profiler
+
+# messages sent by the crawler processes to the supervisor: their stats and metrics while they run, and once they end
+MESSAGE_PROGRESS = 'progress'
+MESSAGE_DONE = 'done'
+
+# how many seconds between the messages of each crawler process
+REPORT_INTERVAL = 1
+
+
+def get_partition_settings(settings, processes):
+    """
+    divides the rate budget of the run among the crawler processes, so that together they send as many requests, as
+    often, as a single process would
+
+    the split is static: each process keeps its own share of CONCURRENT_REQUESTS and DOWNLOAD_DELAY, and with adaptive
+    throttling its own controller, which only sees its own responses; only the backoffs after 429 errors are shared, so
+    that a 429 hit by any process holds back the others, see `middlewares.TooManyRequestsRetryMiddleware`
+    :param settings: dict of the scrapy settings of the run
+    :param processes: the number of crawler processes
+    :return: dict of the scrapy settings of each crawler process
+    """
+    settings = dict(settings)
+    settings['CONCURRENT_REQUESTS'] = max(1, settings.get('CONCURRENT_REQUESTS', 1) // processes)
+    settings['DOWNLOAD_DELAY'] = settings.get('DOWNLOAD_DELAY', 0) * processes
+    settings['PARSER_PROCESSES'] = max(1, (settings.get('PARSER_PROCESSES') or os.cpu_count()) // processes)
+    for name in ['CONCURRENT_REQUESTS_PER_DOMAIN', 'ADAPTIVE_THROTTLE_START_CONCURRENCY',
+                 'ADAPTIVE_THROTTLE_MAX_CONCURRENCY']:
+        if settings.get(name):
+            settings[name] = max(1, settings[name] // processes)
+    settings['SHARED_BACKOFF'] = True
+    return settings
+
+
+def get_numeric_stats(stats):
+    """
+    :param stats: the stats of a crawler, see `scrapy.statscollectors.StatsCollector.get_stats`
+    :return: dict of the numeric stats, which can be added over crawler processes
+    """
+    return {key: value for key, value in stats.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+
+def run_partition(index, processes, settings, spider_kwargs, messages):
+    """
+    runs the spider on partition `index` of the remaining articles; runs in a crawler process
+    :param index: the partition, from 0 to `processes - 1`, see `plan.get_partition`
+    :param processes: the number of crawler processes
+    :param settings: dict of the scrapy settings of the crawler process, see `get_partition_settings`
+    :param spider_kwargs: the arguments of the spider, besides its partition
+    :param messages: queue of the messages to the supervisor, see `crawl_partitions`
+    :return: None
+    """
+    start_profiler('crawler')
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    scrapy_settings = get_project_settings()
+    scrapy_settings.setdict(settings)
+    process = CrawlerProcess(scrapy_settings)
+    crawler = process.create_crawler('IaArticle')
+
+    def report(message=MESSAGE_PROGRESS):
+        stats = crawler.stats.get_stats() if crawler.stats is not None else {}
+        messages.put((message, index, get_numeric_stats(stats), get_metrics().drain()))
+
+    # imported once the crawler process has installed its reactor
+    from twisted.internet import task
+    reporter = task.LoopingCall(report)
+    reporter.start(REPORT_INTERVAL, now=False)
+    process.crawl(crawler, partition=(index, processes), **spider_kwargs)
+    try:
+        process.start()
+    finally:
+        if reporter.running:
+            reporter.stop()
+        report(MESSAGE_DONE)
+        stop_profiler()
+
+
+def crawl_partitions(settings, spider_kwargs, processes, total=None):
+    """
+    runs the spider in `processes` crawler processes, each on its own partition of the remaining articles, and
+    supervises them: their stats are shown as a single progress bar, and their metrics added to those of this process
+    :param settings: dict of the scrapy settings of the run, divided among the crawler processes, see
+           `get_partition_settings`
+    :param spider_kwargs: the arguments of the spider, besides its partition
+    :param processes: the number of crawler processes
+    :param total: the number of articles to download, for the progress bar
+    :return: dict of the numeric stats, added over all crawler processes
+    """
+    # spawned rather than forked, as each crawler process installs a reactor of its own
+    context = multiprocessing.get_context('spawn')
+    messages = context.Queue()
+    partition_settings = get_partition_settings(settings, processes)
+    workers = [context.Process(target=run_partition, args=(index, processes, partition_settings, spider_kwargs,
+                                                           messages), name='crawler-{}'.format(index))
+               for index in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    stats = [{} for _ in workers]
+    done = set()
+    progress = tqdm(total=total, desc='downloading articles with {} crawler processes'.format(processes))
+    while len(done) < len(workers):
+        try:
+            message, index, worker_stats, metrics = messages.get(timeout=REPORT_INTERVAL)
+        except queue.Empty:
+            # crawler processes that died without saying so, e.g., killed
+            done.update(index for index, worker in enumerate(workers) if not worker.is_alive() and
+                        worker.exitcode != 0)
+            continue
+        get_metrics().merge(metrics)
+        stats[index] = worker_stats
+        if message == MESSAGE_DONE:
+            done.add(index)
+        scraped = sum(s.get('item_scraped_count', 0) for s in stats)
+        progress.update(scraped - progress.n)
+        progress.set_postfix(responses=sum(s.get('response_received_count', 0) for s in stats),
+                             errors=sum(s.get('log_count/ERROR', 0) for s in stats))
+    progress.close()
+    for index, worker in enumerate(workers):
+        worker.join()
+        if worker.exitcode != 0:
+            print('crawler process', index, 'exited with code', worker.exitcode)
+
+    totals = Counter()
+    for worker_stats in stats:
+        totals.update(worker_stats)
+    return dict(totals)
@@ -0,0 +1,211 @@
+"""Export of the downloaded articles, and of the pairs that they belong to, to columnar files."""
+import json
+
+import pandas as pd
+
+from semeval_8_2022_ia_downloader.plan import build_plan
+from semeval_8_2022_ia_downloader.state import get_state_index
+from semeval_8_2022_ia_downloader.storage import get_storage
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # exporting is optional
+    pyarrow = None
+
+FORMAT_PARQUET = 'parquet'
+# the Arrow IPC file format, which readers can memory-map
+FORMAT_ARROW = 'arrow'
+FORMATS = [FORMAT_PARQUET, FORMAT_ARROW]
+
+# the fields of the dict saved as json by `cli.parse_article`, with their type: "string", "list" of strings, or "json"
+# for dicts, which are exported as json strings
+ARTICLE_FIELDS = {
+    'source_url': 'string',
+    'url': 'string',
+    'title': 'string',
+    'top_image': 'string',
+    'meta_img': 'string',
+    'images': 'list',
+    'movies': 'list',
+    'text': 'string',
+    'keywords': 'list',
+    'meta_keywords': 'list',
+    'tags': 'list',
+    'authors': 'list',
+    'publish_date': 'string',
+    'summary': 'string',
+    'article_html': 'string',
+    'meta_description': 'string',
+    'meta_lang': 'string',
+    'meta_favicon': 'string',
+    'meta_data': 'json',
+    'canonical_link': 'string',
+}
+DEFAULT_FIELDS = ['url', 'title', 'text', 'authors', 'publish_date', 'keywords', 'meta_description', 'meta_lang',
+                  'canonical_link']
+
+# the columns of the input file that describe the articles rather than their similarity
+PAIR_ARTICLE_COLUMNS = ['pair_id', 'lang1', 'lang2', 'link1', 'link2', 'url1_lang', 'url2_lang']
+
+
+def check_pyarrow():
+    if pyarrow is None:
+        raise ImportError('exporting requires the pyarrow package: pip install pyarrow')
+
+
+def get_articles_schema(fields):
+    """
+    :param fields: the fields of the articles to export, among `ARTICLE_FIELDS`
+    :return: the `pyarrow.Schema` of the exported articles
+    """
+    types = {'string': pyarrow.string(), 'list': pyarrow.list_(pyarrow.string()), 'json': pyarrow.string()}
+    return pyarrow.schema([('article_id', pyarrow.string()), ('lang', pyarrow.string()), ('link', pyarrow.string()),
+                           ('phase', pyarrow.string())] +
+                          [(field, types[ARTICLE_FIELDS[field]]) for field in fields])
+
+
+class TableWriter:
+    """
+    writes record batches to a parquet or Arrow IPC file, so that the exported table never needs to fit in memory
+    """
+
+    def __init__(self, path, schema, file_format=FORMAT_PARQUET):
+        self.schema = schema
+        if file_format == FORMAT_PARQUET:
+            self.writer = pyarrow.parquet.ParquetWriter(path, schema, compression='zstd')
+        else:
+            self.writer = pyarrow.ipc.new_file(path, schema)
+
+    def write(self, columns):
+        """
+        :param columns: dict mapping each column of the schema to a list of values
+        :return: None
+        """
+        self.writer.write_batch(pyarrow.record_batch([columns[name] for name in self.schema.names],
+                                                     schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def iter_article_batches(location, dump_dir, fields, batch_size):
+    """
+    reads the parsed articles of `dump_dir`, in the order in which they appear in the input file
+    :param location: the path to the input file
+    :param dump_dir: the root folder where articles are saved
+    :param fields: the fields of the articles to export, among `ARTICLE_FIELDS`
+    :param batch_size: how many articles to read at a time
+    :return: generator of dicts mapping each column of `get_articles_schema` to `batch_size` values, at most
+    """
+    storage = get_storage(dump_dir)
+    state_index = get_state_index(dump_dir)
+    stored_ids = set(storage.iter_article_ids('.json'))
+    # links from news aggregators are not resolved, as the saved articles record their own url
+    plan = build_plan(location)
+    columns = None
+    for article_id, article_link, article_lang in plan[['article_id', 'link', 'lang']].itertuples(
+            index=False, name=None):
+        if article_id not in stored_ids:
+            continue
+        try:
+            article_dict = json.loads(storage.read(article_id, '.json'))
+        except (TypeError, ValueError, OSError, EOFError) as e:
+            print(e)
+            print('cannot read', article_id)
+            continue
+        if columns is None:
+            columns = {name: [] for name in ['article_id', 'lang', 'link', 'phase'] + fields}
+        state = state_index.get(article_id) or {}
+        columns['article_id'].append(article_id)
+        columns['lang'].append(article_lang if isinstance(article_lang, str) else None)
+        columns['link'].append(article_link)
+        columns['phase'].append(state.get('phase'))
+        for field in fields:
+            value = article_dict.get(field)
+            if ARTICLE_FIELDS[field] == 'json' and value is not None:
+                value = json.dumps(value)
+            elif ARTICLE_FIELDS[field] == 'list' and value is not None:
+                value = [str(item) for item in value]
+            columns[field].append(value)
+        if len(columns['article_id']) >= batch_size:
+            yield columns
+            columns = None
+    if columns is not None:
+        yield columns
+
+
+def export_articles(location, dump_dir, path, fields=None, file_format=FORMAT_PARQUET, batch_size=1000):
+    """
+    exports the parsed articles of `dump_dir` to a single columnar file, one row per article
+    :param location: the path to the input file
+    :param dump_dir: the root folder where articles are saved
+    :param path: the path to the exported file
+    :param fields: the fields of the articles to export, among `ARTICLE_FIELDS`, by default `DEFAULT_FIELDS`
+    :param file_format: one of `FORMATS`
+    :param batch_size: how many articles to hold in memory at a time
+    :return: dict mapping the id of each exported article to its row in the exported file
+    """
+    check_pyarrow()
+    fields = fields or DEFAULT_FIELDS
+    unknown_fields = [field for field in fields if field not in ARTICLE_FIELDS]
+    if unknown_fields:
+        raise ValueError('unknown fields: {}'.format(', '.join(unknown_fields)))
+    writer = TableWriter(path, get_articles_schema(fields), file_format)
+    rows = {}
+    try:
+        for columns in iter_article_batches(location, dump_dir, fields, batch_size):
+            for article_id in columns['article_id']:
+                rows[article_id] = len(rows)
+            writer.write(columns)
+    finally:
+        writer.close()
+    return rows
+
+
+def export_pairs(location, path, rows, file_format=FORMAT_PARQUET, batch_size=10000):
+    """
+    exports the pairs of the input file with their similarity columns, e.g., `overall`, `geo`, `ent`, joined to the
+    exported articles
+    :param location: the path to the input file
+    :param path: the path to the exported file
+    :param rows: dict mapping the id of each exported article to its row in the exported articles, see
+           `export_articles`
+    :param file_format: one of `FORMATS`
+    :param batch_size: how many pairs to hold in memory at a time
+    :return: the number of exported pairs
+    """
+    check_pyarrow()
+    writer = None
+    count = 0
+    try:
+        for df in pd.read_csv(location, encoding='utf8', chunksize=batch_size, dtype={'pair_id': str}):
+            df = df.rename(columns={"url1_lang": "lang1", "url2_lang": "lang2"})  # patch for different release format
+            article_ids = df['pair_id'].str.split('_', expand=True)
+            columns = {'pair_id': df['pair_id'].tolist()}
+            for side in (1, 2):
+                columns['article_id{}'.format(side)] = article_ids[side - 1].tolist()
+                columns['lang{}'.format(side)] = [lang if isinstance(lang, str) else None
+                                                  for lang in df['lang{}'.format(side)]]
+                # the row of the article in the exported articles, or missing if the article was not downloaded
+                columns['article_row{}'.format(side)] = [rows.get(article_id)
+                                                         for article_id in columns['article_id{}'.format(side)]]
+            similarity_columns = [column for column in df.columns if column not in PAIR_ARTICLE_COLUMNS]
+            for column in similarity_columns:
+                columns[column] = [None if pd.isna(value) else float(value)
+                                   for value in pd.to_numeric(df[column], errors='coerce')]
+            if writer is None:
+                schema = pyarrow.schema(
+                    [('pair_id', pyarrow.string())] +
+                    [(name.format(side), data_type) for side in (1, 2)
+                     for name, data_type in [('article_id{}', pyarrow.string()), ('lang{}', pyarrow.string()),
+                                             ('article_row{}', pyarrow.int64())]] +
+                    [(column, pyarrow.float64()) for column in similarity_columns])
+                writer = TableWriter(path, schema, file_format)
+            writer.write(columns)
+            count += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
@@ -0,0 +1,435 @@
+"""Asynchronous engine downloading articles over keep-alive connections, for the retry phases and streaming mode."""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+
+import requests
+import tqdm
+from requests.adapters import HTTPAdapter
+
+from semeval_8_2022_ia_downloader.cli import get_cdx_link, get_endpoint, get_first_snapshots, get_rate_limit_key, \
+    get_wayback_link, get_wayback_timestamp
+from semeval_8_2022_ia_downloader.gating import Rejected, get_reason_label, get_rejection
+from semeval_8_2022_ia_downloader.metrics import BYTES_BUCKETS, get_metrics
+from semeval_8_2022_ia_downloader.profiling import start_thread_profiler
+from semeval_8_2022_ia_downloader.state import get_cdx_cache, get_state_index
+from semeval_8_2022_ia_downloader.workers import init_worker, parse_article_task
+
+# where articles are downloaded from: the latest archived copy, or the original source
+SOURCE_WAYBACK = 'wayback'
+SOURCE_ORIGINAL = 'original'
+
+# the steps of the fallback chain, named after the phases that they replace: the earliest snapshots listed by the CDX
+# server, the latest archived copy, the latest archived copy of the url without query string, the original source
+STEP_CDX = 'cdx'
+STEP_WAYBACK = 'wayback'
+STEP_WAYBACK_NOQUERY = 'wayback_noquery'
+STEP_ORIGINAL = 'original'
+
+# how many bytes of a body to read at a time, checking its size after each
+CHUNK_SIZE = 64 * 1024
+
+# one keep-alive session per downloader thread
+_local = threading.local()
+
+
+def get_session(pool_size):
+    """
+    :param pool_size: how many connections to keep alive per host
+    :return: the session of the current thread
+    """
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        _local.session.mount('http://', adapter)
+        _local.session.mount('https://', adapter)
+    return _local.session
+
+
+def fetch(url, user_agent, timeout, pool_size, content_types=(), max_size=0):
+    """
+    downloads a page; runs in a downloader thread
+    :param url: the URL of the page
+    :param user_agent: user agent to identify the script with the IA and original source website
+    :param timeout: how many seconds to wait for the server
+    :param pool_size: how many connections to keep alive per host
+    :param content_types: media types accepted, or an empty list to accept any, see `gating.get_rejection`
+    :param max_size: the largest body accepted, in bytes, or 0 to accept any
+    :return: pair `(url, html)` where `url` is the URL of the page after following redirects; raises
+             `gating.Rejected` if the headers, or the body read so far, are not accepted
+    """
+    endpoint = get_endpoint(url)
+    metrics = get_metrics()
+    try:
+        with metrics.timer('fetch_seconds', endpoint=endpoint):
+            response = get_session(pool_size).get(url, headers={'User-Agent': user_agent}, timeout=timeout,
+                                                  stream=True)
+    except requests.RequestException as e:
+        metrics.inc('responses_total', endpoint=endpoint, status=type(e).__name__)
+        raise
+    # the body is read, or the connection dropped, before returning
+    with response:
+        metrics.inc('responses_total', endpoint=endpoint, status=str(response.status_code))
+        response.raise_for_status()
+        content_length = response.headers.get('Content-Length')
+        reason = get_rejection(response.headers.get('Content-Type'),
+                               int(content_length) if content_length and content_length.isdigit() else None,
+                               content_types, max_size)
+        if reason is not None:
+            raise Rejected(reason, response.status_code)
+        # the announced length may be missing, or wrong
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            chunks.append(chunk)
+            size += len(chunk)
+            reason = get_rejection(None, size, content_types, max_size)
+            if reason is not None:
+                raise Rejected(reason, response.status_code)
+        content = b''.join(chunks)
+    metrics.observe('response_bytes', len(content), buckets=BYTES_BUCKETS, endpoint=endpoint)
+    return response.url, content
+
+
+class HostSlot:
+    """
+    the requests in flight against a rate limit, see `cli.get_rate_limit_key`: at most `get_limit()` at a time, where
+    the limit may change while requests wait
+    """
+
+    def __init__(self, get_limit, released=None):
+        """
+        :param get_limit: function returning how many requests may be in flight
+        :param released: `asyncio.Event` set whenever a request releases the slot, e.g., shared by all slots
+        """
+        self.get_limit = get_limit
+        self.released = released
+        self.active = 0
+        self.waiters = deque()
+
+    def is_free(self):
+        """
+        :return: whether a request would get the slot right away
+        """
+        return self.active + len(self.waiters) < self.get_limit()
+
+    async def acquire(self):
+        while self.active >= self.get_limit():
+            waiter = asyncio.get_event_loop().create_future()
+            self.waiters.append(waiter)
+            await waiter
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        if self.released is not None:
+            self.released.set()
+        # wake as many waiters as there are free slots; each checks the limit again, as it may have changed
+        for _ in range(self.get_limit() - self.active):
+            if not self.waiters:
+                break
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class FetchEngine:
+    """
+    downloads articles with at most `concurrency` requests in flight, of which at most `per_host_concurrency` to the
+    same host, and parses them in a pool of worker processes
+
+    after each request, its host slot stays reserved for `delay` seconds; waiting for the delay holds neither a
+    connection nor a thread, so other hosts keep downloading in the meantime; articles of a single source are scheduled
+    round-robin across hosts, and only once their host has a free slot, so that runs of articles from the same host do
+    not hold up the others
+
+    with a `throttle.AimdController`, the concurrency against each host and the delay adapt to the responses of each
+    class of endpoint instead, up to the ceiling of the controller
+
+    articles whose response is not of one of `content_types`, or larger than `max_size` bytes, are recorded as rejected
+    without reading the rest of their body, see `gating.get_rejection`
+    """
+
+    def __init__(self, dump_dir, concurrency, per_host_concurrency=None, delay=0, parser_processes=None,
+                 user_agent=None, timeout=60, languages=(), throttle=None, content_types=(), max_size=0):
+        self.dump_dir = dump_dir
+        self.throttle = throttle
+        self.content_types = content_types
+        self.max_size = max_size
+        self.concurrency = concurrency if throttle is None else throttle.max_concurrency
+        self.per_host_concurrency = per_host_concurrency or self.concurrency
+        self.delay = delay
+        self.parser_processes = parser_processes or os.cpu_count()
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.languages = languages
+
+    def run(self, tasks, source, desc=None):
+        """
+        downloads and parses articles, recording the outcome of each in the state index of `dump_dir`
+        :param tasks: list of tuples `(article_id, article_link, article_lang, phase)`, see `cli.parse_article`
+        :param source: `SOURCE_WAYBACK` to download the latest archived copy of each article, or `SOURCE_ORIGINAL` to
+               download it from the original source
+        :param desc: description for the progress bar
+        :return: None
+        """
+        self._run_loop(tasks, lambda loop, task: self._process(loop, task, source), desc,
+                       get_url=lambda task: get_wayback_link(task[1]) if source == SOURCE_WAYBACK else task[1])
+
+    def run_chain(self, tasks, steps, cdx_time_range=None, max_snapshots=1, min_text_length=0, desc=None):
+        """
+        downloads each article from the first source of the fallback chain that yields more than `min_text_length`
+        characters of text; each article moves through the chain independently of the others
+        :param tasks: list of triplets `(article_id, article_link, article_lang)`, see `cli.parse_article`
+        :param steps: the steps of the fallback chain, in order, among `STEP_CDX`, `STEP_WAYBACK`,
+               `STEP_WAYBACK_NOQUERY`, `STEP_ORIGINAL`
+        :param cdx_time_range: pair of timestamps delimiting the snapshots listed by `STEP_CDX`, see
+               `cli.get_cdx_time_range`
+        :param max_snapshots: how many snapshots to try in `STEP_CDX`, from the earliest one
+        :param min_text_length: continue along the chain if the `text` of the article is at most `min_text_length`
+               characters
+        :param desc: description for the progress bar
+        :return: None
+        """
+        self._run_loop(tasks, lambda loop, task: self._process_chain(loop, task, steps, cdx_time_range, max_snapshots,
+                                                                     min_text_length), desc)
+
+    def _run_loop(self, tasks, process, desc, get_url=None):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._run(loop, tasks, process, desc, get_url))
+        finally:
+            loop.close()
+
+    async def _run(self, loop, tasks, process, desc, get_url=None):
+        """
+        :param get_url: function mapping each task to the url it downloads, to schedule tasks across hosts, see
+               `_schedule`, or None to start them in order, e.g., if each task downloads from several sources
+        """
+        # each downloader thread profiles itself, if the run is profiled
+        self.downloaders = ThreadPoolExecutor(max_workers=self.concurrency, initializer=start_thread_profiler)
+        self.parsers = ProcessPoolExecutor(max_workers=self.parser_processes, initializer=init_worker,
+                                           initargs=(self.languages,))
+        self.connections = asyncio.Semaphore(self.concurrency)
+        self.hosts = {}
+        self.released = asyncio.Event()
+        # bound the articles in flight, so that html waiting to be parsed does not pile up in memory
+        in_flight = asyncio.Semaphore(self.concurrency + 2 * self.parser_processes)
+        progress = tqdm.tqdm(desc=desc, total=len(tasks))
+
+        async def run_task(task):
+            try:
+                await process(loop, task)
+            finally:
+                in_flight.release()
+                progress.update()
+
+        try:
+            pending = []
+            if get_url is None:
+                for task in tasks:
+                    await in_flight.acquire()
+                    pending.append(loop.create_task(run_task(task)))
+            else:
+                async for task in self._schedule(tasks, get_url):
+                    await in_flight.acquire()
+                    pending.append(loop.create_task(run_task(task)))
+                    # let the task take its host slot, before the next host is checked
+                    await asyncio.sleep(0)
+            await asyncio.gather(*pending)
+        finally:
+            progress.close()
+            self.downloaders.shutdown(wait=True)
+            self.parsers.shutdown(wait=True)
+
+    async def _schedule(self, tasks, get_url):
+        """
+        groups tasks by host, and yields them round-robin across the hosts with a free slot, waiting for a slot when
+        none is free
+        :param tasks: the tasks to schedule
+        :param get_url: function mapping each task to the url it downloads
+        :return: async generator of the tasks
+        """
+        queues = OrderedDict()
+        for task in tasks:
+            url = get_url(task)
+            queues.setdefault((get_rate_limit_key(url), get_endpoint(url)), deque()).append(task)
+        rotation = deque(queues)
+        while rotation:
+            self.released.clear()
+            scheduled = False
+            for _ in range(len(rotation)):
+                key, endpoint = rotation[0]
+                rotation.rotate(-1)
+                if not self._get_host(key, endpoint).is_free():
+                    continue
+                yield queues[key, endpoint].popleft()
+                scheduled = True
+                if not queues[key, endpoint]:
+                    # the host just yielded is the last one of the rotation
+                    rotation.pop()
+            if not scheduled:
+                await self.released.wait()
+
+    def _get_host(self, key, endpoint):
+        """
+        :param key: the rate limit, see `cli.get_rate_limit_key`
+        :param endpoint: the class of endpoint of `key`, see `cli.get_endpoint`
+        :return: the `HostSlot` of `key`
+        """
+        if key not in self.hosts:
+            self.hosts[key] = HostSlot(lambda: self.get_concurrency(endpoint), self.released)
+        return self.hosts[key]
+
+    def get_concurrency(self, endpoint):
+        """
+        :param endpoint: the class of endpoint, see `cli.get_endpoint`
+        :return: how many requests may be in flight against each rate limit of `endpoint`
+        """
+        if self.throttle is None:
+            return self.per_host_concurrency
+        return min(self.per_host_concurrency, self.throttle.get_concurrency(endpoint))
+
+    def get_delay(self, endpoint):
+        """
+        :param endpoint: the class of endpoint, see `cli.get_endpoint`
+        :return: how many seconds to wait between requests against each rate limit of `endpoint`
+        """
+        return self.delay if self.throttle is None else self.throttle.get_delay(endpoint)
+
+    async def _fetch(self, loop, url, gate=False):
+        """
+        :param gate: whether to reject responses that cannot be articles, see `fetch`; CDX listings are not gated
+        """
+        endpoint = get_endpoint(url)
+        host = self._get_host(get_rate_limit_key(url), endpoint)
+        await host.acquire()
+        sent_at = None
+        status = None
+        # whether the outcome tells how loaded the server is
+        record = self.throttle is not None
+        try:
+            async with self.connections:
+                # after waiting for a connection, which is not the latency of the server
+                sent_at = time.time()
+                result = await loop.run_in_executor(self.downloaders, fetch, url, self.user_agent, self.timeout,
+                                                    self.per_host_concurrency, self.content_types if gate else (),
+                                                    self.max_size if gate else 0)
+            status = 200
+            return result
+        except requests.HTTPError as e:
+            status = e.response.status_code
+            raise
+        except Rejected as e:
+            status = e.status
+            raise
+        except requests.Timeout:
+            # recorded without status, as an overloaded server
+            raise
+        except Exception:
+            # DNS failures, refused connections and TLS errors: the website is down rather than overloaded
+            record = False
+            raise
+        finally:
+            if record and sent_at is not None:
+                self.throttle.record(endpoint, status, time.time() - sent_at, sent_at)
+            # keep the host slot for the delay, without keeping this coroutine waiting
+            loop.call_later(self.get_delay(endpoint), host.release)
+
+    async def _download(self, loop, article_id, url, article_lang, phase, archived):
+        """
+        downloads and parses an article
+        :param url: the URL to download the article from
+        :param archived: whether `url` points to an archived copy on the waybackmachine
+        :return: the length of the stripped `text` extracted from the article, or None if the article cannot be
+                 downloaded or parsed; raises `gating.Rejected`, once recorded, if the response cannot be an article
+        """
+        try:
+            final_url, html = await self._fetch(loop, url, gate=True)
+            article_link = url
+            if archived:
+                if get_wayback_timestamp(final_url) is None:
+                    raise ValueError('not an archived copy: {}'.format(final_url))
+                # the waybackmachine redirects to the archived copy, which is what the article is parsed as
+                article_link = final_url
+            text_length, metrics = await loop.run_in_executor(
+                self.parsers, parse_article_task, (self.dump_dir, article_id, article_link, article_lang, html, phase))
+            get_metrics().merge(metrics)
+        except Rejected as e:
+            print('rejected', url, e.reason)
+            get_state_index(self.dump_dir).record_rejection(article_id, phase, e.reason)
+            get_metrics().inc('rejected_total', endpoint=get_endpoint(url), reason=get_reason_label(e.reason))
+            get_metrics().inc('articles_total', phase=phase, outcome='rejected')
+            raise
+        except Exception as e:
+            print(e)
+            print('cannot download from', url)
+            get_state_index(self.dump_dir).record_failure(article_id, phase, e)
+            get_metrics().inc('articles_total', phase=phase, outcome='failure')
+            return None
+        get_metrics().inc('articles_total', phase=phase, outcome='failure' if text_length is None else 'success')
+        return text_length
+
+    async def _process(self, loop, task, source):
+        article_id, article_link, article_lang, phase = task
+        try:
+            if source == SOURCE_WAYBACK:
+                await self._download(loop, article_id, get_wayback_link(article_link), article_lang, phase, True)
+            else:
+                await self._download(loop, article_id, article_link, article_lang, phase, False)
+        except Rejected:
+            pass
+
+    async def _get_snapshot_links(self, loop, article_id, article_link, cdx_time_range, max_snapshots):
+        """
+        lists the snapshots of an article to download, see `get_first_snapshots`, consulting the CDX cache of `dump_dir`
+        first
+        :return: list of links to archived copies, earliest first
+        """
+        cdx_cache = get_cdx_cache(self.dump_dir)
+        time_range_key = '-'.join(cdx_time_range)
+        snapshot_links = cdx_cache.get(article_link, time_range_key)
+        if snapshot_links is not None:
+            return snapshot_links
+        try:
+            _, content = await self._fetch(loop, get_cdx_link(article_link, cdx_time_range))
+        except Exception as e:
+            get_state_index(self.dump_dir).record_failure(article_id, STEP_CDX, e)
+            return []
+        try:
+            rows = json.loads(content)
+        except ValueError:
+            # forbidden by robots.txt
+            rows = []
+        snapshots = [dict(zip(rows[0], row)) for row in rows[1:]]
+        snapshots = get_first_snapshots(snapshots, cdx_time_range, max_snapshots)
+        snapshot_links = [get_wayback_link(snapshot['original'], snapshot['timestamp']) for snapshot in snapshots]
+        cdx_cache.put(article_link, time_range_key, snapshot_links)
+        return snapshot_links
+
+    async def _process_chain(self, loop, task, steps, cdx_time_range, max_snapshots, min_text_length):
+        article_id, article_link, article_lang = task
+        for step in steps:
+            if step == STEP_CDX:
+                urls = await self._get_snapshot_links(loop, article_id, article_link, cdx_time_range, max_snapshots)
+            elif step == STEP_WAYBACK:
+                urls = [get_wayback_link(article_link)]
+            elif step == STEP_WAYBACK_NOQUERY:
+                urls = [get_wayback_link(urljoin(article_link, urlparse(article_link).path))] \
+                    if urlparse(article_link).query else []
+            else:
+                urls = [article_link]
+            for url in urls:
+                try:
+                    text_length = await self._download(loop, article_id, url, article_lang, step,
+                                                       step != STEP_ORIGINAL)
+                except Rejected:
+                    # the other sources serve the same document
+                    return
+                if text_length is not None and text_length > min_text_length:
+                    return
@@ -0,0 +1,60 @@
+"""Rejection of responses that cannot be articles, e.g., PDFs, videos or huge live blogs, before their body is read."""
+
+# media types downloaded as articles, matched as prefixes of the `Content-Type` header; responses without the header
+# are downloaded
+DEFAULT_CONTENT_TYPES = ['text/html', 'application/xhtml', 'text/plain']
+# the largest body downloaded as an article, in bytes
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+
+# reasons of `get_rejection`, recorded in the state index, and used as the label of the `rejected_total` metric
+REASON_CONTENT_TYPE = 'content_type'
+REASON_SIZE = 'size'
+
+
+class Rejected(Exception):
+    """
+    a response whose body is not downloaded, as it cannot be an article
+    """
+
+    def __init__(self, reason, status=None):
+        """
+        :param reason: the reason, see `get_rejection`
+        :param status: the HTTP status of the response
+        """
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+
+
+def parse_content_types(value):
+    """
+    parses the --content_types argument
+    :param value: comma-separated media types, or "" to accept any
+    :return: list of media types, lowercase
+    """
+    return [content_type.strip().lower() for content_type in value.split(',') if content_type.strip()]
+
+
+def get_rejection(content_type, content_length, content_types, max_size):
+    """
+    :param content_type: the `Content-Type` header of the response, or None if missing
+    :param content_length: the size of the body, as announced by the `Content-Length` header or as read so far, or
+           None if unknown
+    :param content_types: media types accepted, see `DEFAULT_CONTENT_TYPES`, or an empty list to accept any
+    :param max_size: the largest body accepted, in bytes, or 0 to accept any
+    :return: the reason to reject the response, e.g., "content_type: application/pdf", or None to accept it
+    """
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type and content_types and not media_type.startswith(tuple(content_types)):
+        return '{}: {}'.format(REASON_CONTENT_TYPE, media_type)
+    if max_size and content_length is not None and content_length > max_size:
+        return '{}: more than {} bytes'.format(REASON_SIZE, max_size)
+    return None
+
+
+def get_reason_label(reason):
+    """
+    :param reason: the reason of a rejection, see `get_rejection`
+    :return: the kind of the reason, `REASON_CONTENT_TYPE` or `REASON_SIZE`
+    """
+    return reason.partition(':')[0]
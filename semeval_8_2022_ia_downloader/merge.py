@@ -0,0 +1,80 @@
+"""Merge of the dumps of the shards of a links file, see `plan.get_shards`, into a single corpus."""
+import os
+import os.path
+from collections import Counter
+
+from semeval_8_2022_ia_downloader.state import STATUS_DOWNLOADED, get_state_index
+from semeval_8_2022_ia_downloader.storage import STORAGE_FILENAME, ZSTD_DICT_FILENAME, configure_storage, \
+    get_storage, get_storage_config
+
+# outcomes of `merge_dump`, for each article of the merged dump
+MERGE_MERGED = 'merged'
+MERGE_UNCHANGED = 'unchanged'
+MERGE_SKIPPED = 'skipped'
+
+
+def merge_dump(source_dir, target_dir):
+    """
+    adds the articles of `source_dir`, and its failures and caches, to `target_dir`; the files of the articles are hard
+    linked where both dumps store them alike, and articles that did not change since an earlier merge are left as is
+    :param source_dir: the root folder of the dump to merge, e.g., of a shard
+    :param target_dir: the root folder of the merged dump
+    :return: Counter of `MERGE_MERGED`, `MERGE_UNCHANGED` and `MERGE_SKIPPED`, the latter for articles whose files or
+             state are missing or not downloaded in `source_dir`
+    """
+    if os.path.realpath(source_dir) == os.path.realpath(target_dir):
+        raise ValueError('cannot merge {} into itself'.format(source_dir))
+    if not os.path.exists(os.path.join(target_dir, STORAGE_FILENAME)) and \
+            os.path.exists(os.path.join(source_dir, STORAGE_FILENAME)):
+        # the first dump merged sets how the merged dump stores articles, so that its files can be linked as they are
+        config = get_storage_config(source_dir)
+        zstd_dict = os.path.join(source_dir, ZSTD_DICT_FILENAME)
+        configure_storage(target_dir, config['compression'], zstd_dict if os.path.exists(zstd_dict) else None,
+                          config['layout'])
+    source_storage = get_storage(source_dir)
+    target_storage = get_storage(target_dir)
+    source_state = get_state_index(source_dir)
+    target_state = get_state_index(target_dir)
+    outcomes = Counter()
+    for article_id in source_storage.iter_article_ids('.json'):
+        state = source_state.get(article_id)
+        if state is None or state['status'] != STATUS_DOWNLOADED:
+            outcomes[MERGE_SKIPPED] += 1
+            continue
+        merged_state = target_state.get(article_id) or {}
+        if merged_state.get('status') == STATUS_DOWNLOADED and \
+                merged_state.get('content_hash') == state['content_hash'] and \
+                merged_state.get('extractor_version') == state['extractor_version'] and \
+                target_storage.find(article_id, '.json') is not None:
+            outcomes[MERGE_UNCHANGED] += 1
+            continue
+        if not target_storage.import_article(source_storage, article_id, '.json'):
+            outcomes[MERGE_SKIPPED] += 1
+            continue
+        # articles saved without their html, e.g., by `reparse`, still have their parsed article
+        target_storage.import_article(source_storage, article_id, '.html')
+        target_state.put(state)
+        outcomes[MERGE_MERGED] += 1
+    target_state.merge_from(source_dir)
+    return outcomes
+
+
+def merge_retry_logs(paths, retry_log):
+    """
+    concatenates failure logs, such as the `--retry_log` of each shard, without repeating lines
+    :param paths: the failure logs to concatenate; missing files are ignored
+    :param retry_log: the path of the concatenated log
+    :return: the number of lines written
+    """
+    lines = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf8') as f:
+            for line in f:
+                if line.strip():
+                    lines.setdefault(line.rstrip('\n'), None)
+    with open(retry_log, 'w', encoding='utf8') as f:
+        for line in lines:
+            f.write(line + '\n')
+    return len(lines)
@@ -0,0 +1,241 @@
+"""Counters and latency histograms of a run, written as json and in the Prometheus textfile format."""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# prefix of the metrics in the Prometheus textfile format
+METRICS_NAMESPACE = 'semeval_8_2022_ia_downloader'
+
+METRICS_FILENAME = '.metrics'
+
+# upper bounds of the histogram buckets, for durations in seconds, sizes in bytes and text lengths in characters
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+CHARS_BUCKETS = (0, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+# one registry per process; worker processes hand their metrics over to the main process, see `Metrics.drain`
+_METRICS = {}
+
+
+def get_metrics():
+    """
+    :return: the `Metrics` of the current process
+    """
+    pid = os.getpid()
+    if pid not in _METRICS:
+        _METRICS[pid] = Metrics()
+    return _METRICS[pid]
+
+
+class Metrics:
+    """
+    counters, gauges and histograms, identified by a name and a set of labels; safe to update from several threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # per histogram: its bucket bounds, the count of values in each bucket, the sum and the count of values
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        increments a counter
+        :param name: the name of the counter, e.g., "requests_total"
+        :param value: the increment
+        :param labels: the labels of the counter, e.g., `phase="cdx"`
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        sets a gauge, i.e., a value that goes up and down, e.g., the current concurrency of an endpoint
+        :param name: the name of the gauge, e.g., "throttle_concurrency"
+        :param value: the value
+        :param labels: the labels of the gauge, e.g., `endpoint="cdx"`
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        """
+        records a value in a histogram
+        :param name: the name of the histogram, e.g., "parse_seconds"
+        :param value: the value to record
+        :param buckets: the upper bounds of the buckets, used when the histogram is created
+        :param labels: the labels of the histogram, e.g., `phase="cdx"`
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [tuple(buckets), [0] * len(buckets), 0, 0]
+            histogram = self.histograms[key]
+            for i, bound in enumerate(histogram[0]):
+                if value <= bound:
+                    histogram[1][i] += 1
+                    break
+            histogram[2] += value
+            histogram[3] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        records the duration of the enclosed block in a histogram, in seconds
+        :param name: the name of the histogram
+        :param labels: the labels of the histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stopwatch(self, name, **labels):
+        """
+        adds the duration of the enclosed block to a counter, in seconds, e.g., for the wall time of each phase
+        :param name: the name of the counter
+        :param labels: the labels of the counter
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(name, time.perf_counter() - start, **labels)
+
+    def drain(self):
+        """
+        empties the registry, e.g., in a worker process, so that its metrics are handed over with the result of a task
+        :return: the metrics recorded since the last call, see `merge`
+        """
+        with self.lock:
+            snapshot = (self.counters, self.gauges, self.histograms)
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        adds the metrics recorded by another process; its gauges replace those of this process
+        :param snapshot: the result of `drain` in the other process
+        :return: None
+        """
+        counters, gauges, histograms = snapshot
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(gauges)
+            for key, (buckets, counts, total, count) in histograms.items():
+                if key not in self.histograms:
+                    self.histograms[key] = [buckets, [0] * len(buckets), 0, 0]
+                histogram = self.histograms[key]
+                histogram[1] = [a + b for a, b in zip(histogram[1], counts)]
+                histogram[2] += total
+                histogram[3] += count
+
+    def to_dict(self):
+        """
+        :return: the metrics as a json-serializable dict, with cumulative bucket counts
+        """
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            gauges = [{'name': name, 'labels': dict(labels), 'value': value}
+                      for (name, labels), value in sorted(self.gauges.items())]
+            histograms = []
+            for (name, labels), (buckets, counts, total, count) in sorted(self.histograms.items()):
+                cumulative = [sum(counts[:i + 1]) for i in range(len(counts))]
+                histograms.append({'name': name, 'labels': dict(labels),
+                                   'buckets': dict(zip([str(bound) for bound in buckets], cumulative)),
+                                   'sum': total, 'count': count})
+        return {'updated_at': time.time(), 'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def to_prometheus(self):
+        """
+        :return: the metrics in the Prometheus text exposition format, e.g., for the textfile collector of
+                 node_exporter
+        """
+        metrics = self.to_dict()
+        lines = []
+        declared = set()
+        for kind, values in [('counter', metrics['counters']), ('gauge', metrics['gauges'])]:
+            for value in values:
+                name = '{}_{}'.format(METRICS_NAMESPACE, value['name'])
+                if name not in declared:
+                    declared.add(name)
+                    lines.append('# TYPE {} {}'.format(name, kind))
+                lines.append('{}{} {}'.format(name, format_labels(value['labels']), value['value']))
+        for histogram in metrics['histograms']:
+            name = '{}_{}'.format(METRICS_NAMESPACE, histogram['name'])
+            if name not in declared:
+                declared.add(name)
+                lines.append('# TYPE {} histogram'.format(name))
+            for bound, count in histogram['buckets'].items():
+                lines.append('{}_bucket{} {}'.format(name, format_labels(dict(histogram['labels'], le=bound)), count))
+            lines.append('{}_bucket{} {}'.format(name, format_labels(dict(histogram['labels'], le='+Inf')),
+                                                 histogram['count']))
+            lines.append('{}_sum{} {}'.format(name, format_labels(histogram['labels']), histogram['sum']))
+            lines.append('{}_count{} {}'.format(name, format_labels(histogram['labels']), histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    """
+    :param labels: dict of labels
+    :return: the labels in the Prometheus text exposition format, e.g., `{phase="cdx"}`
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in sorted(labels.items())) + '}'
+
+
+def write_metrics(path, metrics=None):
+    """
+    writes the metrics to `<path>.json` and `<path>.prom`, replacing the previous files atomically
+    :param path: the path to the metrics files, without extension
+    :param metrics: the `Metrics` to write, by default those of the current process
+    :return: None
+    """
+    metrics = metrics or get_metrics()
+    for extension, content in [('.json', json.dumps(metrics.to_dict(), indent=1)),
+                               ('.prom', metrics.to_prometheus())]:
+        with open(path + extension + '.tmp', 'w', encoding='utf8') as f:
+            f.write(content)
+        os.replace(path + extension + '.tmp', path + extension)
+
+
+class MetricsWriter:
+    """
+    writes the metrics of the current process every `interval` seconds, from a daemon thread, and once more when
+    stopped
+    """
+
+    def __init__(self, path, interval=30):
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            write_metrics(self.path)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        write_metrics(self.path)
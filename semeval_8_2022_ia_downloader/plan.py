@@ -0,0 +1,335 @@
+"""Compiles the links csv file into a deduplicated task plan, cached on disk next to `dump_dir`."""
+import hashlib
+import os
+import os.path
+import re
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import pandas as pd
+import requests
+from requests import RequestException
+
+from semeval_8_2022_ia_downloader.state import STATUS_DOWNLOADED, STATUS_REJECTED, get_plan_index, \
+    get_redirect_cache, get_state_index
+from semeval_8_2022_ia_downloader.storage import get_storage
+
+RESOLVE_FQDN_LIST = ['feedproxy.google.com']
+
+# number of links resolved in parallel, and seconds to wait for each of them
+RESOLVE_CONCURRENCY = 16
+RESOLVE_TIMEOUT = 30
+
+PLAN_COLUMNS = ['article_id', 'link', 'lang', 'resolved_link', 'fetch_id']
+
+# query parameters that only track where readers come from, and do not change the page
+TRACKING_PARAMETER_PATTERN = re.compile(r'^(?:utm_\w+|fbclid|gclid|ocid|cmpid|ns_\w+)$', re.IGNORECASE)
+
+# scheme and network location of a url, as parsed by `urllib.parse.urlparse`
+NETLOC_PATTERN = r'^(?:[A-Za-z][A-Za-z0-9+.-]*:)?//([^/?#]*)'
+
+# one keep-alive session per resolver thread
+_local = threading.local()
+
+# the plans loaded by this process, by path, see `load_plan`, and the hashes of links files, by path, modification
+# time and size, see `get_csv_hash`
+_plans = {}
+_csv_hashes = {}
+
+
+def get_csv_hash(location):
+    """
+    hashes the content of the links file, so that cached plans are invalidated when the file changes; the file is read
+    once per process, unless it changes
+    :param location: the path to the input file
+    :return: the hex digest of the file
+    """
+    stat = os.stat(location)
+    key = (os.path.abspath(location), stat.st_mtime_ns, stat.st_size)
+    if key not in _csv_hashes:
+        digest = hashlib.sha1()
+        with open(location, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _csv_hashes[key] = digest.hexdigest()
+    return _csv_hashes[key]
+
+
+def get_plan_path(location, dump_dir, shard=None):
+    """
+    maps the links file to the path where its plan is cached
+    :param location: the path to the input file
+    :param dump_dir: the root folder where to save articles
+    :param shard: pair `(index, count)` of the shard of the links file that the plan covers, or None for all of it
+    :return: the path to the cached plan, stored next to `dump_dir`
+    """
+    dump_dir = os.path.abspath(dump_dir)
+    filename = '.{}.plan-{}{}.csv'.format(os.path.basename(dump_dir), get_csv_hash(location)[:16],
+                                          '-shard{}of{}'.format(*shard) if shard is not None else '')
+    return os.path.join(os.path.dirname(dump_dir), filename)
+
+
+def resolve_link(article_link, timeout=RESOLVE_TIMEOUT):
+    """
+    follows the redirects of a link, e.g., coming from news aggregators like feedproxy.google.com
+    :param article_link: the link to resolve
+    :param timeout: how many seconds to wait for each response
+    :return: the resolved link; raises `RequestException` if the link cannot be resolved
+    """
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    r = _local.session.head(article_link, allow_redirects=True, timeout=timeout)
+    return r.url
+
+
+def resolve_links(links, redirect_cache=None, concurrency=RESOLVE_CONCURRENCY, timeout=RESOLVE_TIMEOUT):
+    """
+    resolves links in parallel, consulting and updating `redirect_cache`
+    :param links: iterable of links to resolve
+    :param redirect_cache: a `state.RedirectCache`, or None to always resolve links over the network
+    :param concurrency: how many links to resolve in parallel
+    :param timeout: how many seconds to wait for each response
+    :return: dict mapping each link to a pair `(resolved_link, error)`, where `resolved_link` is None if the link
+             could not be resolved
+    """
+    resolved = {}
+    pending = []
+    for link in set(links):
+        cached = redirect_cache.get(link) if redirect_cache is not None else None
+        if cached is None:
+            pending.append(link)
+        else:
+            resolved[link] = cached
+    if not pending:
+        return resolved
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(resolve_link, link, timeout): link for link in pending}
+        for future in as_completed(futures):
+            link = futures[future]
+            try:
+                resolved[link] = (future.result(), None)
+            except (TimeoutError, RequestException) as e:
+                resolved[link] = (None, repr(e))
+            if redirect_cache is not None:
+                redirect_cache.put(link, *resolved[link])
+    return resolved
+
+
+def get_links_to_resolve(plan):
+    """
+    :param plan: DataFrame with columns `PLAN_COLUMNS`
+    :return: boolean Series, true for the rows whose link comes from a domain in `RESOLVE_FQDN_LIST` and has not
+             been resolved yet
+    """
+    domains = plan['link'].str.extract(NETLOC_PATTERN, expand=False)
+    return domains.isin(RESOLVE_FQDN_LIST) & plan['resolved_link'].isna()
+
+
+def resolve_plan(plan, redirect_cache=None, concurrency=RESOLVE_CONCURRENCY, timeout=RESOLVE_TIMEOUT):
+    """
+    fills in `resolved_link` for the links of `plan` that need resolving, see `resolve_links`
+    :param plan: DataFrame with columns `PLAN_COLUMNS`, modified in place
+    :return: dict mapping the ids of the articles whose link cannot be resolved to the corresponding error
+    """
+    to_resolve = get_links_to_resolve(plan)
+    if not to_resolve.any():
+        return {}
+    resolved = resolve_links(plan.loc[to_resolve, 'link'], redirect_cache, concurrency, timeout)
+    plan.loc[to_resolve, 'resolved_link'] = plan.loc[to_resolve, 'link'].map(lambda link: resolved[link][0])
+    # links from news aggregators may resolve to the link of another article
+    assign_fetch_ids(plan)
+    return {article_id: resolved[link][1]
+            for article_id, link in plan.loc[to_resolve, ['article_id', 'link']].itertuples(index=False, name=None)
+            if resolved[link][0] is None}
+
+
+def normalize_link(link):
+    """
+    maps the variants of a link to the same page to the same string: the scheme, the case of the host, default ports,
+    fragments, trailing slashes, the order of query parameters and tracking parameters do not matter
+    :param link: the link to normalize
+    :return: the normalized link
+    """
+    parts = urlsplit(link.strip())
+    netloc = parts.netloc.lower()
+    if netloc.endswith(':80') or netloc.endswith(':443'):
+        netloc = netloc.rsplit(':', 1)[0]
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not TRACKING_PARAMETER_PATTERN.match(name))
+    return urlunsplit(('', netloc, parts.path.rstrip('/') or '/', urlencode(query), ''))
+
+
+def assign_fetch_ids(plan):
+    """
+    fills in `fetch_id`, the id of the article whose download serves every article with the same normalized link:
+    the first of them in the plan, see `normalize_link`
+    :param plan: DataFrame with columns `PLAN_COLUMNS`, modified in place
+    :return: None
+    """
+    normalized_links = plan['resolved_link'].map(normalize_link, na_action='ignore')
+    plan['fetch_id'] = plan.groupby(normalized_links, sort=False)['article_id'].transform('first')
+    # links that cannot be resolved are not deduplicated
+    plan['fetch_id'] = plan['fetch_id'].fillna(plan['article_id'])
+
+
+def get_domains(links):
+    """
+    :param links: Series of links
+    :return: Series of the websites of the links: their host, lowercase, without port nor "www."
+    """
+    hosts = links.str.extract(NETLOC_PATTERN, expand=False).str.lower()
+    return hosts.str.replace(r'^(?:[^@]*@)?(?:www\.)?([^:]*)(?::\d*)?$', r'\1', regex=True)
+
+
+def record_plan(plan, dump_dir, replace=True):
+    """
+    copies the language and website of each article to the state database of `dump_dir`, for the `status` command
+    :param plan: DataFrame with columns `PLAN_COLUMNS`
+    :param dump_dir: the root folder where articles are saved
+    :param replace: whether to replace a copy with as many articles as `plan`, e.g., False for a cached plan
+    :return: None
+    """
+    plan_index = get_plan_index(dump_dir)
+    if not replace and plan_index.count() == len(plan):
+        return
+    domains = get_domains(plan['resolved_link'].fillna(plan['link']))
+    plan_index.replace((article_id, *[value if isinstance(value, str) else None for value in (lang, domain)])
+                       for article_id, lang, domain in zip(plan['article_id'], plan['lang'], domains))
+
+
+def materialize_aliases(plan, dump_dir):
+    """
+    stores, for every article that shares its link with another, the download of the other article, see
+    `assign_fetch_ids`
+    :param plan: DataFrame with columns `PLAN_COLUMNS`
+    :param dump_dir: the root folder where articles are saved
+    :return: the number of articles stored
+    """
+    state_index = get_state_index(dump_dir)
+    storage = get_storage(dump_dir)
+    count = 0
+    aliases = plan[plan['fetch_id'] != plan['article_id']]
+    for article_id, fetch_id in aliases[['article_id', 'fetch_id']].itertuples(index=False, name=None):
+        source = state_index.get(fetch_id)
+        if source is not None and source['status'] == STATUS_REJECTED:
+            # the link cannot be an article for this article either
+            state_index.record_rejection(article_id, source['phase'], source['last_error'])
+            continue
+        if source is None or source['status'] != STATUS_DOWNLOADED:
+            continue
+        target = state_index.get(article_id)
+        if target is not None and target['status'] == STATUS_DOWNLOADED and \
+                (target['content_hash'], target['extractor_version']) == \
+                (source['content_hash'], source['extractor_version']):
+            continue
+        if not all([storage.copy(fetch_id, article_id, extension) for extension in ['.html', '.json']]):
+            continue
+        state_index.record_success(article_id, source['phase'], source['text_length'], source['content_hash'],
+                                   source['extractor_version'])
+        count += 1
+    return count
+
+
+def get_shards(article_ids, count):
+    """
+    :param article_ids: Series of article ids
+    :param count: the number of shards
+    :return: Series of the shard of each article, from 0 to `count - 1`; unlike `hash`, the same on every run and every
+             machine
+    """
+    return article_ids.map(lambda article_id: zlib.crc32(article_id.encode('utf8')) % count)
+
+
+def get_partition(article_id, count):
+    """
+    :param article_id: the id of an article
+    :param count: the number of partitions
+    :return: the partition of the article, from 0 to `count - 1`, for splitting the articles of a run among crawler
+             processes; hashed differently from `get_shards`, so that the articles of a shard spread over all partitions
+    """
+    return int(hashlib.sha1(article_id.encode('utf8')).hexdigest()[:8], 16) % count
+
+
+def build_plan(location, shard=None):
+    """
+    reads the csv file containing the articles to download into a table with one row per article
+    :param location: the path to the input file
+    :param shard: pair `(index, count)` to keep only the articles of shard `index` out of `count`, see `get_shards`,
+           or None to keep all articles
+    :return: DataFrame with columns `PLAN_COLUMNS`, in the order in which articles appear in the input file;
+             `resolved_link` is missing for links that need resolving, see `resolve_plan`, and `fetch_id` is the id of
+             the article that is downloaded in place of each article, see `assign_fetch_ids`
+    """
+    df = pd.read_csv(location, index_col='pair_id', encoding='utf8')
+    df.rename(columns={"url1_lang": "lang1", "url2_lang": "lang2"}, inplace=True)  # patch for different release format
+
+    article_ids = df.index.to_series().str.split('_', expand=True)
+    sides = []
+    for side in (0, 1):
+        sides.append(pd.DataFrame({'article_id': article_ids[side].values,
+                                   'link': df['link{}'.format(side + 1)].values,
+                                   'lang': df['lang{}'.format(side + 1)].values,
+                                   # interleave the two articles of each pair, as they appear in the input file
+                                   'order': range(side, 2 * len(df), 2)}))
+    plan = pd.concat(sides).sort_values('order', kind='stable').drop_duplicates('article_id')
+    if shard is not None:
+        # before any link is resolved, so that each node only accesses the network for its own articles
+        plan = plan[get_shards(plan['article_id'], shard[1]) == shard[0]]
+
+    plan['resolved_link'] = plan['link'].where(
+        ~plan['link'].str.extract(NETLOC_PATTERN, expand=False).isin(RESOLVE_FQDN_LIST))
+    plan = plan.reset_index(drop=True)
+    assign_fetch_ids(plan)
+    return plan[PLAN_COLUMNS]
+
+
+def load_plan(location, dump_dir, concurrency=RESOLVE_CONCURRENCY, timeout=RESOLVE_TIMEOUT, shard=None,
+              resolve=False):
+    """
+    returns the plan for the links file, building and caching it on disk on the first call, and in memory for the
+    later calls of this process; the plan is shared by these calls, and not to be modified
+    :param location: the path to the input file
+    :param dump_dir: the root folder where to save articles
+    :param concurrency: how many links to resolve in parallel
+    :param timeout: how many seconds to wait when resolving each link
+    :param shard: pair `(index, count)` to plan only the articles of shard `index` out of `count`, see `build_plan`
+    :param resolve: whether to resolve the links that need it, e.g., in the planning step of `cli.download`; links
+           that could not be resolved are resolved again once their entry in the redirect cache of `dump_dir` expires,
+           and their failure is recorded in the state index of `dump_dir`; otherwise, unresolved links stay so, and
+           their articles are skipped, see `cli.parse_input`
+    :return: DataFrame with columns `PLAN_COLUMNS`, see `build_plan`
+    """
+    plan_path = get_plan_path(location, dump_dir, shard)
+    plan = _plans.get(plan_path)
+    changed = False
+    if plan is None:
+        if os.path.exists(plan_path):
+            plan = pd.read_csv(plan_path, dtype=str, keep_default_na=False, na_values=[''], encoding='utf8')
+            if 'fetch_id' not in plan.columns:
+                # cached by a version that did not deduplicate links
+                assign_fetch_ids(plan)
+                changed = True
+        else:
+            plan = build_plan(location, shard)
+            changed = True
+
+    if resolve and get_links_to_resolve(plan).any():
+        resolved = plan['resolved_link'].notna().sum()
+        # links whose failure is still in the redirect cache are not resolved again
+        errors = resolve_plan(plan, get_redirect_cache(dump_dir), concurrency, timeout)
+        state_index = get_state_index(dump_dir)
+        for article_id, error in errors.items():
+            state_index.record_failure(article_id, 'resolve', error)
+        changed = changed or plan['resolved_link'].notna().sum() != resolved
+
+    if changed:
+        # write to a temporary file first, so that an interrupted run never leaves a truncated plan behind
+        plan.to_csv(plan_path + '.tmp', index=False, encoding='utf8')
+        os.replace(plan_path + '.tmp', plan_path)
+        record_plan(plan, dump_dir)
+    elif plan_path not in _plans:
+        record_plan(plan, dump_dir, replace=False)
+    _plans[plan_path] = plan
+    return plan
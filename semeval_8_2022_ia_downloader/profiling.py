@@ -0,0 +1,227 @@
+"""Profiling of a run: cProfile in every process and downloader thread, and the parse time of each website."""
+import csv
+import glob
+import io
+import json
+import os
+import pstats
+import cProfile
+from multiprocessing.util import Finalize
+
+from semeval_8_2022_ia_downloader.metrics import SECONDS_BUCKETS
+
+# where each process saves its profile, inside `dump_dir`, before they are aggregated by `write_report`
+PROFILE_DIRNAME = '.profile'
+# set by `enable_profiling`, so that worker processes, whichever way they are started, profile themselves too
+PROFILE_DIR_ENV = 'SEMEVAL_8_2022_IA_PROFILE_DIR'
+
+REPORT_FILENAME = 'profile.txt'
+DOMAINS_FILENAME = 'profile-domains.csv'
+# how many functions, and websites, are listed in the report
+REPORT_LIMIT = 40
+
+# the profiler of the current process, the profilers of its threads, see `start_thread_profiler`, and the parse times
+# of each website: count, total and maximum seconds, the link parsed the slowest, and the count in each of
+# `SECONDS_BUCKETS`
+_PROFILE = {}
+
+
+def get_profile_dir():
+    """
+    :return: the folder where the processes of this run save their profile, or None if the run is not profiled
+    """
+    return os.environ.get(PROFILE_DIR_ENV)
+
+
+def enable_profiling(dump_dir):
+    """
+    profiles the current process, and the worker processes that it starts from now on, until `write_report`
+    :param dump_dir: the root folder where articles are saved, and where the report is written
+    :return: None
+    """
+    profile_dir = os.path.abspath(os.path.join(dump_dir, PROFILE_DIRNAME))
+    os.makedirs(profile_dir, exist_ok=True)
+    # profiles of previous runs
+    for path in glob.glob(os.path.join(profile_dir, '*')):
+        os.remove(path)
+    os.environ[PROFILE_DIR_ENV] = profile_dir
+    start_profiler('main')
+
+
+def start_profiler(name):
+    """
+    starts profiling the current process, if the run is profiled; worker processes save their profile when they exit
+    :param name: the role of the process, "main", "crawler" or "worker"
+    :return: None
+    """
+    if get_profile_dir() is None:
+        return
+    # a forked worker inherits the profiler of its parent
+    inherited = _PROFILE.get('profiler')
+    if inherited is not None:
+        inherited.disable()
+    _PROFILE.clear()
+    _PROFILE.update(name=name, pid=os.getpid(), domains={}, profiler=cProfile.Profile(), threads=[])
+    _PROFILE['profiler'].enable()
+    if name != 'main':
+        Finalize(None, stop_profiler, exitpriority=10)
+
+
+def start_thread_profiler():
+    """
+    starts profiling the current thread, e.g., a downloader thread of `fetcher.FetchEngine`, if the current process is
+    profiled; the profile of the thread is saved with that of the process
+    :return: None
+    """
+    if _PROFILE.get('pid') != os.getpid():
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # python 3.12 and later allow a single profiler, which already sees every thread of the process
+        return
+    _PROFILE['threads'].append(profiler)
+
+
+def stop_profiler():
+    """
+    stops profiling the current process, and saves its profile and parse times in the profile folder of the run
+    :return: None
+    """
+    if _PROFILE.get('pid') != os.getpid():
+        return
+    _PROFILE['profiler'].disable()
+    path = os.path.join(get_profile_dir(), '{}-{}'.format(_PROFILE['name'], _PROFILE['pid']))
+    stats = pstats.Stats(_PROFILE['profiler'])
+    for profiler in _PROFILE['threads']:
+        profiler.create_stats()
+        # pstats refuses empty profiles, e.g., of threads that never ran a task
+        if profiler.stats:
+            stats.add(profiler)
+    stats.dump_stats(path + '.prof')
+    with open(path + '.json', 'w', encoding='utf8') as f:
+        json.dump(_PROFILE['domains'], f)
+    _PROFILE.clear()
+
+
+def record_parse_time(domain, seconds, article_link):
+    """
+    records how long newspaper3k took to parse an article, if the run is profiled
+    :param domain: the website of the article, see `cli.get_article_domain`
+    :param seconds: the parse time
+    :param article_link: the link of the article, reported if it is the slowest of its website
+    :return: None
+    """
+    if _PROFILE.get('pid') != os.getpid():
+        return
+    if domain not in _PROFILE['domains']:
+        _PROFILE['domains'][domain] = [0, 0, 0, None, [0] * (len(SECONDS_BUCKETS) + 1)]
+    parse_times = _PROFILE['domains'][domain]
+    parse_times[0] += 1
+    parse_times[1] += seconds
+    if seconds >= parse_times[2]:
+        parse_times[2] = seconds
+        parse_times[3] = article_link
+    parse_times[4][sum(seconds > bound for bound in SECONDS_BUCKETS)] += 1
+
+
+def get_quantile(counts, quantile):
+    """
+    :param counts: the count of parse times in each of `SECONDS_BUCKETS`, and above
+    :param quantile: e.g., 0.95
+    :return: the upper bound of the bucket holding the quantile, or None if above all buckets
+    """
+    target = quantile * sum(counts)
+    cumulative = 0
+    for bound, count in zip(SECONDS_BUCKETS, counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return None
+
+
+def merge_parse_times(profile_dir):
+    """
+    :param profile_dir: the profile folder of the run
+    :return: dict mapping each website to its parse times, added over all processes, see `record_parse_time`
+    """
+    domains = {}
+    for path in glob.glob(os.path.join(profile_dir, '*.json')):
+        with open(path, encoding='utf8') as f:
+            for domain, (count, total, maximum, slowest_link, counts) in json.load(f).items():
+                if domain not in domains:
+                    domains[domain] = [0, 0, 0, None, [0] * len(counts)]
+                merged = domains[domain]
+                merged[0] += count
+                merged[1] += total
+                if maximum >= merged[2]:
+                    merged[2] = maximum
+                    merged[3] = slowest_link
+                merged[4] = [a + b for a, b in zip(merged[4], counts)]
+    return domains
+
+
+def format_stats(paths, title):
+    """
+    :param paths: the profiles of the processes to add up
+    :param title: the heading of the section
+    :return: the functions taking the most cumulative time, as formatted by pstats
+    """
+    if not paths:
+        return '{}: no profile\n'.format(title)
+    stream = io.StringIO()
+    stats = pstats.Stats(*paths, stream=stream)
+    stream.write('{}: {} process(es)\n'.format(title, len(paths)))
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LIMIT)
+    return stream.getvalue()
+
+
+def write_report(dump_dir):
+    """
+    stops profiling the current process, and aggregates the profiles of all processes of the run into
+    `dump_dir/profile-main.pstats`, `dump_dir/profile-crawlers.pstats` and `dump_dir/profile-workers.pstats`, readable
+    with pstats or snakeviz, the parse times of each website into `dump_dir/profile-domains.csv`, and a summary of both
+    into `dump_dir/profile.txt`
+    :param dump_dir: the root folder where articles are saved
+    :return: the path to the summary, or None if the run is not profiled
+    """
+    profile_dir = get_profile_dir()
+    if profile_dir is None:
+        return None
+    stop_profiler()
+    sections = []
+    for name, filename, title in [('main', 'profile-main.pstats',
+                                   'main process, including the scrapy reactor, and the fetch engine with its '
+                                   'downloader threads'),
+                                  ('crawler', 'profile-crawlers.pstats',
+                                   'crawler processes of Phase 1, each with its scrapy reactor'),
+                                  ('worker', 'profile-workers.pstats', 'parser processes')]:
+        paths = sorted(glob.glob(os.path.join(profile_dir, '{}-*.prof'.format(name))))
+        if paths:
+            pstats.Stats(*paths).dump_stats(os.path.join(dump_dir, filename))
+        sections.append(format_stats(paths, title))
+
+    # websites by total parse time, as a few pathological websites make up the tail of the parse time
+    domains = sorted(merge_parse_times(profile_dir).items(), key=lambda item: item[1][1], reverse=True)
+    rows = []
+    for domain, (count, total, maximum, slowest_link, counts) in domains:
+        p95 = get_quantile(counts, 0.95)
+        # the bucket bound is an upper estimate, never above the slowest parse
+        p95 = round(1000 * min(p95 if p95 is not None else maximum, maximum), 1)
+        rows.append([domain, count, round(total, 3), round(1000 * total / count, 1), p95, round(1000 * maximum, 1),
+                     slowest_link])
+    header = ['domain', 'articles', 'total_s', 'mean_ms', 'p95_ms', 'max_ms', 'slowest_link']
+    with open(os.path.join(dump_dir, DOMAINS_FILENAME), 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    table = ['{:<40} {:>8} {:>10} {:>8} {:>8} {:>10}  {}'.format(*header)]
+    table += ['{:<40} {:>8} {:>10} {:>8} {:>8} {:>10}  {}'.format(*row) for row in rows[:REPORT_LIMIT]]
+    sections.append('parse time per website, slowest first ({} websites, all in {}):\n{}\n'.format(
+        len(rows), DOMAINS_FILENAME, '\n'.join(table)))
+
+    path = os.path.join(dump_dir, REPORT_FILENAME)
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('\n'.join(sections))
+    return path
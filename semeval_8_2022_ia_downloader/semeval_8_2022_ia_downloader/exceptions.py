@@ -0,0 +1,12 @@
+# Define here the exceptions shared by the spider and its middlewares
+#
+# Kept apart from middlewares.py, whose imports install the default reactor: the spider loader imports the spider
+# before scrapy installs the reactor of TWISTED_REACTOR
+from scrapy.exceptions import IgnoreRequest
+
+
+class BackedOff(IgnoreRequest):
+    """
+    a request dropped by `TooManyRequestsRetryMiddleware` while its rate limit backs off, and crawled again once the
+    backoff expires; not a failure of the request
+    """
@@ -0,0 +1,56 @@
+# Define here your extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+from scrapy import signals
+from scrapy.exceptions import StopDownload
+
+from semeval_8_2022_ia_downloader.cli import get_endpoint
+from semeval_8_2022_ia_downloader.gating import DEFAULT_CONTENT_TYPES, DEFAULT_MAX_SIZE, get_reason_label, \
+    get_rejection
+from semeval_8_2022_ia_downloader.metrics import get_metrics
+
+
+class ContentGate:
+    """
+    stops downloading snapshots that cannot be articles, as soon as their headers, or the body received so far, show
+    that they are not of one of ARTICLE_CONTENT_TYPES or larger than ARTICLE_MAX_SIZE bytes, see
+    `gating.get_rejection`; unlike DOWNLOAD_MAXSIZE, CDX listings are not limited, and the reason is kept in the
+    "content_gate_rejected" meta of the request, for the spider to record
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.content_types = crawler.settings.getlist('ARTICLE_CONTENT_TYPES', DEFAULT_CONTENT_TYPES)
+        self.max_size = crawler.settings.getint('ARTICLE_MAX_SIZE', DEFAULT_MAX_SIZE)
+        crawler.signals.connect(self.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(self.bytes_received, signal=signals.bytes_received)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def headers_received(self, headers, body_length, request, spider):
+        if not request.meta.get('wayback_machine_url'):
+            return
+        # the same request may be downloaded again, e.g., after a 429 error
+        request.meta['content_gate_size'] = 0
+        content_type = headers.get('Content-Type')
+        self.check(request, content_type.decode('latin-1') if content_type else None,
+                   # twisted's UNKNOWN_LENGTH if there is no Content-Length header
+                   body_length if isinstance(body_length, int) and body_length >= 0 else None)
+
+    def bytes_received(self, data, request, spider):
+        if 'content_gate_size' not in request.meta:
+            return
+        request.meta['content_gate_size'] += len(data)
+        self.check(request, None, request.meta['content_gate_size'])
+
+    def check(self, request, content_type, content_length):
+        reason = get_rejection(content_type, content_length, self.content_types, self.max_size)
+        if reason is None:
+            return
+        request.meta['content_gate_rejected'] = reason
+        self.crawler.stats.inc_value('content_gate/rejected/{}'.format(get_reason_label(reason)))
+        get_metrics().inc('rejected_total', endpoint=get_endpoint(request.url), reason=get_reason_label(reason))
+        raise StopDownload(fail=True)
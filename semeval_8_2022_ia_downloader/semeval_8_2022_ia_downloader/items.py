@@ -7,6 +7,9 @@ import scrapy
 
 
 class Semeval82022IaDownloaderItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # a downloaded article, parsed by Semeval82022IaDownloaderPipeline
+    article_id = scrapy.Field()
+    article_link = scrapy.Field()
+    article_lang = scrapy.Field()
+    html = scrapy.Field()
+    phase = scrapy.Field()
@@ -2,45 +2,255 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-import pandas as pd
+import scrapy
 from scrapy import signals
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
-from scrapy.exceptions import IgnoreRequest
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest, NotConfigured
+from scrapy.http import Response
 from scrapy_wayback_machine import WaybackMachineMiddleware
 
-from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.downloadermiddlewares.retry import RetryMiddleware, get_retry_request
 from scrapy.utils.response import response_status_message
+from twisted.internet import defer, error
 
+import heapq
+import random
 import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+
+from semeval_8_2022_ia_downloader.cli import CDX_ENDPOINT, IA_URL, WAYBACK_PREFIX, get_cdx_params, \
+    get_cdx_time_range, get_endpoint, get_rate_limit_key, get_wayback_timestamp
+from semeval_8_2022_ia_downloader.metrics import BYTES_BUCKETS, get_metrics
+from semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.exceptions import BackedOff
+from semeval_8_2022_ia_downloader.state import CDX_TTL, get_backoff_index, get_cdx_cache
+from semeval_8_2022_ia_downloader.throttle import ENDPOINTS, TARGET_LATENCY, AimdController
+
+
+def get_backoff_key(request):
+    """
+    :param request: the request
+    :return: the rate limit that the request counts against, see `cli.get_rate_limit_key`
+    """
+    return get_rate_limit_key(request.url)
+
+
+def get_retry_after(response):
+    """
+    :param response: the response
+    :return: the number of seconds to wait according to the `Retry-After` header of the response, or None if the
+             header is missing or malformed
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    retry_after = retry_after.decode('latin1').strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        return max(0., parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# how many seconds a crawler process trusts its copy of the backoffs shared with the other crawler processes
+SHARED_BACKOFF_INTERVAL = 1
 
 
 class TooManyRequestsRetryMiddleware(RetryMiddleware):
+    """
+    retries requests that hit a 429 error after backing off, without blocking the reactor; the backoff only delays
+    requests counting against the same rate limit, see `get_backoff_key`
+
+    requests hitting a backoff are dropped from the downloader, where they would hold a slot of CONCURRENT_REQUESTS
+    while waiting, and crawled again when the backoff expires
+
+    with SHARED_BACKOFF, as set for each of several crawler processes, the backoffs are shared with the other processes
+    through the state database of the dump, see `state.BackoffIndex`; how many 429 errors were hit in a row stays
+    local to each process
+    """
 
     def __init__(self, crawler):
         super(TooManyRequestsRetryMiddleware, self).__init__(crawler.settings)
         self.crawler = crawler
+        self.backoff_base = crawler.settings.getfloat('TOO_MANY_REQUESTS_BACKOFF_BASE', 60)
+        self.backoff_max = crawler.settings.getfloat('TOO_MANY_REQUESTS_BACKOFF_MAX', 900)
+        # per backoff key: when requests can resume, and how many 429 errors were hit in a row
+        self.backoff_until = {}
+        self.backoff_count = {}
+        # how many dropped requests are waiting to be crawled again
+        self.backed_off = 0
+        # per backoff key: when to read again the backoff shared by the other crawler processes
+        self.shared_backoff = crawler.settings.getbool('SHARED_BACKOFF')
+        self.shared_backoff_read_at = {}
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
 
     @classmethod
     def from_crawler(cls, crawler):
         return cls(crawler)
 
+    def get_backoff_delay(self, key, response):
+        retry_after = get_retry_after(response)
+        if retry_after is not None:
+            return retry_after
+        # exponential backoff with jitter, so that requests delayed together do not hit the server together again
+        delay = min(self.backoff_max, self.backoff_base * 2 ** self.backoff_count.get(key, 0))
+        return random.uniform(delay / 2, delay)
+
+    def spider_idle(self, spider):
+        if self.backed_off:
+            # the requests dropped during a backoff are not in the scheduler yet
+            raise DontCloseSpider
+
+    def crawl_later(self, request, spider, delay):
+        def crawl():
+            self.backed_off -= 1
+            # the scheduler has seen the request before
+            retried = request.replace(dont_filter=True)
+            # scrapy 2.6 deprecated, and later removed, the spider argument
+            if scrapy.version_info < (2, 6):
+                self.crawler.engine.crawl(retried, spider)
+            else:
+                self.crawler.engine.crawl(retried)
+
+        # imported here, as importing the reactor installs the default one, see `exceptions`
+        from twisted.internet import reactor
+        self.backed_off += 1
+        reactor.callLater(delay, crawl)
+
+    def retry(self, request, reason, spider):
+        # like `_retry`, whose spider argument later scrapy versions dropped
+        return get_retry_request(request, spider=spider, reason=reason,
+                                 max_retry_times=request.meta.get('max_retry_times', self.max_retry_times),
+                                 priority_adjust=request.meta.get('priority_adjust', self.priority_adjust))
+
+    def get_shared_backoff(self, key, spider):
+        now = time.time()
+        # read at most once per SHARED_BACKOFF_INTERVAL, rather than for every request
+        if now >= self.shared_backoff_read_at.get(key, 0):
+            self.shared_backoff_read_at[key] = now + SHARED_BACKOFF_INTERVAL
+            backoff_until = get_backoff_index(spider.dump_dir).get(key)
+            if backoff_until > self.backoff_until.get(key, 0):
+                self.backoff_until[key] = backoff_until
+        return self.backoff_until.get(key, 0)
+
+    def process_request(self, request, spider):
+        key = get_backoff_key(request)
+        now = time.time()
+        backoff_until = self.backoff_until.get(key, 0)
+        if self.shared_backoff and backoff_until <= now:
+            backoff_until = self.get_shared_backoff(key, spider)
+        delay = backoff_until - now
+        if delay > 0:
+            # hold this request back until the backoff expires, letting everything else proceed
+            self.crawl_later(request, spider, delay)
+            self.crawler.stats.inc_value('backoff/dropped', spider=spider)
+            raise BackedOff('{} backs off for {:.0f} more seconds'.format(key, delay))
+        return None
+
     def process_response(self, request, response, spider):
+        key = get_backoff_key(request)
+        # the closest middleware to the downloader: every response, including retried ones, goes through here
+        metrics = get_metrics()
+        endpoint = get_endpoint(request.url)
+        metrics.inc('responses_total', endpoint=endpoint, status=str(response.status))
+        if 'download_latency' in request.meta:
+            metrics.observe('fetch_seconds', request.meta['download_latency'], endpoint=endpoint)
+        metrics.observe('response_bytes', len(response.body), buckets=BYTES_BUCKETS, endpoint=endpoint)
+        if response.status != 429:
+            self.backoff_count.pop(key, None)
         if request.meta.get('dont_retry', False):
             return response
         elif response.status == 429:
-            self.crawler.engine.pause()
-            spider.logger.error('Hit 429 error: pausing for 180 seconds')
-            time.sleep(180)
-            self.crawler.engine.unpause()
+            now = time.time()
+            # several requests in flight may hit the same 429: only the first one extends the backoff
+            if self.backoff_until.get(key, 0) <= now:
+                delay = self.get_backoff_delay(key, response)
+                self.backoff_until[key] = now + delay
+                self.backoff_count[key] = self.backoff_count.get(key, 0) + 1
+                if self.shared_backoff:
+                    get_backoff_index(spider.dump_dir).put(key, self.backoff_until[key])
+                self.crawler.stats.inc_value('backoff/seconds', delay, spider=spider)
+                metrics.inc('backoff_seconds_total', delay, endpoint=endpoint)
+                spider.logger.error('Hit 429 error on {}: backing off for {:.0f} seconds'.format(key, delay))
+            self.crawler.stats.inc_value('backoff/429_count', spider=spider)
             reason = response_status_message(response.status)
-            return self._retry(request, reason, spider) or response
+            return self.retry(request, reason, spider) or response
         elif response.status in self.retry_http_codes:
             reason = response_status_message(response.status)
-            return self._retry(request, reason, spider) or response
+            return self.retry(request, reason, spider) or response
+        return response
+
+
+class AdaptiveThrottleMiddleware:
+    """
+    adapts the concurrency and delay of the downloader slots of each class of endpoint to the responses of the IA, see
+    `throttle.AimdController`; requests are assigned to downloader slots by rate limit, so that CDX queries and snapshot
+    downloads, although served by the same host, are throttled separately
+    """
+
+    def __init__(self, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.controller = AimdController(
+            crawler.settings.getint('ADAPTIVE_THROTTLE_START_CONCURRENCY') or
+            crawler.settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'),
+            delay=crawler.settings.getfloat('DOWNLOAD_DELAY'),
+            max_concurrency=crawler.settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY') or None,
+            target_latency=crawler.settings.getfloat('ADAPTIVE_THROTTLE_TARGET_LATENCY', TARGET_LATENCY))
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        for endpoint in ENDPOINTS:
+            self.set_stats(endpoint)
+
+    def set_stats(self, endpoint):
+        self.crawler.stats.set_value('adaptive_throttle/{}/concurrency'.format(endpoint),
+                                     self.controller.get_concurrency(endpoint))
+        self.crawler.stats.set_value('adaptive_throttle/{}/delay'.format(endpoint),
+                                     round(self.controller.get_delay(endpoint), 3))
+
+    def update_slot(self, key, endpoint):
+        """
+        applies the current concurrency and delay of `endpoint` to the downloader slot of `key`, once it exists
+        """
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            slot.concurrency = self.controller.get_concurrency(endpoint)
+            slot.delay = self.controller.get_delay(endpoint)
+
+    def record(self, request, status, latency):
+        endpoint = get_endpoint(request.url)
+        if self.controller.record(endpoint, status, latency, request.meta.get('adaptive_throttle_sent_at')):
+            self.update_slot(request.meta['download_slot'], endpoint)
+            self.set_stats(endpoint)
+
+    def process_request(self, request, spider):
+        key = get_rate_limit_key(request.url)
+        # set again for each request, as snapshot requests are built from the request of the original url
+        request.meta['download_slot'] = key
+        request.meta['adaptive_throttle_sent_at'] = time.time()
+        self.update_slot(key, get_endpoint(request.url))
+        return None
+
+    def process_response(self, request, response, spider):
+        self.record(request, response.status, request.meta.get('download_latency'))
         return response
 
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, (error.TimeoutError, error.TCPTimedOutError, defer.TimeoutError)):
+            # other failures, e.g., DNS errors and refused connections, say nothing about the load of the server
+            self.record(request, None, None)
+        return None
+
 
 class Semeval82022IaDownloaderSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -137,20 +347,114 @@ class Semeval82022IaDownloaderDownloaderMiddleware:
 
 
 class FirstSnapshotMiddleware(WaybackMachineMiddleware):
+    """
+    downloads the earliest HTTP 200 snapshot of each url, falling back to the next earliest ones when a snapshot cannot
+    be downloaded; remembers the snapshots chosen for each url in the CDX cache of `dump_dir`, so that reruns do not
+    query the CDX server again
+    """
+
+    # the same endpoints as the parent class, on the server set by `cli.IA_URL`
+    cdx_url_template = CDX_ENDPOINT + '?url={url}&output=json&fl=timestamp,original,statuscode,digest'
+    snapshot_url_template = WAYBACK_PREFIX + '{timestamp}id_/{original}'
+    robots_txt = IA_URL + '/robots.txt'
+
+    def __init__(self, crawler):
+        super(FirstSnapshotMiddleware, self).__init__(crawler)
+        self.cdx_cache_ttl = crawler.settings.getint('WAYBACK_MACHINE_CDX_CACHE_TTL', CDX_TTL)
+        self.max_snapshots = max(1, crawler.settings.getint('WAYBACK_MACHINE_MAX_SNAPSHOTS', 1))
+        self.cdx_time_range = get_cdx_time_range(crawler.settings.get('WAYBACK_MACHINE_TIME_RANGE'))
+        self.cdx_cache = None
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+
+    def spider_opened(self, spider):
+        self.cdx_cache = get_cdx_cache(spider.dump_dir)
+        self.cdx_cache.ttl = self.cdx_cache_ttl
+
+    def get_time_range_key(self):
+        return '-'.join(self.cdx_time_range)
+
+    def build_cdx_request(self, request):
+        cdx_request = super(FirstSnapshotMiddleware, self).build_cdx_request(request)
+        # let the CDX server drop the redirects and the snapshots after the time range, but not those before it, of
+        # which `filter_snapshots` keeps the one live when the time range starts
+        query = urlencode([(key, value) for key, value in get_cdx_params(self.cdx_time_range)
+                           if key not in ('output', 'fl')])
+        return cdx_request.replace(url=cdx_request.url + '&' + query)
+
+    def build_snapshot_request(self, original_request, snapshot_urls):
+        """
+        :param original_request: the request for the original url
+        :param snapshot_urls: the urls of the candidate snapshots, in order of preference
+        :return: the request for the first candidate snapshot, holding the other candidates in its meta
+        """
+        snapshot_url = snapshot_urls[0]
+        snapshot_request = original_request.replace(url=snapshot_url)
+        timestamp = get_wayback_timestamp(snapshot_url)
+        snapshot_time = datetime.strptime(timestamp.ljust(14, '0'), self.timestamp_format).replace(tzinfo=timezone.utc)
+        snapshot_request.meta.update({
+            'wayback_machine_original_request': original_request,
+            'wayback_machine_url': snapshot_request.url,
+            'wayback_machine_time': snapshot_time,
+            'wayback_machine_candidates': list(snapshot_urls[1:]),
+        })
+        return snapshot_request
+
+    def process_request(self, request, spider):
+        if request.url == self.robots_txt or request.meta.get('wayback_machine_url') or \
+                request.meta.get('wayback_machine_cdx_request'):
+            return None
+        snapshot_urls = self.cdx_cache.get(request.url, self.get_time_range_key())
+        if snapshot_urls is None:
+            self.crawler.stats.inc_value('wayback_machine/cdx_cache/miss', spider=spider)
+            get_metrics().inc('cdx_cache_total', outcome='miss')
+            return self.build_cdx_request(request)
+        self.crawler.stats.inc_value('wayback_machine/cdx_cache/hit', spider=spider)
+        get_metrics().inc('cdx_cache_total', outcome='hit')
+        if not snapshot_urls:
+            raise IgnoreRequest('no snapshot of {} (cached)'.format(request.url))
+        return self.build_snapshot_request(request, snapshot_urls)
+
+    def build_snapshot_requests(self, response, meta):
+        original_request = meta['wayback_machine_original_request']
+        # requests dropped on the way, e.g., `BackedOff`, raise IgnoreRequest here, and are not cached
+        snapshot_requests = super(FirstSnapshotMiddleware, self).build_snapshot_requests(response, meta)
+        snapshot_urls = [snapshot_request.url for snapshot_request in snapshot_requests]
+        # cache only listings returned by the CDX server, and not errors such as exhausted 429 retries
+        if response.status == 200:
+            self.cdx_cache.put(original_request.url, self.get_time_range_key(), snapshot_urls)
+        get_metrics().inc('cdx_listings_total', outcome='found' if snapshot_urls else 'empty')
+        if not snapshot_urls:
+            return []
+        # download only the first candidate; the others are tried in turn if it cannot be downloaded
+        return [self.build_snapshot_request(original_request, snapshot_urls)]
 
     def filter_snapshots(self, snapshots):
         snapshots = super(FirstSnapshotMiddleware, self).filter_snapshots(snapshots=snapshots)
         # keep only HTTP 200 snapshots (ignore 3xx redrects, 4xx, 5xx errors)
         snapshots = [snapshot for snapshot in snapshots if (snapshot['statuscode'] == '200')]
-        if not len(snapshots):
-            raise IgnoreRequest
-        sorted_snapshots = sorted(snapshots, key=lambda snapshot: snapshot['datetime'].timestamp(), reverse=False)
-        return [sorted_snapshots[0]]
+        # the listing is sorted by timestamp, up to the end of the time range only; see `cli.get_first_snapshots`, which
+        # selects the same snapshots for the fetcher
+        return heapq.nsmallest(self.max_snapshots, snapshots, key=lambda snapshot: snapshot['datetime'])
 
     def process_response(self, request, response, spider):
-        response_ = super(FirstSnapshotMiddleware, self).process_response(request, response, spider)
+        if request.meta.get('wayback_machine_cdx_request'):
+            # download the first candidate in place of the CDX request, as with cached listings, rather than schedule
+            # it with `engine.schedule` like the parent class, which later scrapy versions removed
+            snapshot_requests = self.build_snapshot_requests(response, request.meta)
+            if snapshot_requests:
+                return snapshot_requests[0]
+            # empty listings are treated as 404s, as by the parent class
+            response_ = Response(request.meta['wayback_machine_original_request'].url, status=404)
+        else:
+            response_ = super(FirstSnapshotMiddleware, self).process_response(request, response, spider)
         if response_.status in [404, 429, 502]:
-            # try downloading the original url
             spider.logger.info('cannot download {}: {}'.format(request.url, response_.status))
+            candidates = request.meta.get('wayback_machine_candidates')
+            if candidates:
+                # try the next earliest snapshot right away
+                self.crawler.stats.inc_value('wayback_machine/snapshot_fallback', spider=spider)
+                get_metrics().inc('snapshot_fallbacks_total')
+                return self.build_snapshot_request(request.meta['wayback_machine_original_request'], candidates)
+            # leave the article to the retry phases
             raise IgnoreRequest
         return response_
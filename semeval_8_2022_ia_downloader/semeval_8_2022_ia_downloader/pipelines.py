@@ -2,12 +2,77 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from twisted.internet import defer
+
+from semeval_8_2022_ia_downloader.metrics import get_metrics
+from semeval_8_2022_ia_downloader.plan import load_plan
+from semeval_8_2022_ia_downloader.state import get_state_index
+from semeval_8_2022_ia_downloader.workers import init_worker, parse_article_task
 
 
 class Semeval82022IaDownloaderPipeline:
+    """
+    parses downloaded articles in a pool of worker processes, so that parsing neither blocks the reactor nor is
+    limited to a single core
+    """
+
+    def __init__(self, processes, max_pending):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.executor = None
+        self.semaphore = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        processes = crawler.settings.getint('PARSER_PROCESSES') or os.cpu_count()
+        max_pending = crawler.settings.getint('PARSER_MAX_PENDING') or 2 * processes
+        return cls(processes, max_pending)
+
+    def open_spider(self, spider):
+        languages = sorted(load_plan(spider.links_file, spider.dump_dir, shard=spider.shard)['lang'].dropna().unique())
+        self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=init_worker,
+                                            initargs=(languages,))
+        # at most `max_pending` articles are handed to the workers at a time; the others wait here together with their
+        # response, which counts towards SCRAPER_SLOT_MAX_ACTIVE_SIZE and so stops the engine from downloading more
+        self.semaphore = defer.DeferredSemaphore(self.max_pending)
+
+    def close_spider(self, spider):
+        self.executor.shutdown(wait=True)
+
     def process_item(self, item, spider):
-        return item
+        return self.semaphore.run(self._parse, item, spider)
+
+    def _parse(self, item, spider):
+        # imported here, as importing the reactor installs the default one, see `exceptions`
+        from twisted.internet import reactor
+        adapter = ItemAdapter(item)
+        d = defer.Deferred()
+        future = self.executor.submit(parse_article_task, (spider.dump_dir,
+                                                           adapter['article_id'],
+                                                           adapter['article_link'],
+                                                           adapter['article_lang'],
+                                                           adapter['html'],
+                                                           adapter['phase']))
+        future.add_done_callback(lambda f: reactor.callFromThread(self._parsed, f, d, item, spider))
+        return d
+
+    def _parsed(self, future, d, item, spider):
+        adapter = ItemAdapter(item)
+        # the html is in the dump folder by now; do not keep it in memory for the rest of the item's life
+        adapter['html'] = None
+        error = future.exception()
+        text_length = None
+        if error is not None:
+            spider.logger.error('cannot parse {}: {!r}'.format(adapter['article_link'], error))
+            get_state_index(spider.dump_dir).record_failure(adapter['article_id'], adapter['phase'], repr(error))
+        else:
+            text_length, metrics = future.result()
+            get_metrics().merge(metrics)
+        get_metrics().inc('articles_total', phase=adapter['phase'],
+                          outcome='failure' if text_length is None else 'success')
+        d.callback(item)
@@ -13,6 +13,10 @@ SPIDER_MODULES = ['semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.spi
 NEWSPIDER_MODULE = 'semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.spiders'
 
 WAYBACK_MACHINE_TIME_RANGE = (20100101, 20210707)
+# How many snapshots to try for each url, from the earliest one, before leaving it to the retry phases
+WAYBACK_MACHINE_MAX_SNAPSHOTS = 3
+# How long the snapshots chosen for each url are cached in dump_dir, in seconds
+WAYBACK_MACHINE_CDX_CACHE_TTL = 30 * 24 * 60 * 60
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 # USER_AGENT = 'semeval_8_2022_ia_downloader (+http://www.euagendas.org/semeval2022)'
@@ -55,19 +59,24 @@ DOWNLOADER_MIDDLEWARES = {
     'semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.middlewares.FirstSnapshotMiddleware': 543,
     'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
     'semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.middlewares.TooManyRequestsRetryMiddleware': 544,
+    'semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.middlewares.AdaptiveThrottleMiddleware': 545,
 }
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+EXTENSIONS = {
+    'semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.extensions.ContentGate': 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    'semeval_8_2022_ia_downloader.pipelines.Semeval82021IaDownloaderPipeline': 300,
-#}
+ITEM_PIPELINES = {
+    'semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.pipelines.Semeval82022IaDownloaderPipeline': 300,
+}
+# Number of worker processes parsing articles (default: one per core), and how many articles can be handed to them
+# at a time (default: twice the number of processes)
+# PARSER_PROCESSES = 0
+# PARSER_MAX_PENDING = 0
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -91,3 +100,21 @@ DOWNLOADER_MIDDLEWARES = {
 #HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
 HTTPERROR_ALLOWED_CODES = [404, 502]
 RETRY_HTTP_CODES = [429]
+# Backoff after a 429 error, unless the response has a Retry-After header: doubles with each 429 error in a row for
+# the same host (or IA endpoint), up to the maximum, in seconds
+TOO_MANY_REQUESTS_BACKOFF_BASE = 60
+TOO_MANY_REQUESTS_BACKOFF_MAX = 900
+# Whether the backoffs are shared with the other crawler processes of the dump (--crawl_processes), through its state
+# database
+SHARED_BACKOFF = False
+# Adaptive concurrency and delay of CDX queries and snapshot downloads (--adaptive_throttle): starts from
+# ADAPTIVE_THROTTLE_START_CONCURRENCY requests in flight and DOWNLOAD_DELAY, and never exceeds the hard ceiling
+ADAPTIVE_THROTTLE_ENABLED = False
+ADAPTIVE_THROTTLE_START_CONCURRENCY = 0
+ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 0
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 5
+# Snapshots whose Content-Type does not start with one of these media types (all of them if empty), or whose body is
+# larger than this many bytes (any size if 0), are not downloaded, and not downloaded again (--content_types,
+# --max_size)
+ARTICLE_CONTENT_TYPES = ['text/html', 'application/xhtml', 'text/plain']
+ARTICLE_MAX_SIZE = 10 * 1024 * 1024
@@ -1,16 +1,34 @@
 import scrapy
+from scrapy.exceptions import StopDownload
 from scrapy.spidermiddlewares.httperror import HttpError
 from twisted.internet.error import DNSLookupError
 
-from semeval_8_2022_ia_downloader.cli import parse_article, get_remaining_articles
+from semeval_8_2022_ia_downloader.cli import get_remaining_articles
+from semeval_8_2022_ia_downloader.metrics import get_metrics
+from semeval_8_2022_ia_downloader.plan import get_partition
+from semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.items import Semeval82022IaDownloaderItem
+from semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.exceptions import BackedOff
+from semeval_8_2022_ia_downloader.state import get_state_index
 
 
 class IaArticleSpider(scrapy.Spider):
     name = "IaArticle"
+    # pair `(index, count)` of the shard of the links file to download, or None for all of it, see `cli.parse_shard`
+    shard = None
+    # pair `(index, count)` of the partition of the articles to download when crawling in several processes, see
+    # `crawl.crawl_partitions`, or None for all articles
+    partition = None
+
+    async def start(self):
+        # the initial requests of scrapy 2.13 and later, which no longer reads `start_requests`
+        for request in self.start_requests():
+            yield request
 
     def start_requests(self):
         for article_id, article_link, article_lang in get_remaining_articles(self.links_file, self.dump_dir,
-                                                                             self.min_text_length):
+                                                                             self.min_text_length, self.shard):
+            if self.partition is not None and get_partition(article_id, self.partition[1]) != self.partition[0]:
+                continue
             yield scrapy.Request(article_link,
                                  errback=self.errback_httpbin,
                                  meta={'article_id': article_id,
@@ -22,7 +40,20 @@ class IaArticleSpider(scrapy.Spider):
         # log all errback failures,
         # in case you want to do something special for some errors,
         # you may need the failure's type
+        if failure.check(BackedOff):
+            # crawled again once the backoff expires
+            return
+        article_id = failure.request.meta.get('article_id')
+        if failure.check(StopDownload) and 'content_gate_rejected' in failure.request.meta:
+            # not an article, see `extensions.ContentGate`
+            self.logger.info('rejected %s: %s', failure.request.url, failure.request.meta['content_gate_rejected'])
+            get_state_index(self.dump_dir).record_rejection(article_id, 'cdx',
+                                                            failure.request.meta['content_gate_rejected'])
+            get_metrics().inc('articles_total', phase='cdx', outcome='rejected')
+            return
         self.logger.error(repr(failure))
+        if article_id is not None:
+            get_state_index(self.dump_dir).record_failure(article_id, 'cdx', repr(failure.value))
 
         if failure.check(HttpError):
             # you can get the response
@@ -39,8 +70,9 @@ class IaArticleSpider(scrapy.Spider):
             self.logger.error('TimeoutError on %s', request.url)
 
     def parse(self, response):
-        parse_article(self.dump_dir,
-                      response.meta['article_id'],
-                      response.meta['article_link'],
-                      response.meta['article_lang'],
-                      html=response.body)
+        # parsed in worker processes by Semeval82022IaDownloaderPipeline
+        yield Semeval82022IaDownloaderItem(article_id=response.meta['article_id'],
+                                           article_link=response.meta['article_link'],
+                                           article_lang=response.meta['article_lang'],
+                                           html=response.body,
+                                           phase='cdx')
@@ -0,0 +1,599 @@
+"""Persistent download state for semeval_8_2022_ia_downloader, kept as a SQLite database inside `dump_dir`."""
+import hashlib
+import json
+import os
+import os.path
+import sqlite3
+import time
+
+from semeval_8_2022_ia_downloader.storage import get_storage
+
+STATE_FILENAME = '.state.sqlite3'
+
+STATUS_DOWNLOADED = 'downloaded'
+STATUS_FAILED = 'failed'
+# responses that cannot be articles, e.g., PDFs, see `gating.get_rejection`; not downloaded again
+STATUS_REJECTED = 'rejected'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    article_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    phase TEXT,
+    text_length INTEGER,
+    content_hash TEXT,
+    last_attempt REAL,
+    last_error TEXT,
+    extractor_version TEXT
+);
+CREATE INDEX IF NOT EXISTS articles_status_text_length ON articles (status, text_length);
+CREATE INDEX IF NOT EXISTS articles_content_hash ON articles (content_hash);
+
+CREATE TABLE IF NOT EXISTS redirects (
+    link TEXT PRIMARY KEY,
+    resolved_link TEXT,
+    error TEXT,
+    resolved_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS cdx (
+    url TEXT NOT NULL,
+    time_range TEXT NOT NULL,
+    snapshot_urls TEXT NOT NULL,
+    queried_at REAL NOT NULL,
+    PRIMARY KEY (url, time_range)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS packs (
+    article_id TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    pack TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    compression TEXT NOT NULL,
+    PRIMARY KEY (article_id, extension)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS plan (
+    article_id TEXT PRIMARY KEY,
+    lang TEXT,
+    domain TEXT,
+    status TEXT,
+    text_length INTEGER
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS plan_lang_domain_status ON plan (lang, domain, status, text_length);
+
+CREATE TABLE IF NOT EXISTS backoffs (
+    key TEXT PRIMARY KEY,
+    backoff_until REAL NOT NULL
+) WITHOUT ROWID;
+
+-- the status of each article is copied to the plan, so that counting the progress of a dump needs no join
+CREATE TRIGGER IF NOT EXISTS articles_insert_plan AFTER INSERT ON articles BEGIN
+    UPDATE plan SET status = NEW.status, text_length = NEW.text_length WHERE article_id = NEW.article_id;
+END;
+CREATE TRIGGER IF NOT EXISTS articles_update_plan AFTER UPDATE OF status, text_length ON articles BEGIN
+    UPDATE plan SET status = NEW.status, text_length = NEW.text_length WHERE article_id = NEW.article_id;
+END;
+"""
+
+# how long resolved redirects, and failed resolutions, are trusted before resolving the link again
+REDIRECT_TTL = 30 * 24 * 60 * 60
+REDIRECT_FAILURE_TTL = 24 * 60 * 60
+
+# how long the snapshots listed by the CDX server are trusted before querying it again
+CDX_TTL = 30 * 24 * 60 * 60
+
+# one connection per (class, process, dump_dir): sqlite connections must not be shared across forked processes
+_CONNECTIONS = {}
+
+
+def get_content_hash(html):
+    """
+    computes the hash used to identify the content of a downloaded page
+    :param html: the raw html of the page, as bytes or str
+    :return: the hex digest of the html
+    """
+    if isinstance(html, str):
+        html = html.encode('utf8')
+    return hashlib.sha1(html).hexdigest()
+
+
+def connect(dump_dir):
+    """
+    opens the sqlite database holding the state of `dump_dir`, creating it if needed
+    :param dump_dir: the root folder where articles are saved
+    :return: a `sqlite3.Connection` in autocommit mode
+    """
+    os.makedirs(dump_dir, exist_ok=True)
+    # autocommit mode: each statement is its own transaction, so that concurrent workers never wait on each other
+    # for longer than a single write
+    connection = sqlite3.connect(os.path.join(dump_dir, STATE_FILENAME), timeout=60, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(_SCHEMA)
+    migrate(connection)
+    return connection
+
+
+def migrate(connection):
+    """
+    adds the columns introduced after a state database was created
+    :param connection: a connection to the state database
+    :return: None
+    """
+    columns = {row[1] for row in connection.execute('PRAGMA table_info(articles)')}
+    if 'extractor_version' not in columns:
+        connection.execute('ALTER TABLE articles ADD COLUMN extractor_version TEXT')
+
+
+def _get_cached(cls, dump_dir):
+    key = (cls, os.getpid(), os.path.abspath(dump_dir))
+    if key not in _CONNECTIONS:
+        _CONNECTIONS[key] = cls(dump_dir)
+    return _CONNECTIONS[key]
+
+
+def get_state_index(dump_dir):
+    """
+    returns the state index for `dump_dir`, opening it if needed; the index is cached per process
+    :param dump_dir: the root folder where articles are saved
+    :return: an `ArticleStateIndex`
+    """
+    return _get_cached(ArticleStateIndex, dump_dir)
+
+
+def get_redirect_cache(dump_dir):
+    """
+    returns the redirect cache for `dump_dir`, opening it if needed; the cache is cached per process
+    :param dump_dir: the root folder where articles are saved
+    :return: a `RedirectCache`
+    """
+    return _get_cached(RedirectCache, dump_dir)
+
+
+def get_cdx_cache(dump_dir):
+    """
+    returns the CDX cache for `dump_dir`, opening it if needed; the cache is cached per process
+    :param dump_dir: the root folder where articles are saved
+    :return: a `CdxCache`
+    """
+    return _get_cached(CdxCache, dump_dir)
+
+
+def get_pack_index(dump_dir):
+    """
+    returns the index of the pack files of `dump_dir`, opening it if needed; the index is cached per process
+    :param dump_dir: the root folder where articles are saved
+    :return: a `PackIndex`
+    """
+    return _get_cached(PackIndex, dump_dir)
+
+
+def get_plan_index(dump_dir):
+    """
+    returns the copy of the plan of `dump_dir` kept in its state database, opening it if needed; the index is cached per
+    process
+    :param dump_dir: the root folder where articles are saved
+    :return: a `PlanIndex`
+    """
+    return _get_cached(PlanIndex, dump_dir)
+
+
+def get_backoff_index(dump_dir):
+    """
+    returns the backoffs shared by the crawler processes of `dump_dir`, opening them if needed; the index is cached per
+    process
+    :param dump_dir: the root folder where articles are saved
+    :return: a `BackoffIndex`
+    """
+    return _get_cached(BackoffIndex, dump_dir)
+
+
+class ArticleStateIndex:
+    """
+    records, for each article id, whether and how it was downloaded, so that the set of remaining articles can be
+    computed with an indexed query rather than by loading every json file in `dump_dir`
+    """
+
+    def __init__(self, dump_dir):
+        self.dump_dir = dump_dir
+        self.connection = connect(dump_dir)
+        # user_version is 0 until the index has been populated from the files already in `dump_dir`
+        if not self.connection.execute('PRAGMA user_version').fetchone()[0]:
+            self.rebuild()
+            self.connection.execute('PRAGMA user_version = 1')
+
+    def rebuild(self):
+        """
+        populates the index from the json files already in `dump_dir`, whatever their compression; this is the only
+        full scan of the dump, and only happens the first time a dump created by an older version is opened
+        :return: the number of articles found
+        """
+        storage = get_storage(self.dump_dir)
+        rows = []
+        for article_id in storage.iter_article_ids('.json'):
+            filepath, _ = storage.find(article_id, '.json')
+            try:
+                article_json = json.loads(storage.read(article_id, '.json'))
+                text_length = len(article_json.get('text', '').strip())
+            except (OSError, ValueError, EOFError) as e:
+                rows.append((article_id, STATUS_FAILED, None, None, None, os.path.getmtime(filepath), repr(e)))
+                continue
+            html = storage.read(article_id, '.html')
+            content_hash = get_content_hash(html) if html is not None else None
+            rows.append((article_id, STATUS_DOWNLOADED, None, text_length, content_hash,
+                         os.path.getmtime(filepath), None))
+        self.connection.execute('BEGIN')
+        self.connection.executemany("""
+            INSERT OR REPLACE INTO articles (article_id, status, phase, text_length, content_hash, last_attempt,
+                                             last_error)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+        self.connection.execute('COMMIT')
+        return len(rows)
+
+    def record_success(self, article_id, phase, text_length, content_hash, extractor_version=None):
+        """
+        records that an article was downloaded and parsed
+        :param article_id: the id of the article
+        :param phase: the phase that downloaded the article, e.g., "cdx" or "original"
+        :param text_length: the length of the stripped `text` extracted from the article
+        :param content_hash: the hash of the html of the article, see `get_content_hash`
+        :param extractor_version: the version of the extraction that parsed the article, see `cli.get_extractor_version`
+        :return: None
+        """
+        self.connection.execute("""
+            INSERT OR REPLACE INTO articles (article_id, status, phase, text_length, content_hash, last_attempt,
+                                             last_error, extractor_version)
+            VALUES (?, ?, ?, ?, ?, ?, NULL, ?)
+            """, (article_id, STATUS_DOWNLOADED, phase, text_length, content_hash, time.time(), extractor_version))
+
+    def record_failure(self, article_id, phase, error):
+        """
+        records a failed attempt to download an article; previously downloaded articles keep their status
+        :param article_id: the id of the article
+        :param phase: the phase that attempted the download
+        :param error: a description of the error
+        :return: None
+        """
+        self.connection.execute("""
+            INSERT INTO articles (article_id, status, phase, last_attempt, last_error) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (article_id) DO UPDATE SET
+                phase = CASE WHEN status = ? THEN phase ELSE excluded.phase END,
+                status = CASE WHEN status = ? THEN status ELSE excluded.status END,
+                last_attempt = excluded.last_attempt,
+                last_error = excluded.last_error
+            """, (article_id, STATUS_FAILED, phase, time.time(), str(error), STATUS_DOWNLOADED, STATUS_DOWNLOADED))
+
+    def put(self, state):
+        """
+        records the state of an article as is, e.g., as copied from the state of another dump
+        :param state: dict with the state of the article, see `get`
+        :return: None
+        """
+        columns = ['article_id', 'status', 'phase', 'text_length', 'content_hash', 'last_attempt', 'last_error',
+                   'extractor_version']
+        self.connection.execute('INSERT OR REPLACE INTO articles ({}) VALUES ({})'.format(
+            ', '.join(columns), ', '.join('?' * len(columns))), [state.get(column) for column in columns])
+
+    def merge_from(self, source_dir):
+        """
+        adds the failures, the cached redirects and CDX queries, and the plan of another dump to this one; the
+        downloaded articles are added by `merge.merge_dump`, together with their files
+        :param source_dir: the root folder of the other dump, e.g., of a shard, see `plan.get_shards`
+        :return: None
+        """
+        # opens, and if needed creates or upgrades, the state of the other dump
+        get_state_index(source_dir)
+        self.connection.execute('ATTACH DATABASE ? AS source', (os.path.join(source_dir, STATE_FILENAME),))
+        self.connection.execute('BEGIN')
+        # failures and rejections never replace a downloaded article, and only replace a failure or rejection if they
+        # are more recent; the `WHERE true` tells sqlite that `ON CONFLICT` is not part of the `SELECT`
+        self.connection.execute("""
+            INSERT INTO articles (article_id, status, phase, last_attempt, last_error)
+            SELECT article_id, status, phase, last_attempt, last_error FROM source.articles
+            WHERE status != ? AND true
+            ON CONFLICT (article_id) DO UPDATE SET
+                status = excluded.status,
+                phase = excluded.phase,
+                last_attempt = excluded.last_attempt,
+                last_error = excluded.last_error
+            WHERE articles.status != ? AND coalesce(excluded.last_attempt > articles.last_attempt, 1)
+            """, (STATUS_DOWNLOADED, STATUS_DOWNLOADED))
+        self.connection.execute("""
+            INSERT INTO redirects SELECT link, resolved_link, error, resolved_at FROM source.redirects WHERE true
+            ON CONFLICT (link) DO UPDATE SET
+                resolved_link = excluded.resolved_link,
+                error = excluded.error,
+                resolved_at = excluded.resolved_at
+            WHERE excluded.resolved_at > redirects.resolved_at
+            """)
+        self.connection.execute("""
+            INSERT INTO cdx SELECT url, time_range, snapshot_urls, queried_at FROM source.cdx WHERE true
+            ON CONFLICT (url, time_range) DO UPDATE SET
+                snapshot_urls = excluded.snapshot_urls,
+                queried_at = excluded.queried_at
+            WHERE excluded.queried_at > cdx.queried_at
+            """)
+        self.connection.execute("""
+            INSERT OR REPLACE INTO plan (article_id, lang, domain, status, text_length)
+            SELECT plan.article_id, plan.lang, plan.domain, articles.status, articles.text_length
+            FROM source.plan LEFT JOIN main.articles ON articles.article_id = plan.article_id
+            """)
+        self.connection.execute('COMMIT')
+        self.connection.execute('DETACH DATABASE source')
+
+    def record_rejection(self, article_id, phase, reason):
+        """
+        records that an article was not downloaded, as the response cannot be an article; previously downloaded
+        articles keep their status
+        :param article_id: the id of the article
+        :param phase: the phase that rejected the response
+        :param reason: the reason, see `gating.get_rejection`
+        :return: None
+        """
+        self.connection.execute("""
+            INSERT INTO articles (article_id, status, phase, last_attempt, last_error) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (article_id) DO UPDATE SET
+                phase = excluded.phase,
+                status = excluded.status,
+                last_attempt = excluded.last_attempt,
+                last_error = excluded.last_error
+            WHERE status != ?
+            """, (article_id, STATUS_REJECTED, phase, time.time(), reason, STATUS_DOWNLOADED))
+
+    def clear_rejections(self):
+        """
+        forgets the rejected articles, e.g., so that they are downloaded again with other limits
+        :return: the number of articles forgotten
+        """
+        return self.connection.execute('DELETE FROM articles WHERE status = ?', (STATUS_REJECTED,)).rowcount
+
+    def get_completed_ids(self, min_text_length=0):
+        """
+        finds the articles that do not need downloading again
+        :param min_text_length: articles whose `text` is at most `min_text_length` characters are not completed
+        :return: set of article ids, including the rejected articles
+        """
+        cursor = self.connection.execute("""
+            SELECT article_id FROM articles WHERE status = ? AND text_length > ? OR status = ?
+            """, (STATUS_DOWNLOADED, min_text_length, STATUS_REJECTED))
+        return {article_id for article_id, in cursor}
+
+    def find_by_content_hash(self, content_hash, article_id=None, extractor_version=None):
+        """
+        finds a downloaded article whose html is byte-identical to another
+        :param content_hash: the hash of the html, see `get_content_hash`
+        :param article_id: the id of the article to prefer, if it has the same html
+        :param extractor_version: only consider articles parsed by this version of the extraction
+        :return: dict with the state of the article, or None if no downloaded article has the same html
+        """
+        cursor = self.connection.execute("""
+            SELECT * FROM articles WHERE content_hash = ? AND status = ? AND extractor_version IS ?
+            ORDER BY article_id = ? DESC LIMIT 1
+            """, (content_hash, STATUS_DOWNLOADED, extractor_version, article_id))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def get(self, article_id):
+        """
+        :param article_id: the id of the article
+        :return: dict with the state of the article, or None if the article was never attempted
+        """
+        cursor = self.connection.execute('SELECT * FROM articles WHERE article_id = ?', (article_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+
+class RedirectCache:
+    """
+    remembers where links from news aggregators redirect to, including links that could not be resolved
+    """
+
+    def __init__(self, dump_dir, ttl=REDIRECT_TTL, failure_ttl=REDIRECT_FAILURE_TTL):
+        self.connection = connect(dump_dir)
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+
+    def get(self, link):
+        """
+        :param link: the link to resolve
+        :return: pair `(resolved_link, error)`, where `resolved_link` is None if the link could not be resolved, or
+                 None if the link was never resolved or its entry expired
+        """
+        row = self.connection.execute('SELECT resolved_link, error, resolved_at FROM redirects WHERE link = ?',
+                                      (link,)).fetchone()
+        if row is None:
+            return None
+        resolved_link, error, resolved_at = row
+        ttl = self.ttl if resolved_link is not None else self.failure_ttl
+        if resolved_at + ttl < time.time():
+            return None
+        return resolved_link, error
+
+    def put(self, link, resolved_link, error=None):
+        """
+        records the outcome of resolving a link
+        :param link: the link to resolve
+        :param resolved_link: the url the link redirects to, or None if the link could not be resolved
+        :param error: a description of the error, if the link could not be resolved
+        :return: None
+        """
+        self.connection.execute('INSERT OR REPLACE INTO redirects VALUES (?, ?, ?, ?)',
+                                (link, resolved_link, error, time.time()))
+
+
+class CdxCache:
+    """
+    remembers the snapshots chosen from the CDX server for each url and time range, including urls without any
+    """
+
+    def __init__(self, dump_dir, ttl=CDX_TTL):
+        self.connection = connect(dump_dir)
+        self.ttl = ttl
+
+    def get(self, url, time_range):
+        """
+        :param url: the url queried on the CDX server
+        :param time_range: a string identifying the time range of the query
+        :return: list of snapshot urls, empty if the url has no usable snapshot, or None if the url was never queried
+                 or its entry expired
+        """
+        row = self.connection.execute('SELECT snapshot_urls, queried_at FROM cdx WHERE url = ? AND time_range = ?',
+                                      (url, time_range)).fetchone()
+        if row is None or row[1] + self.ttl < time.time():
+            return None
+        return json.loads(row[0])
+
+    def put(self, url, time_range, snapshot_urls):
+        """
+        records the snapshots chosen for a url
+        :param url: the url queried on the CDX server
+        :param time_range: a string identifying the time range of the query
+        :param snapshot_urls: list of snapshot urls, empty if the url has no usable snapshot
+        :return: None
+        """
+        self.connection.execute('INSERT OR REPLACE INTO cdx VALUES (?, ?, ?, ?)',
+                                (url, time_range, json.dumps(snapshot_urls), time.time()))
+
+
+class BackoffIndex:
+    """
+    shares, among the crawler processes of a dump, until when each rate limit backs off after a 429 error, see
+    `middlewares.TooManyRequestsRetryMiddleware`
+    """
+
+    def __init__(self, dump_dir):
+        self.connection = connect(dump_dir)
+
+    def get(self, key):
+        """
+        :param key: the rate limit, see `cli.get_rate_limit_key`
+        :return: the time until which requests counting against the rate limit back off, or 0 if they never did
+        """
+        row = self.connection.execute('SELECT backoff_until FROM backoffs WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def put(self, key, backoff_until):
+        """
+        records a backoff, unless another process already recorded a longer one
+        :param key: the rate limit, see `cli.get_rate_limit_key`
+        :param backoff_until: the time until which requests counting against the rate limit back off
+        :return: None
+        """
+        self.connection.execute('INSERT INTO backoffs VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET '
+                                'backoff_until = excluded.backoff_until WHERE excluded.backoff_until > backoff_until',
+                                (key, backoff_until))
+
+
+class PackIndex:
+    """
+    locates the record of each article in the pack files of `dump_dir`, see `storage.PackedStorage`
+    """
+
+    def __init__(self, dump_dir):
+        self.connection = connect(dump_dir)
+
+    def get(self, article_id, extension):
+        """
+        :param article_id: the id of the article
+        :param extension: ".json" for the parsed article, or ".html" for the raw html
+        :return: tuple `(pack, offset, length, compression)` locating the record, or None if the article is not packed
+        """
+        return self.connection.execute(
+            'SELECT pack, offset, length, compression FROM packs WHERE article_id = ? AND extension = ?',
+            (article_id, extension)).fetchone()
+
+    def put(self, article_id, extension, pack, offset, length, compression):
+        """
+        records where a record was appended, replacing any older record of the same article
+        :param article_id: the id of the article
+        :param extension: ".json" for the parsed article, or ".html" for the raw html
+        :param pack: the name of the pack file
+        :param offset: the offset of the record in the pack file, in bytes
+        :param length: the length of the record, in bytes, as stored
+        :param compression: the compression of the record
+        :return: None
+        """
+        self.connection.execute('INSERT OR REPLACE INTO packs VALUES (?, ?, ?, ?, ?, ?)',
+                                (article_id, extension, pack, offset, length, compression))
+
+    def delete(self, article_id, extension):
+        """
+        forgets the record of an article
+        :return: None
+        """
+        self.connection.execute('DELETE FROM packs WHERE article_id = ? AND extension = ?', (article_id, extension))
+
+    def iter_article_ids(self, extension):
+        """
+        :param extension: ".json" for the parsed articles, or ".html" for the raw html
+        :return: generator of the ids of the packed articles
+        """
+        cursor = self.connection.execute('SELECT article_id FROM packs WHERE extension = ?', (extension,))
+        for article_id, in cursor:
+            yield article_id
+
+
+class PlanIndex:
+    """
+    the language and website of each article of the plan, so that the progress of a dump can be counted with a single
+    query, without reading the links file, see `plan.load_plan`
+    """
+
+    # the columns that the counts of `get_status_counts` can be grouped by
+    GROUP_COLUMNS = ['lang', 'domain']
+
+    def __init__(self, dump_dir):
+        self.connection = connect(dump_dir)
+
+    def count(self):
+        """
+        :return: the number of articles in the plan
+        """
+        return self.connection.execute('SELECT count(*) FROM plan').fetchone()[0]
+
+    def replace(self, rows):
+        """
+        replaces the plan
+        :param rows: iterable of triplets `(article_id, lang, domain)`
+        :return: None
+        """
+        self.connection.execute('BEGIN')
+        self.connection.execute('DELETE FROM plan')
+        self.connection.executemany('INSERT OR REPLACE INTO plan (article_id, lang, domain) VALUES (?, ?, ?)', rows)
+        self.connection.execute("""
+            UPDATE plan SET (status, text_length) = (
+                SELECT status, text_length FROM articles WHERE articles.article_id = plan.article_id)
+            """)
+        self.connection.execute('COMMIT')
+
+    def get_status_counts(self, group_by, min_text_length=0):
+        """
+        counts the articles of the plan by status
+        :param group_by: list of columns among `GROUP_COLUMNS`, possibly empty
+        :param min_text_length: downloaded articles whose `text` is at most `min_text_length` characters are counted as
+               short rather than downloaded, as they are downloaded again, see `ArticleStateIndex.get_completed_ids`
+        :return: list of dicts mapping the columns of `group_by`, and "total", "downloaded", "short_text", "failed",
+                 "rejected" and "missing", to their value, largest groups first
+        """
+        unknown_columns = [column for column in group_by if column not in self.GROUP_COLUMNS]
+        if unknown_columns:
+            raise ValueError('cannot group by: {}'.format(', '.join(unknown_columns)))
+        columns = ''.join('{}, '.format(column) for column in group_by)
+        cursor = self.connection.execute("""
+            SELECT {0}count(*) AS total,
+                   coalesce(sum(status = ? AND text_length > ?), 0) AS downloaded,
+                   coalesce(sum(status = ? AND coalesce(text_length <= ?, 1)), 0) AS short_text,
+                   coalesce(sum(status = ?), 0) AS failed,
+                   coalesce(sum(status = ?), 0) AS rejected,
+                   coalesce(sum(status IS NULL), 0) AS missing
+            FROM plan {1} ORDER BY total DESC
+            """.format(columns, 'GROUP BY ' + ', '.join(group_by) if group_by else ''),
+            (STATUS_DOWNLOADED, min_text_length, STATUS_DOWNLOADED, min_text_length, STATUS_FAILED, STATUS_REJECTED))
+        return [dict(zip([column[0] for column in cursor.description], row)) for row in cursor]
@@ -0,0 +1,554 @@
+"""Storage of the downloaded articles in `dump_dir`, optionally compressed, as a tree of files or in pack files."""
+import filecmp
+import gzip
+import json
+import os
+import os.path
+import shutil
+import uuid
+from datetime import datetime, timezone
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+STORAGE_FILENAME = '.storage.json'
+ZSTD_DICT_FILENAME = '.zstd.dict'
+
+# file extension added by each compression
+COMPRESSION_EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# how articles are laid out in `dump_dir`: two files per article, or appended to pack files
+LAYOUT_TREE = 'tree'
+LAYOUT_PACKED = 'packed'
+LAYOUTS = [LAYOUT_TREE, LAYOUT_PACKED]
+
+PACKS_DIRNAME = 'packs'
+# the raw html goes to WARC files, the parsed articles to JSON lines files
+PACK_KINDS = {'.html': ('html', '.warc'), '.json': ('json', '.jsonl')}
+# a new pack file is started once the current one reaches this size
+PACK_MAX_SIZE = 1 << 30
+
+# one storage per (process, dump_dir): pack files and zstd compressors cannot be shared across processes
+_STORAGES = {}
+
+
+def get_storage_config(dump_dir):
+    """
+    :param dump_dir: the root folder where articles are saved
+    :return: dict with the `compression` and `layout` set for `dump_dir` by `configure_storage`
+    """
+    config = {'compression': 'none', 'layout': LAYOUT_TREE}
+    config_path = os.path.join(dump_dir, STORAGE_FILENAME)
+    if os.path.exists(config_path):
+        with open(config_path, encoding='utf8') as f:
+            config.update(json.loads(f.read()))
+    return config
+
+
+def configure_storage(dump_dir, compression=None, zstd_dict=None, layout=None):
+    """
+    sets how articles are stored in `dump_dir`; articles already stored are still read, whatever their compression
+    and layout
+    :param dump_dir: the root folder where to save articles
+    :param compression: one of `COMPRESSION_EXTENSIONS`, or None to keep the compression already set for `dump_dir`
+    :param zstd_dict: path to a dictionary trained with `zstd --train`, to compress articles with zstd; copied into
+           `dump_dir`, where readers find it
+    :param layout: one of `LAYOUTS`, or None to keep the layout already set for `dump_dir`
+    :return: None
+    """
+    if compression is None and layout is None:
+        return
+    config = get_storage_config(dump_dir)
+    config['compression'] = compression or config['compression']
+    config['layout'] = layout or config['layout']
+    if config['compression'] not in COMPRESSION_EXTENSIONS:
+        raise ValueError('unknown compression: {}'.format(config['compression']))
+    if config['layout'] not in LAYOUTS:
+        raise ValueError('unknown layout: {}'.format(config['layout']))
+    if config['compression'] == 'zstd' and zstandard is None:
+        raise ImportError('zstd compression requires the zstandard package: pip install zstandard')
+    os.makedirs(dump_dir, exist_ok=True)
+    if zstd_dict is not None:
+        shutil.copyfile(zstd_dict, os.path.join(dump_dir, ZSTD_DICT_FILENAME))
+    with open(os.path.join(dump_dir, STORAGE_FILENAME), 'w', encoding='utf8') as f:
+        f.write(json.dumps(config))
+    _STORAGES.pop((os.getpid(), os.path.abspath(dump_dir)), None)
+
+
+def get_storage(dump_dir):
+    """
+    returns the storage of `dump_dir`, as set by `configure_storage`; the storage is cached per process
+    :param dump_dir: the root folder where articles are saved
+    :return: a `TreeStorage` or a `PackedStorage`, which also reads the articles stored with the other layout
+    """
+    key = (os.getpid(), os.path.abspath(dump_dir))
+    if key not in _STORAGES:
+        config = get_storage_config(dump_dir)
+        _STORAGES[key] = make_storage(dump_dir, config['layout'], config['compression'])
+    return _STORAGES[key]
+
+
+def has_same_zstd_dict(dump_dir, other_dump_dir):
+    """
+    :param dump_dir: the root folder where articles are saved
+    :param other_dump_dir: the root folder of another dump
+    :return: whether articles compressed with zstd in one dump can be read in the other, i.e., whether both dumps have
+             the same dictionary, or none
+    """
+    paths = [os.path.join(d, ZSTD_DICT_FILENAME) for d in (dump_dir, other_dump_dir)]
+    exists = [os.path.exists(path) for path in paths]
+    if not any(exists):
+        return True
+    return all(exists) and filecmp.cmp(*paths, shallow=False)
+
+
+def make_storage(dump_dir, layout, compression='none'):
+    """
+    :param dump_dir: the root folder where articles are saved
+    :param layout: one of `LAYOUTS`
+    :param compression: one of `COMPRESSION_EXTENSIONS`
+    :return: a new storage writing with `layout` and `compression`, and falling back to the other layout for reading
+    """
+    if layout == LAYOUT_PACKED:
+        return PackedStorage(dump_dir, compression, fallback=TreeStorage(dump_dir))
+    return TreeStorage(dump_dir, compression, fallback=PackedStorage(dump_dir))
+
+
+class _Storage:
+    """
+    compression shared by both layouts; reads fall back to `fallback` for articles it does not hold
+    """
+
+    def __init__(self, dump_dir, compression='none', fallback=None):
+        self.dump_dir = dump_dir
+        self.compression = compression
+        self.fallback = fallback
+        self._zstd_dict = None
+        self._zstd_compressor = None
+
+    @property
+    def zstd_dict(self):
+        if self._zstd_dict is None:
+            dict_path = os.path.join(self.dump_dir, ZSTD_DICT_FILENAME)
+            if os.path.exists(dict_path):
+                with open(dict_path, 'rb') as f:
+                    self._zstd_dict = zstandard.ZstdCompressionDict(f.read())
+        return self._zstd_dict
+
+    def compress(self, data):
+        """
+        :param data: bytes to compress with the compression of the storage
+        :return: the compressed bytes
+        """
+        if self.compression == 'gzip':
+            return gzip.compress(data, compresslevel=6)
+        if self.compression == 'zstd':
+            if self._zstd_compressor is None:
+                self._zstd_compressor = zstandard.ZstdCompressor(dict_data=self.zstd_dict)
+            return self._zstd_compressor.compress(data)
+        return data
+
+    def decompress(self, data, compression):
+        """
+        :param data: bytes compressed with `compression`
+        :param compression: one of `COMPRESSION_EXTENSIONS`
+        :return: the decompressed bytes
+        """
+        if compression == 'gzip':
+            return gzip.decompress(data)
+        if compression == 'zstd':
+            if zstandard is None:
+                raise ImportError('reading zstd compressed articles requires the zstandard package')
+            # frames written by the streaming API may not record their size
+            return zstandard.ZstdDecompressor(dict_data=self.zstd_dict).decompressobj().decompress(data)
+        return data
+
+    def find(self, article_id, extension):
+        """
+        :param article_id: the id of the article
+        :param extension: the extension for the file that should contain the article, e.g., ".json" or ".html"
+        :return: pair `(path, compression)` of the file holding the article, or None if the article is missing
+        """
+        found = self.locate(article_id, extension)
+        if found is None and self.fallback is not None:
+            return self.fallback.find(article_id, extension)
+        return found
+
+    def read(self, article_id, extension):
+        """
+        :param article_id: the id of the article
+        :param extension: the extension for the file that should contain the article, e.g., ".json" or ".html"
+        :return: the content of the file as bytes, decompressed, or None if the article is missing
+        """
+        data = self._read(article_id, extension)
+        if data is None and self.fallback is not None:
+            return self.fallback.read(article_id, extension)
+        return data
+
+    def copy(self, source_id, target_id, extension):
+        """
+        stores the file of article `source_id` as the file of article `target_id` too, sharing the stored bytes where
+        the layout allows it
+        :param source_id: the id of the stored article
+        :param target_id: the id of the article to store
+        :param extension: the extension for the file that should contain the article, e.g., ".json" or ".html"
+        :return: whether the file of `source_id` was found
+        """
+        if source_id == target_id:
+            return self.find(source_id, extension) is not None
+        if self._link(source_id, target_id, extension):
+            return True
+        data = self.read(source_id, extension)
+        if data is None:
+            return False
+        self.write(target_id, extension, data)
+        return True
+
+    def import_article(self, source, article_id, extension):
+        """
+        stores the file of an article held by the storage of another dump, e.g., of a shard being merged, sharing the
+        stored bytes where both layouts allow it
+        :param source: the storage of the other dump, see `get_storage`
+        :param article_id: the id of the article
+        :param extension: the extension for the file that should contain the article, e.g., ".json" or ".html"
+        :return: whether the file was found in `source`
+        """
+        if self._link_from(source, article_id, extension):
+            return True
+        data = source.read(article_id, extension)
+        if data is None:
+            return False
+        self.write(article_id, extension, data)
+        return True
+
+    def _link_from(self, source, article_id, extension):
+        return False
+
+    def iter_article_ids(self, extension):
+        """
+        :param extension: the extension for the files of the articles, e.g., ".json"
+        :return: generator of the ids of the articles stored with `extension`, whatever their compression and layout
+        """
+        seen = set()
+        for storage in [self, self.fallback] if self.fallback is not None else [self]:
+            for article_id in storage._iter_article_ids(extension):
+                if article_id not in seen:
+                    seen.add(article_id)
+                    yield article_id
+
+
+class TreeStorage(_Storage):
+    """
+    stores each article as `dump_dir/<id[-2:]>/<id><extension>[.gz|.zst]`
+    """
+
+    def get_path(self, article_id, extension, compression=None):
+        """
+        :param article_id: the id of the article
+        :param extension: the extension for the file that should contain the article, e.g., ".json" or ".html"
+        :param compression: one of `COMPRESSION_EXTENSIONS`, by default the compression of the storage
+        :return: the path to the file
+        """
+        compression = compression or self.compression
+        filename = article_id + extension + COMPRESSION_EXTENSIONS[compression]
+        return os.path.join(self.dump_dir, article_id[-2:], filename)
+
+    def locate(self, article_id, extension):
+        """
+        like `find`, without falling back to the other layout
+        :return: pair `(path, compression)` of the stored file, whatever its compression, or None if the file is
+                 missing
+        """
+        for compression in [self.compression] + [c for c in COMPRESSION_EXTENSIONS if c != self.compression]:
+            path = self.get_path(article_id, extension, compression)
+            if os.path.exists(path):
+                return path, compression
+        return None
+
+    def write(self, article_id, extension, data, url=None):
+        """
+        stores a file of an article, replacing any copy stored with another compression
+        :param article_id: the id of the article
+        :param extension: the extension for the file that should contain the article
+        :param data: the content of the file, as bytes
+        :param url: the URL the article was downloaded from; unused by this layout
+        :return: None
+        """
+        path = self.get_path(article_id, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # replace rather than overwrite the file, which may be hard linked to the file of another article, see `copy`
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.compress(data))
+        os.replace(path + '.tmp', path)
+        for compression in COMPRESSION_EXTENSIONS:
+            other_path = self.get_path(article_id, extension, compression)
+            if compression != self.compression and os.path.exists(other_path):
+                os.remove(other_path)
+
+    def _link(self, source_id, target_id, extension):
+        """
+        hard links the file of `source_id` as the file of `target_id`, or copies it where hard links are not supported
+        :return: whether the file of `source_id` was found in this layout
+        """
+        located = self.locate(source_id, extension)
+        if located is None:
+            return False
+        path, compression = located
+        self._link_path(path, compression, target_id, extension)
+        return True
+
+    def _link_from(self, source, article_id, extension):
+        """
+        hard links the file of an article stored as a tree in another dump, unless the other dump holds a newer copy in
+        its pack files, or compressed it with a zstd dictionary that this dump does not share
+        :return: whether the file was linked
+        """
+        tree = source if isinstance(source, TreeStorage) else source.fallback
+        located = tree.locate(article_id, extension) if isinstance(tree, TreeStorage) else None
+        if located is None or located != source.find(article_id, extension):
+            return False
+        path, compression = located
+        if compression == 'zstd' and not has_same_zstd_dict(self.dump_dir, source.dump_dir):
+            return False
+        self._link_path(path, compression, article_id, extension)
+        return True
+
+    def _link_path(self, path, compression, article_id, extension):
+        """
+        hard links `path` as the file of an article, or copies it where hard links are not supported
+        :return: None
+        """
+        target_path = self.get_path(article_id, extension, compression)
+        self.delete(article_id, extension)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        try:
+            os.link(path, target_path)
+        except OSError:
+            shutil.copyfile(path, target_path)
+
+    def delete(self, article_id, extension):
+        """
+        removes the file of an article, whatever its compression
+        :return: None
+        """
+        for compression in COMPRESSION_EXTENSIONS:
+            path = self.get_path(article_id, extension, compression)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _read(self, article_id, extension):
+        found = self.locate(article_id, extension)
+        if found is None:
+            return None
+        path, compression = found
+        with open(path, 'rb') as f:
+            return self.decompress(f.read(), compression)
+
+    def _iter_article_ids(self, extension):
+        if not os.path.isdir(self.dump_dir):
+            return
+        for dirname in sorted(os.listdir(self.dump_dir)):
+            dirpath = os.path.join(self.dump_dir, dirname)
+            if dirname.startswith('.') or dirname == PACKS_DIRNAME or not os.path.isdir(dirpath):
+                continue
+            for filename in os.listdir(dirpath):
+                for compression_extension in COMPRESSION_EXTENSIONS.values():
+                    suffix = extension + compression_extension
+                    if filename.endswith(suffix):
+                        yield filename[:-len(suffix)]
+                        break
+
+
+def get_warc_record(article_id, url, data):
+    """
+    :param article_id: the id of the article
+    :param url: the URL the article was downloaded from
+    :param data: the raw html of the article
+    :return: a WARC/1.0 resource record holding `data`
+    """
+    headers = ['WARC/1.0',
+               'WARC-Type: resource',
+               'WARC-Record-ID: <urn:uuid:{}>'.format(uuid.uuid4()),
+               'WARC-Date: {}'.format(datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')),
+               'WARC-Target-URI: {}'.format(url or 'urn:article:' + article_id),
+               'WARC-Article-ID: {}'.format(article_id),
+               'Content-Type: text/html',
+               'Content-Length: {}'.format(len(data))]
+    return '\r\n'.join(headers).encode('utf8') + b'\r\n\r\n' + data + b'\r\n\r\n'
+
+
+def get_warc_content(record):
+    """
+    :param record: a WARC record, see `get_warc_record`
+    :return: the content block of `record`
+    """
+    end = record.index(b'\r\n\r\n')
+    for line in record[:end].decode('utf8').split('\r\n'):
+        name, _, value = line.partition(':')
+        if name.lower() == 'content-length':
+            return record[end + 4:end + 4 + int(value)]
+    raise ValueError('WARC record without Content-Length')
+
+
+# separates the id of the article from the parsed article in the JSON lines files
+JSONL_SEPARATOR = b', "article": '
+
+
+def get_jsonl_prefix(article_id):
+    """
+    :param article_id: the id of the article
+    :return: the start of the JSON line holding the parsed article, which ends with `}\n`
+    """
+    return '{{"article_id": {}'.format(json.dumps(article_id)).encode('utf8') + JSONL_SEPARATOR
+
+
+class PackedStorage(_Storage):
+    """
+    appends the raw html of the articles to WARC files, and the parsed articles to JSON lines files, in
+    `dump_dir/packs/`; each process appends to its own pack files, and the offset of each record is kept in the
+    state database of `dump_dir`, for random access by article id
+
+    each record is compressed on its own, so that compressed pack files can be both read at an offset and decompressed
+    as a whole, e.g., with `zcat`
+    """
+
+    def __init__(self, dump_dir, compression='none', fallback=None):
+        super().__init__(dump_dir, compression, fallback)
+        self._pack_index = None
+        self._writers = {}
+        self._readers = {}
+
+    @property
+    def pack_index(self):
+        if self._pack_index is None:
+            # imported here, as the state index reads articles through this module
+            from semeval_8_2022_ia_downloader.state import get_pack_index
+            self._pack_index = get_pack_index(self.dump_dir)
+        return self._pack_index
+
+    def get_path(self, article_id, extension, compression=None):
+        """
+        the pack file of an article is only known once it is written
+        :return: None
+        """
+        return None
+
+    def _get_writer(self, extension):
+        """
+        :param extension: the extension for the file that should contain the article, e.g., ".json" or ".html"
+        :return: pair `(pack, file)` of the pack file this process appends to, opened in append mode
+        """
+        pack, f = self._writers.get(extension, (None, None))
+        if f is not None and f.tell() < PACK_MAX_SIZE:
+            return pack, f
+        if f is not None:
+            f.close()
+        kind, pack_extension = PACK_KINDS[extension]
+        os.makedirs(os.path.join(self.dump_dir, PACKS_DIRNAME), exist_ok=True)
+        sequence = 0
+        while True:
+            pack = '{}-{}-{:05d}{}{}'.format(kind, os.getpid(), sequence, pack_extension,
+                                             COMPRESSION_EXTENSIONS[self.compression])
+            path = os.path.join(self.dump_dir, PACKS_DIRNAME, pack)
+            if not os.path.exists(path) or os.path.getsize(path) < PACK_MAX_SIZE:
+                break
+            sequence += 1
+        f = open(path, 'ab')
+        self._writers[extension] = pack, f
+        return pack, f
+
+    def write(self, article_id, extension, data, url=None):
+        """
+        appends a file of an article to the pack files of this process; older copies stay in their pack files, but
+        are no longer indexed
+        :param article_id: the id of the article
+        :param extension: ".json" for the parsed article, or ".html" for the raw html
+        :param data: the content of the file, as bytes
+        :param url: the URL the article was downloaded from, recorded in the WARC record
+        :return: None
+        """
+        if extension == '.html':
+            record = get_warc_record(article_id, url, data)
+        else:
+            record = get_jsonl_prefix(article_id) + data + b'}\n'
+        record = self.compress(record)
+        pack, f = self._get_writer(extension)
+        offset = f.tell()
+        f.write(record)
+        # make the record readable by other processes before it is indexed
+        f.flush()
+        self.pack_index.put(article_id, extension, pack, offset, len(record), self.compression)
+
+    def _link(self, source_id, target_id, extension):
+        """
+        indexes the record of `source_id` as the record of `target_id` too
+        :return: whether the record of `source_id` was found in this layout
+        """
+        entry = self.pack_index.get(source_id, extension) if self.has_packs() else None
+        if entry is None:
+            return False
+        self.pack_index.put(target_id, extension, *entry)
+        return True
+
+    def delete(self, article_id, extension):
+        """
+        removes an article from the index; its records stay in the pack files
+        :return: None
+        """
+        self.pack_index.delete(article_id, extension)
+
+    def has_packs(self):
+        """
+        :return: whether any pack file was written in `dump_dir`; if not, the index need not be opened
+        """
+        return os.path.isdir(os.path.join(self.dump_dir, PACKS_DIRNAME))
+
+    def locate(self, article_id, extension):
+        """
+        like `find`, without falling back to the other layout
+        :return: pair `(path, compression)` of the pack file holding the article, or None if the article is missing
+        """
+        if not self.has_packs():
+            return None
+        entry = self.pack_index.get(article_id, extension)
+        if entry is None:
+            return None
+        pack, _, _, compression = entry
+        return os.path.join(self.dump_dir, PACKS_DIRNAME, pack), compression
+
+    def _read(self, article_id, extension):
+        if not self.has_packs():
+            return None
+        entry = self.pack_index.get(article_id, extension)
+        if entry is None:
+            return None
+        pack, offset, length, compression = entry
+        if pack not in self._readers:
+            self._readers[pack] = open(os.path.join(self.dump_dir, PACKS_DIRNAME, pack), 'rb')
+        f = self._readers[pack]
+        f.seek(offset)
+        record = self.decompress(f.read(length), compression)
+        if extension == '.html':
+            return get_warc_content(record)
+        # records shared with other articles, see `copy`, start with the id of the article that they were written for,
+        # which cannot contain the separator, as it is json-encoded
+        return record[record.index(JSONL_SEPARATOR) + len(JSONL_SEPARATOR):-len(b'}\n')]
+
+    def _iter_article_ids(self, extension):
+        if not self.has_packs():
+            return iter(())
+        return self.pack_index.iter_article_ids(extension)
+
+    def close(self):
+        """
+        closes the pack files opened by this process
+        :return: None
+        """
+        for _, f in self._writers.values():
+            f.close()
+        for f in self._readers.values():
+            f.close()
+        self._writers = {}
+        self._readers = {}
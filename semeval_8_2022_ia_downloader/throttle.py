@@ -0,0 +1,107 @@
+"""Adaptive concurrency and delay for each class of endpoint, adjusted by additive increase, multiplicative decrease."""
+import time
+
+from semeval_8_2022_ia_downloader.metrics import get_metrics
+
+# the classes of endpoint adjusted independently, see `cli.get_endpoint`
+ENDPOINTS = ['cdx', 'web', 'original']
+
+# responses slower than this many seconds do not increase the concurrency
+TARGET_LATENCY = 5
+# the concurrency is multiplied by this factor, and the delay divided by it, when the server is overloaded
+DECREASE_FACTOR = 0.5
+# the smallest delay set when the server is overloaded, and the largest one
+MIN_BACKOFF_DELAY = 0.25
+MAX_DELAY = 60
+# the delay removed for each healthy window of responses, in seconds
+DELAY_STEP = 0.1
+# the concurrency when no hard ceiling is set, as a multiple of the initial concurrency
+DEFAULT_CEILING_FACTOR = 4
+
+
+def is_overloaded(status):
+    """
+    :param status: the HTTP status of a response, or None if the request timed out
+    :return: whether the response signals that the server is overloaded
+    """
+    return status is None or status == 429 or status >= 500
+
+
+class AimdController:
+    """
+    keeps a concurrency and a delay between requests for each class of endpoint: healthy responses increase the
+    concurrency by about one per window of responses, and shorten the delay, while 429 and 5xx errors and timeouts
+    halve the concurrency and double the delay; requests sent before the last decrease do not decrease it
+    again, so that the requests in flight when the server got overloaded count as a single signal
+
+    the values are exposed as the `throttle_concurrency` and `throttle_delay_seconds` gauges of `metrics.get_metrics`
+    """
+
+    def __init__(self, concurrency, delay=0, max_concurrency=None, max_delay=MAX_DELAY, target_latency=TARGET_LATENCY,
+                 min_delays=None):
+        """
+        :param concurrency: the initial number of requests in flight to each class of endpoint
+        :param delay: the initial delay between requests, in seconds
+        :param max_concurrency: the hard ceiling of the concurrency, by default `DEFAULT_CEILING_FACTOR` times
+               `concurrency`
+        :param max_delay: the largest delay, in seconds
+        :param target_latency: responses slower than this many seconds do not increase the concurrency
+        :param min_delays: dict mapping some of `ENDPOINTS` to the smallest delay between their requests, e.g., to keep
+               a politeness delay for the original websites, which rarely signal that they are overloaded
+        """
+        self.max_concurrency = max_concurrency or DEFAULT_CEILING_FACTOR * concurrency
+        self.max_delay = max_delay
+        self.target_latency = target_latency
+        self.concurrency = {endpoint: float(min(concurrency, self.max_concurrency)) for endpoint in ENDPOINTS}
+        self.min_delays = {endpoint: float((min_delays or {}).get(endpoint, 0)) for endpoint in ENDPOINTS}
+        self.delay = {endpoint: max(float(delay), self.min_delays[endpoint]) for endpoint in ENDPOINTS}
+        self.decreased_at = {endpoint: 0 for endpoint in ENDPOINTS}
+        for endpoint in ENDPOINTS:
+            self._publish(endpoint)
+
+    def get_concurrency(self, endpoint):
+        """
+        :param endpoint: one of `ENDPOINTS`
+        :return: how many requests may be in flight to `endpoint`
+        """
+        return int(self.concurrency[endpoint])
+
+    def get_delay(self, endpoint):
+        """
+        :param endpoint: one of `ENDPOINTS`
+        :return: how many seconds to wait between requests to `endpoint`
+        """
+        return self.delay[endpoint]
+
+    def record(self, endpoint, status, latency, sent_at=None):
+        """
+        adjusts the concurrency and delay of `endpoint` after a request
+        :param endpoint: one of `ENDPOINTS`
+        :param status: the HTTP status of the response, or None if the request timed out; other failures, e.g., DNS
+               errors, say nothing about the load of the server, and are not recorded
+        :param latency: how many seconds the server took to respond, or None if unknown
+        :param sent_at: when the request was sent, as per `time.time`, by default `latency` seconds ago
+        :return: whether the concurrency or delay changed
+        """
+        now = time.time()
+        if sent_at is None:
+            sent_at = now - (latency or 0)
+        concurrency, delay = self.concurrency[endpoint], self.delay[endpoint]
+        if is_overloaded(status):
+            if sent_at < self.decreased_at[endpoint]:
+                return False
+            self.decreased_at[endpoint] = now
+            self.concurrency[endpoint] = max(1., concurrency * DECREASE_FACTOR)
+            self.delay[endpoint] = min(self.max_delay, max(MIN_BACKOFF_DELAY, delay / DECREASE_FACTOR))
+            get_metrics().inc('throttle_decreases_total', endpoint=endpoint)
+        elif latency is not None and latency <= self.target_latency:
+            self.concurrency[endpoint] = min(float(self.max_concurrency), concurrency + 1 / concurrency)
+            self.delay[endpoint] = max(self.min_delays[endpoint], delay - DELAY_STEP / concurrency)
+        if (concurrency, delay) == (self.concurrency[endpoint], self.delay[endpoint]):
+            return False
+        self._publish(endpoint)
+        return True
+
+    def _publish(self, endpoint):
+        get_metrics().set('throttle_concurrency', self.get_concurrency(endpoint), endpoint=endpoint)
+        get_metrics().set('throttle_delay_seconds', round(self.delay[endpoint], 3), endpoint=endpoint)
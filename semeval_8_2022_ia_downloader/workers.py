@@ -0,0 +1,119 @@
+"""Worker processes that parse downloaded articles with newspaper3k, away from the process that downloads them."""
+import json
+
+from newspaper import Article, Config
+
+from semeval_8_2022_ia_downloader.cli import get_extractor_version, parse_article
+from semeval_8_2022_ia_downloader.metrics import get_metrics
+from semeval_8_2022_ia_downloader.profiling import start_profiler
+from semeval_8_2022_ia_downloader.state import get_content_hash, get_state_index
+from semeval_8_2022_ia_downloader.storage import get_storage
+
+# minimal page parsed at startup, so that the stopwords and tokenizers of each language are loaded before the first
+# real article arrives
+WARMUP_HTML = b'<html><head><title>warmup</title></head><body><p>warmup</p></body></html>'
+
+# outcomes of `reparse_article_task`
+REPARSE_PARSED = 'parsed'
+REPARSE_SKIPPED = 'skipped'
+REPARSE_FAILED = 'failed'
+REPARSE_MISSING = 'missing'
+
+# newspaper3k writes the language into the configuration passed to `Article`, so each language gets its own
+_CONFIGS = {}
+
+
+def get_config(article_lang, offline=False):
+    """
+    :param article_lang: the language of the article
+    :param offline: whether the configuration must not access the network; newspaper3k otherwise downloads candidate
+           top images to check their size, so the extractions differ, see `cli.get_extractor_version`
+    :return: the newspaper3k configuration for `article_lang`, shared by all articles parsed in this process
+    """
+    if (article_lang, offline) not in _CONFIGS:
+        config = Config()
+        if offline:
+            config.fetch_images = False
+        _CONFIGS[article_lang, offline] = config
+    return _CONFIGS[article_lang, offline]
+
+
+def init_worker(languages=()):
+    """
+    initializes a worker process, loading the newspaper3k resources for each language
+    :param languages: the languages of the articles that the worker will parse
+    :return: None
+    """
+    # saves the profile of the worker when it exits, if the run is profiled
+    start_profiler('worker')
+    for article_lang in languages:
+        try:
+            article = Article('http://localhost/', language=article_lang, config=get_config(article_lang))
+            article.html = WARMUP_HTML
+            article.download_state = 2
+            article.parse()
+        except Exception:
+            # unsupported languages fail again, and are reported, when parsing the actual articles
+            pass
+
+
+def parse_article_task(args):
+    """
+    parses and saves an article that was already downloaded; runs in a worker process
+    :param args: tuple `dump_dir, article_id, article_link, article_lang, html, phase`, see `cli.parse_article`
+    :return: pair `(text_length, metrics)` of the length of the stripped `text` extracted from the article, or None if
+             the article cannot be parsed, and the metrics recorded by this process, see `metrics.Metrics.drain`
+    """
+    dump_dir, article_id, article_link, article_lang, html, phase = args
+    try:
+        article_dict = parse_article(dump_dir, article_id, article_link, article_lang, html=html,
+                                     article_config=get_config(article_lang), phase=phase)
+    except Exception as e:
+        print(e)
+        print('cannot parse', article_link)
+        get_state_index(dump_dir).record_failure(article_id, phase, repr(e))
+        get_metrics().inc('parse_errors_total', phase=str(phase))
+        return None, get_metrics().drain()
+    return len(article_dict['text'].strip()), get_metrics().drain()
+
+
+def reparse_article_task(args):
+    """
+    extracts an article again from its saved html, unless neither the html nor the extractor changed since its last
+    extraction; runs in a worker process, without any network access
+    :param args: tuple `dump_dir, article_id, article_link, article_lang, force`, where `article_link` is used if the
+           saved article lacks its url, and `force` extracts the article even if nothing changed
+    :return: pair `(outcome, metrics)` of one of `REPARSE_PARSED`, `REPARSE_SKIPPED`, `REPARSE_FAILED`,
+             `REPARSE_MISSING`, and the metrics recorded by this process, see `metrics.Metrics.drain`
+    """
+    outcome = _reparse_article(*args)
+    get_metrics().inc('reparse_total', outcome=outcome)
+    return outcome, get_metrics().drain()
+
+
+def _reparse_article(dump_dir, article_id, article_link, article_lang, force):
+    storage = get_storage(dump_dir)
+    html = storage.read(article_id, '.html')
+    if html is None:
+        return REPARSE_MISSING
+    state = get_state_index(dump_dir).get(article_id) or {}
+    if not force and state.get('content_hash') == get_content_hash(html) and \
+            state.get('extractor_version') == get_extractor_version(offline=True) and \
+            storage.find(article_id, '.json') is not None:
+        return REPARSE_SKIPPED
+    try:
+        # the url that the article was parsed as, e.g., the archived copy on the waybackmachine
+        article_link = json.loads(storage.read(article_id, '.json')).get('url') or article_link
+    except (TypeError, ValueError, OSError, EOFError):
+        # missing or corrupted json
+        pass
+    try:
+        parse_article(dump_dir, article_id, article_link, article_lang, html=html,
+                      article_config=get_config(article_lang, offline=True), phase=state.get('phase'),
+                      save_html=False, skip_identical=not force)
+    except Exception as e:
+        print(e)
+        print('cannot reparse', article_id)
+        get_state_index(dump_dir).record_failure(article_id, 'reparse', e)
+        return REPARSE_FAILED
+    return REPARSE_PARSED
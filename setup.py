@@ -23,6 +23,13 @@ requirements = [
 
 test_requirements = []
 
+extras_requirements = {
+    # --compression zstd
+    'zstd': ['zstandard'],
+    # semeval_8_2022_ia_downloader export
+    'export': ['pyarrow'],
+}
+
 setup(
     author="Mattia Samory",
     author_email='mattia.samory@gesis.org',
@@ -44,6 +51,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="GNU General Public License v3",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
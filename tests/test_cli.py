@@ -0,0 +1,152 @@
+"""Tests for the helpers of `semeval_8_2022_ia_downloader.cli`."""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+from semeval_8_2022_ia_downloader.cli import CDX_ENDPOINT, get_cdx_link, get_cdx_time_range, get_endpoint, \
+    get_first_snapshots, get_wayback_link, get_wayback_timestamp, parse_shard, status
+from semeval_8_2022_ia_downloader.state import get_plan_index, get_state_index
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_snapshots(rows):
+    return [dict(zip(['timestamp', 'original', 'statuscode', 'digest'], row)) for row in rows]
+
+
+class TestParseShard(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertEqual(parse_shard('0/4'), (0, 4))
+        self.assertEqual(parse_shard('3/4'), (3, 4))
+
+    def test_invalid(self):
+        for value in ['4/4', '-1/4', '0/0', '1', 'a/b', '1/2/3']:
+            with self.subTest(value=value), self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(value)
+
+
+class TestWaybackTimestamp(unittest.TestCase):
+
+    def test_archived_copy(self):
+        link = get_wayback_link('http://example.com/a?b=1', '20200101000000')
+        self.assertEqual(get_wayback_timestamp(link), '20200101000000')
+
+    def test_latest_copy(self):
+        self.assertEqual(get_wayback_timestamp(get_wayback_link('http://example.com/')), '2')
+
+    def test_not_archived(self):
+        self.assertIsNone(get_wayback_timestamp('http://example.com/web/20200101000000id_/http://example.com/'))
+        self.assertIsNone(get_wayback_timestamp(CDX_ENDPOINT + '?url=http://example.com/'))
+
+
+class TestCdxTimeRange(unittest.TestCase):
+
+    def test_single_time(self):
+        self.assertEqual(get_cdx_time_range('2020'), ('20200000000000', '20200000000000'))
+
+    def test_pair(self):
+        self.assertEqual(get_cdx_time_range([datetime(2020, 1, 2, 3, 4, 5), '20210101']),
+                         ('20200102030405', '20210101000000'))
+
+    def test_unix_timestamp(self):
+        self.assertEqual(get_cdx_time_range((1577836800, 1577836800)), ('20200101000000', '20200101000000'))
+
+
+class TestCdxQuery(unittest.TestCase):
+
+    time_range = ('20100101000000', '20210707000000')
+
+    def test_query(self):
+        query = parse_qs(urlsplit(get_cdx_link('http://example.com/a', self.time_range)).query)
+        self.assertEqual(query['url'], ['http://example.com/a'])
+        self.assertEqual(query['to'], ['20210707000000'])
+        self.assertEqual(query['filter'], ['!statuscode:3..'])
+        # the snapshot live when the time range starts precedes it, and may follow non-200 snapshots
+        self.assertNotIn('from', query)
+        self.assertNotIn('limit', query)
+
+    def test_snapshot_live_at_the_start(self):
+        snapshots = get_snapshots([['20050101000000', 'http://example.com/a', '200', 'A'],
+                                   ['20080101000000', 'http://example.com/a', '200', 'B'],
+                                   ['20120101000000', 'http://example.com/a', '200', 'C'],
+                                   ['20130101000000', 'http://example.com/a', '200', 'D']])
+        self.assertEqual([snapshot['timestamp'] for snapshot in get_first_snapshots(snapshots, self.time_range, 2)],
+                         ['20080101000000', '20120101000000'])
+
+    def test_only_before_the_start(self):
+        snapshots = get_snapshots([['20080101000000', 'http://example.com/a', '200', 'A']])
+        self.assertEqual(get_first_snapshots(snapshots, self.time_range, 2), [])
+
+    def test_skipped_snapshots(self):
+        snapshots = get_snapshots([['20080101000000', 'http://example.com/a', '-', 'A'],
+                                   ['20110101000000', 'http://example.com/a', '200', 'B'],
+                                   # unchanged
+                                   ['20120101000000', 'http://example.com/a', '200', 'B'],
+                                   ['20130101000000', 'http://example.com/a', '404', 'C'],
+                                   ['20140101000000', 'http://example.com/a', '200', 'D'],
+                                   ['20220101000000', 'http://example.com/a', '200', 'E']])
+        self.assertEqual([snapshot['timestamp'] for snapshot in get_first_snapshots(snapshots, self.time_range, 5)],
+                         ['20110101000000', '20140101000000'])
+
+
+class TestGetEndpoint(unittest.TestCase):
+
+    def test_endpoints(self):
+        self.assertEqual(get_endpoint(CDX_ENDPOINT + '?url=http://example.com/'), 'cdx')
+        self.assertEqual(get_endpoint(get_wayback_link('http://example.com/')), 'web')
+        self.assertEqual(get_endpoint('http://example.com/news/page'), 'original')
+
+
+class TestStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump_dir = os.path.join(self.tmp.name, 'articles')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_status(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+            code = status(['--dump_dir', self.dump_dir] + list(argv))
+        return code, output.getvalue()
+
+    def test_without_state(self):
+        self.assertEqual(self.run_status()[0], 1)
+        # no plan yet
+        get_state_index(self.dump_dir)
+        self.assertEqual(self.run_status()[0], 1)
+
+    def test_skips_heavy_imports(self):
+        code = ('import sys\n'
+                'import semeval_8_2022_ia_downloader.cli\n'
+                'heavy = {"newspaper", "pandas", "scrapy", "twisted"} & set(sys.modules)\n'
+                'sys.exit(", ".join(sorted(heavy)) or None)\n')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+        process = subprocess.run([sys.executable, '-c', code], env=env, stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        self.assertEqual(process.returncode, 0, process.stderr)
+
+    def test_json(self):
+        get_plan_index(self.dump_dir).replace([('1', 'en', 'a.com'), ('2', 'de', 'a.com')])
+        get_state_index(self.dump_dir).record_success('1', 'cdx', 1000, 'a')
+        code, output = self.run_status('--json')
+        self.assertEqual(code, 0)
+        self.assertEqual([json.loads(line) for line in output.splitlines()], [
+            {'lang': 'de', 'total': 1, 'downloaded': 0, 'short_text': 0, 'failed': 0, 'rejected': 0, 'missing': 1},
+            {'lang': 'en', 'total': 1, 'downloaded': 1, 'short_text': 0, 'failed': 0, 'rejected': 0, 'missing': 0},
+            {'lang': 'total', 'total': 2, 'downloaded': 1, 'short_text': 0, 'failed': 0, 'rejected': 0, 'missing': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
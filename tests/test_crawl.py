@@ -0,0 +1,34 @@
+"""Tests for `semeval_8_2022_ia_downloader.crawl`."""
+import unittest
+
+from semeval_8_2022_ia_downloader.crawl import get_numeric_stats, get_partition_settings
+
+
+class TestGetPartitionSettings(unittest.TestCase):
+
+    def test_static_split(self):
+        settings = {'CONCURRENT_REQUESTS': 16, 'DOWNLOAD_DELAY': 0.5, 'PARSER_PROCESSES': 8,
+                    'ADAPTIVE_THROTTLE_START_CONCURRENCY': 16, 'ADAPTIVE_THROTTLE_MAX_CONCURRENCY': 64}
+        partition_settings = get_partition_settings(settings, 4)
+        self.assertEqual(partition_settings, {'CONCURRENT_REQUESTS': 4, 'DOWNLOAD_DELAY': 2., 'PARSER_PROCESSES': 2,
+                                              'ADAPTIVE_THROTTLE_START_CONCURRENCY': 4,
+                                              'ADAPTIVE_THROTTLE_MAX_CONCURRENCY': 16, 'SHARED_BACKOFF': True})
+        # the settings of the run are left as they are
+        self.assertNotIn('SHARED_BACKOFF', settings)
+
+    def test_at_least_one(self):
+        partition_settings = get_partition_settings({'CONCURRENT_REQUESTS': 2, 'PARSER_PROCESSES': 2}, 4)
+        self.assertEqual(partition_settings['CONCURRENT_REQUESTS'], 1)
+        self.assertEqual(partition_settings['PARSER_PROCESSES'], 1)
+
+
+class TestGetNumericStats(unittest.TestCase):
+
+    def test_get_numeric_stats(self):
+        self.assertEqual(get_numeric_stats({'item_scraped_count': 3, 'elapsed_time_seconds': 1.5, 'finish_reason':
+                                            'finished', 'start_time': None, 'flag': True}),
+                         {'item_scraped_count': 3, 'elapsed_time_seconds': 1.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
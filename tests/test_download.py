@@ -0,0 +1,71 @@
+"""End-to-end test of the `download` command, against the fake Internet Archive of the benchmarks."""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from semeval_8_2022_ia_downloader.state import get_plan_index, get_state_index
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+import fake_ia  # noqa: E402
+from generate_links import generate_links  # noqa: E402
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # every archive request may fail, so that the downloader has to back off and retry
+        self.server = fake_ia.serve(fake_ia.FakeIaConfig(latency=0.005, original_latency=0.005, rate_429=0.2,
+                                                         rate_502=0.1, retry_after=1, page_size=5000))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.tmp.cleanup()
+
+    def test_download(self):
+        port = self.server.server_address[1]
+        links_file = os.path.join(self.tmp.name, 'links.csv')
+        dump_dir = os.path.join(self.tmp.name, 'articles')
+        generate_links(links_file, 15, domains=3, port=port)
+        env = dict(os.environ, SEMEVAL_8_2022_IA_URL='http://127.0.0.1:{}'.format(port),
+                   PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+        process = subprocess.run([sys.executable, '-m', 'semeval_8_2022_ia_downloader.cli', '--links_file',
+                                  links_file, '--dump_dir', dump_dir, '--retry_log',
+                                  os.path.join(self.tmp.name, 'inaccessible_urls.csv'), '--concurrent_requests', '4',
+                                  '--download_delay', '0', '--retry_delay', '0', '--log_level', 'WARNING'],
+                                 env=env, cwd=self.tmp.name, stderr=subprocess.PIPE, universal_newlines=True,
+                                 timeout=600)
+        # the crawler exits cleanly, rather than leaving all articles to the retry phases
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertNotIn('Traceback', process.stderr)
+        self.assertNotIn('CRITICAL', process.stderr)
+
+        counts, = get_plan_index(dump_dir).get_status_counts([])
+        self.assertGreater(counts['total'], 15)
+        self.assertEqual((counts['failed'], counts['missing']), (0, 0))
+        self.assertEqual(counts['downloaded'] + counts['short_text'], counts['total'])
+        # Phase 1, the scrapy crawler, downloads most of the articles, which have snapshots; the fake pages are in
+        # English, so that articles in some other languages have no text, and go through every phase
+        phases = dict(get_state_index(dump_dir).connection.execute(
+            "SELECT phase, COUNT(*) FROM articles WHERE status = 'downloaded' AND text_length > 50 GROUP BY phase")
+            .fetchall())
+        self.assertGreater(phases.get('cdx', 0), sum(phases.values()) // 2, phases)
+
+        with open(os.path.join(dump_dir, '.metrics.json'), encoding='utf8') as f:
+            counters = json.load(f)['counters']
+        statuses = {counter['labels']['status'] for counter in counters if counter['name'] == 'responses_total'}
+        self.assertIn('429', statuses)
+        self.assertIn('200', statuses)
+        # short articles included
+        cdx_articles = sum(counter['value'] for counter in counters if counter['name'] == 'articles_total' and
+                           counter['labels'] == {'phase': 'cdx', 'outcome': 'success'})
+        self.assertGreaterEqual(cdx_articles, phases['cdx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Tests for the `export` command, `semeval_8_2022_ia_downloader.export`."""
+import json
+import os
+import tempfile
+import unittest
+
+from semeval_8_2022_ia_downloader.cli import export
+from semeval_8_2022_ia_downloader.export import FORMAT_ARROW, FORMAT_PARQUET, pyarrow
+from semeval_8_2022_ia_downloader.state import get_state_index
+from semeval_8_2022_ia_downloader.storage import get_storage
+
+
+@unittest.skipIf(pyarrow is None, 'exporting requires the pyarrow package')
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.links_file = os.path.join(self.tmp.name, 'links.csv')
+        with open(self.links_file, 'w', encoding='utf8') as f:
+            f.write('pair_id,url1_lang,link1,url2_lang,link2,overall,geo\n'
+                    '1_2,en,http://example.com/a,de,http://example.com/b,1.5,\n'
+                    '3_1,fr,http://example.com/c,en,http://example.com/a,4,2\n')
+        self.dump_dir = os.path.join(self.tmp.name, 'articles')
+        storage = get_storage(self.dump_dir)
+        for article_id, phase, article_dict in [
+                ('1', 'cdx', {'url': 'http://example.com/a', 'title': 'A', 'text': 'Text',
+                              'authors': ['X', 'Y'], 'meta_data': {'og': {'type': 'article'}}}),
+                ('3', 'original', {'url': 'http://example.com/c', 'title': 'C', 'text': 'Texte', 'authors': []})]:
+            storage.write(article_id, '.json', json.dumps(article_dict).encode('utf8'))
+            get_state_index(self.dump_dir).record_success(article_id, phase, len(article_dict['text']), article_id)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, path, file_format):
+        if file_format == FORMAT_PARQUET:
+            return pyarrow.parquet.read_table(path).to_pylist()
+        with pyarrow.ipc.open_file(path) as reader:
+            return reader.read_all().to_pylist()
+
+    def test_export(self):
+        for file_format in [FORMAT_PARQUET, FORMAT_ARROW]:
+            with self.subTest(file_format=file_format):
+                output = os.path.join(self.tmp.name, 'articles.' + file_format)
+                pairs_output = os.path.join(self.tmp.name, 'pairs.' + file_format)
+                self.assertEqual(export(['--dump_dir', self.dump_dir, '--links_file', self.links_file,
+                                         '--output', output, '--pairs_output', pairs_output, '--format', file_format,
+                                         '--fields', 'title,text,authors,meta_data']), 0)
+                # in the order of the input file, without the missing article
+                self.assertEqual(self.read(output, file_format), [
+                    {'article_id': '1', 'lang': 'en', 'link': 'http://example.com/a', 'phase': 'cdx', 'title': 'A',
+                     'text': 'Text', 'authors': ['X', 'Y'], 'meta_data': '{"og": {"type": "article"}}'},
+                    {'article_id': '3', 'lang': 'fr', 'link': 'http://example.com/c', 'phase': 'original',
+                     'title': 'C', 'text': 'Texte', 'authors': [], 'meta_data': None}])
+                self.assertEqual(self.read(pairs_output, file_format), [
+                    {'pair_id': '1_2', 'article_id1': '1', 'lang1': 'en', 'article_row1': 0, 'article_id2': '2',
+                     'lang2': 'de', 'article_row2': None, 'overall': 1.5, 'geo': None},
+                    {'pair_id': '3_1', 'article_id1': '3', 'lang1': 'fr', 'article_row1': 1, 'article_id2': '1',
+                     'lang2': 'en', 'article_row2': 0, 'overall': 4.0, 'geo': 2.0}])
+
+    def test_unknown_fields(self):
+        with self.assertRaises(ValueError):
+            export(['--dump_dir', self.dump_dir, '--links_file', self.links_file,
+                    '--output', os.path.join(self.tmp.name, 'articles.parquet'), '--fields', 'title,body'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Tests for `semeval_8_2022_ia_downloader.fetcher`, against the fake Internet Archive of the benchmarks."""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from semeval_8_2022_ia_downloader import cli
+from semeval_8_2022_ia_downloader.cli import get_endpoint, get_rate_limit_key
+from semeval_8_2022_ia_downloader.fetcher import SOURCE_ORIGINAL, SOURCE_WAYBACK, STEP_CDX, STEP_ORIGINAL, \
+    STEP_WAYBACK, STEP_WAYBACK_NOQUERY, FetchEngine
+from semeval_8_2022_ia_downloader.state import STATUS_DOWNLOADED, STATUS_FAILED, STATUS_REJECTED, get_cdx_cache, \
+    get_state_index
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+import fake_ia  # noqa: E402
+
+
+class TestSchedule(unittest.TestCase):
+
+    def test_round_robin_across_free_hosts(self):
+        engine = FetchEngine(None, concurrency=4, per_host_concurrency=1)
+        tasks = ['http://127.0.0.1/a1', 'http://127.0.0.1/a2', 'http://127.0.0.1/a3', 'http://127.0.0.2/b1']
+
+        async def schedule():
+            engine.hosts = {}
+            engine.released = asyncio.Event()
+            scheduled = []
+            async for url in engine._schedule(tasks, lambda task: task):
+                scheduled.append(url)
+                # the request holds its host slot for a while
+                host = engine._get_host(get_rate_limit_key(url), get_endpoint(url))
+                await host.acquire()
+                asyncio.get_event_loop().call_later(0.01, host.release)
+            return scheduled
+
+        loop = asyncio.new_event_loop()
+        try:
+            scheduled = loop.run_until_complete(schedule())
+        finally:
+            loop.close()
+        # the articles of the second host do not wait behind those of the first one
+        self.assertEqual(scheduled, ['http://127.0.0.1/a1', 'http://127.0.0.2/b1', 'http://127.0.0.1/a2',
+                                     'http://127.0.0.1/a3'])
+
+
+class FakeIaTestCase(unittest.TestCase):
+    """
+    runs the engine against the fake Internet Archive, with transient 429 and 502 errors turned off
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump_dir = os.path.join(self.tmp.name, 'articles')
+        self.config = fake_ia.FakeIaConfig(latency=0.005, original_latency=0.005, page_size=5000)
+        self.server = fake_ia.serve(self.config)
+        self.port = self.server.server_address[1]
+        ia_url = 'http://127.0.0.1:{}'.format(self.port)
+        for patcher in [mock.patch.object(cli, 'CDX_ENDPOINT', ia_url + '/cdx/search/cdx'),
+                        mock.patch.object(cli, 'WAYBACK_PREFIX', ia_url + '/web/')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.tmp.cleanup()
+
+    def get_link(self, host, article_id):
+        return 'http://127.0.0.{}:{}/news/{}'.format(host, self.port, article_id)
+
+    def get_engine(self):
+        return FetchEngine(self.dump_dir, concurrency=4, per_host_concurrency=2, parser_processes=1, timeout=10)
+
+
+class TestFetchEngine(FakeIaTestCase):
+
+    def test_run(self):
+        tasks = [(str(i), self.get_link(2 + i % 2, i), 'en', 'original') for i in range(6)]
+        self.get_engine().run(tasks, SOURCE_ORIGINAL)
+        state_index = get_state_index(self.dump_dir)
+        for article_id, _, _, _ in tasks:
+            state = state_index.get(article_id)
+            self.assertEqual((state['status'], state['phase']), (STATUS_DOWNLOADED, 'original'))
+
+    def test_run_latest_copy(self):
+        links = [self.get_link(2, i) for i in range(500)]
+        # archived, and not archived: the article fails, and is left to the next phase
+        archived = [link for link in links if fake_ia.has_latest_copy(link, self.config)][:4]
+        missing = [link for link in links if not fake_ia.has_latest_copy(link, self.config)][:2]
+        tasks = [(str(i), link, 'en', 'wayback') for i, link in enumerate(archived + missing)]
+        self.get_engine().run(tasks, SOURCE_WAYBACK)
+        state_index = get_state_index(self.dump_dir)
+        self.assertEqual([state_index.get(article_id)['status'] for article_id, _, _, _ in tasks],
+                         [STATUS_DOWNLOADED] * 4 + [STATUS_FAILED] * 2)
+
+    def test_rejects_large_pages(self):
+        tasks = [(str(i), self.get_link(2, i), 'en', 'original') for i in range(2)]
+        engine = FetchEngine(self.dump_dir, concurrency=2, parser_processes=1, timeout=10, content_types=['text/html'],
+                             max_size=1000)
+        engine.run(tasks, SOURCE_ORIGINAL)
+        state = get_state_index(self.dump_dir).get('0')
+        self.assertEqual((state['status'], state['last_error']), (STATUS_REJECTED, 'size: more than 1000 bytes'))
+
+
+class TestFallbackChain(FakeIaTestCase):
+
+    def test_run_chain(self):
+        links = [self.get_link(3, i) for i in range(500)]
+        with_snapshots = [link for link in links if fake_ia.has_snapshots(link, self.config)][:3]
+        latest_copy_only = [link for link in links if fake_ia.has_latest_copy(link, self.config) and
+                            not fake_ia.has_snapshots(link, self.config)][:2]
+        not_archived = [link for link in links if not fake_ia.has_latest_copy(link, self.config)][:2]
+        links = with_snapshots + latest_copy_only + not_archived
+        tasks = [(str(i), link, 'en') for i, link in enumerate(links)]
+        time_range = cli.get_cdx_time_range((20100101, 20210707))
+        self.get_engine().run_chain(tasks, [STEP_CDX, STEP_WAYBACK, STEP_WAYBACK_NOQUERY, STEP_ORIGINAL],
+                                    cdx_time_range=time_range, max_snapshots=2)
+
+        # each article stops at the first source that has it
+        state_index = get_state_index(self.dump_dir)
+        self.assertEqual([state_index.get(article_id)['status'] for article_id, _, _ in tasks],
+                         [STATUS_DOWNLOADED] * len(tasks))
+        self.assertEqual([state_index.get(article_id)['phase'] for article_id, _, _ in tasks],
+                         [STEP_CDX] * 3 + [STEP_WAYBACK] * 2 + [STEP_ORIGINAL] * 2)
+        # the snapshots listed by the CDX server are cached, whether any or none
+        cdx_cache = get_cdx_cache(self.dump_dir)
+        self.assertEqual(len(cdx_cache.get(links[0], '-'.join(time_range))), 2)
+        self.assertEqual(cdx_cache.get(links[-1], '-'.join(time_range)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
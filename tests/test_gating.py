@@ -0,0 +1,39 @@
+"""Tests for `semeval_8_2022_ia_downloader.gating`."""
+import unittest
+
+from semeval_8_2022_ia_downloader.gating import DEFAULT_CONTENT_TYPES, REASON_CONTENT_TYPE, REASON_SIZE, \
+    get_reason_label, get_rejection, parse_content_types
+
+
+class TestGetRejection(unittest.TestCase):
+
+    def test_accepted(self):
+        self.assertIsNone(get_rejection('text/html; charset=utf-8', 1000, DEFAULT_CONTENT_TYPES, 10000))
+        self.assertIsNone(get_rejection('application/xhtml+xml', None, DEFAULT_CONTENT_TYPES, 10000))
+        # responses without the header are downloaded
+        self.assertIsNone(get_rejection(None, 1000, DEFAULT_CONTENT_TYPES, 10000))
+
+    def test_content_type(self):
+        reason = get_rejection('Application/PDF', 1000, DEFAULT_CONTENT_TYPES, 10000)
+        self.assertEqual(reason, 'content_type: application/pdf')
+        self.assertEqual(get_reason_label(reason), REASON_CONTENT_TYPE)
+
+    def test_size(self):
+        reason = get_rejection('text/html', 10001, DEFAULT_CONTENT_TYPES, 10000)
+        self.assertEqual(reason, 'size: more than 10000 bytes')
+        self.assertEqual(get_reason_label(reason), REASON_SIZE)
+        self.assertIsNone(get_rejection('text/html', 10000, DEFAULT_CONTENT_TYPES, 10000))
+
+    def test_no_limits(self):
+        self.assertIsNone(get_rejection('video/mp4', 10 ** 9, [], 0))
+
+
+class TestParseContentTypes(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_content_types(' Text/HTML, application/json ,'), ['text/html', 'application/json'])
+        self.assertEqual(parse_content_types(''), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Tests for the `merge` command, `semeval_8_2022_ia_downloader.merge`."""
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from semeval_8_2022_ia_downloader.cli import merge
+from semeval_8_2022_ia_downloader.merge import MERGE_MERGED, MERGE_SKIPPED, MERGE_UNCHANGED, merge_dump
+from semeval_8_2022_ia_downloader.state import STATUS_DOWNLOADED, STATUS_FAILED, get_state_index
+from semeval_8_2022_ia_downloader.storage import get_storage
+
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump_dir = os.path.join(self.tmp.name, 'articles')
+        self.shard_dirs = [os.path.join(self.tmp.name, 'shard{}'.format(i)) for i in range(2)]
+        for shard_dir, article_ids in zip(self.shard_dirs, [['1', '3'], ['2']]):
+            for article_id in article_ids:
+                self.save(shard_dir, article_id)
+            get_state_index(shard_dir).record_failure('1{}'.format(article_ids[0]), 'original', 'timeout')
+        self.retry_logs = [os.path.join(self.tmp.name, 'inaccessible_urls{}.csv'.format(i)) for i in range(2)]
+        for retry_log, lines in zip(self.retry_logs, [['a,1\n', 'b,2\n'], ['b,2\n', 'c,3\n']]):
+            with open(retry_log, 'w', encoding='utf8') as f:
+                f.writelines(lines)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save(self, dump_dir, article_id, text='Article'):
+        html = '<html><body>{}</body></html>'.format(text).encode('utf8')
+        storage = get_storage(dump_dir)
+        storage.write(article_id, '.html', html)
+        storage.write(article_id, '.json', '{{"text": "{}"}}'.format(text).encode('utf8'))
+        get_state_index(dump_dir).record_success(article_id, 'cdx', len(text), text)
+
+    def run_merge(self):
+        retry_log = os.path.join(self.tmp.name, 'inaccessible_urls.csv')
+        with contextlib.redirect_stdout(io.StringIO()):
+            return merge(['--dump_dir', self.dump_dir, '--shard_dirs', *self.shard_dirs,
+                          '--retry_logs', *self.retry_logs, '--retry_log', retry_log])
+
+    def test_merge(self):
+        self.assertEqual(self.run_merge(), 0)
+        storage = get_storage(self.dump_dir)
+        state_index = get_state_index(self.dump_dir)
+        self.assertEqual(sorted(storage.iter_article_ids('.json')), ['1', '2', '3'])
+        self.assertEqual(storage.read('2', '.json'), b'{"text": "Article"}')
+        self.assertEqual(state_index.get('2')['status'], STATUS_DOWNLOADED)
+        # failures are merged too
+        self.assertEqual(state_index.get('11')['status'], STATUS_FAILED)
+        self.assertEqual(state_index.get('12')['status'], STATUS_FAILED)
+        # hard linked rather than copied
+        self.assertEqual(os.stat(storage.find('1', '.html')[0]).st_ino,
+                         os.stat(get_storage(self.shard_dirs[0]).find('1', '.html')[0]).st_ino)
+        with open(os.path.join(self.tmp.name, 'inaccessible_urls.csv'), encoding='utf8') as f:
+            self.assertEqual(f.read(), 'a,1\nb,2\nc,3\n')
+
+    def test_merge_again(self):
+        merge_dump(self.shard_dirs[0], self.dump_dir)
+        # downloaded again in the shard
+        self.save(self.shard_dirs[0], '3', text='Another article')
+        get_state_index(self.shard_dirs[0]).record_failure('4', 'cdx', 'timeout')
+        get_storage(self.shard_dirs[0]).write('4', '.json', b'{}')
+        self.assertEqual(merge_dump(self.shard_dirs[0], self.dump_dir),
+                         {MERGE_UNCHANGED: 1, MERGE_MERGED: 1, MERGE_SKIPPED: 1})
+        self.assertEqual(get_storage(self.dump_dir).read('3', '.json'), b'{"text": "Another article"}')
+
+    def test_missing_shard(self):
+        self.shard_dirs.append(os.path.join(self.tmp.name, 'shard2'))
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(self.run_merge(), 1)
+
+    def test_merge_into_itself(self):
+        with self.assertRaises(ValueError):
+            merge_dump(self.shard_dirs[0], self.shard_dirs[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Tests for `semeval_8_2022_ia_downloader.metrics`."""
+import json
+import os
+import tempfile
+import unittest
+
+from semeval_8_2022_ia_downloader.metrics import Metrics, write_metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_drain_and_merge(self):
+        worker = Metrics()
+        worker.inc('articles_total', phase='cdx', outcome='success')
+        worker.observe('parse_seconds', 0.02, phase='cdx')
+        metrics = Metrics()
+        metrics.inc('articles_total', phase='cdx', outcome='success')
+        metrics.merge(worker.drain())
+        metrics.merge(worker.drain())
+        counters = metrics.to_dict()['counters']
+        self.assertEqual(counters, [{'name': 'articles_total', 'labels': {'outcome': 'success', 'phase': 'cdx'},
+                                     'value': 2}])
+        histogram, = metrics.to_dict()['histograms']
+        self.assertEqual((histogram['count'], histogram['buckets']['0.01'], histogram['buckets']['0.025']), (1, 0, 1))
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.inc('responses_total', endpoint='cdx', status='429')
+        metrics.set('throttle_concurrency', 4, endpoint='cdx')
+        metrics.observe('request_seconds', 3, buckets=(1, 5), endpoint='web')
+        self.assertEqual(metrics.to_prometheus().splitlines(), [
+            '# TYPE semeval_8_2022_ia_downloader_responses_total counter',
+            'semeval_8_2022_ia_downloader_responses_total{endpoint="cdx",status="429"} 1',
+            '# TYPE semeval_8_2022_ia_downloader_throttle_concurrency gauge',
+            'semeval_8_2022_ia_downloader_throttle_concurrency{endpoint="cdx"} 4',
+            '# TYPE semeval_8_2022_ia_downloader_request_seconds histogram',
+            'semeval_8_2022_ia_downloader_request_seconds_bucket{endpoint="web",le="1"} 0',
+            'semeval_8_2022_ia_downloader_request_seconds_bucket{endpoint="web",le="5"} 1',
+            'semeval_8_2022_ia_downloader_request_seconds_bucket{endpoint="web",le="+Inf"} 1',
+            'semeval_8_2022_ia_downloader_request_seconds_sum{endpoint="web"} 3',
+            'semeval_8_2022_ia_downloader_request_seconds_count{endpoint="web"} 1'])
+
+    def test_write_metrics(self):
+        metrics = Metrics()
+        metrics.inc('phase_seconds_total', 1.5, phase='cdx')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, '.metrics')
+            write_metrics(path, metrics)
+            with open(path + '.json', encoding='utf8') as f:
+                self.assertEqual(json.load(f)['counters'][0]['value'], 1.5)
+            self.assertTrue(os.path.exists(path + '.prom'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,340 @@
+"""Tests for the downloader middlewares of Phase 1, with a stand-in for the crawler and its engine."""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import scrapy
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest
+from scrapy.http import Response, TextResponse
+from scrapy.settings import Settings
+from scrapy.signalmanager import SignalManager
+from scrapy.statscollectors import MemoryStatsCollector
+from twisted.internet import error
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+
+from semeval_8_2022_ia_downloader.cli import CDX_ENDPOINT, get_first_snapshots, get_wayback_timestamp
+from semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader import middlewares
+from semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.exceptions import BackedOff
+from semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.middlewares import AdaptiveThrottleMiddleware, \
+    FirstSnapshotMiddleware, TooManyRequestsRetryMiddleware
+from semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.spiders.ia_article_spider import IaArticleSpider
+from semeval_8_2022_ia_downloader.state import get_state_index
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeEngine:
+    """
+    records the requests crawled by the middlewares, instead of scheduling them
+    """
+
+    def __init__(self):
+        self.crawled = []
+        self.downloader = SimpleNamespace(slots={})
+
+    def crawl(self, request, spider=None):
+        self.crawled.append(request)
+
+
+class FakeCrawler:
+    """
+    the parts of `scrapy.crawler.Crawler` used by the middlewares
+    """
+
+    def __init__(self, settings=None):
+        self.settings = Settings(settings)
+        self.signals = SignalManager(self)
+        self.stats = MemoryStatsCollector(self)
+        self.engine = FakeEngine()
+        self.spider = None
+
+
+def get_spider(crawler, dump_dir):
+    spider = IaArticleSpider(dump_dir=dump_dir, links_file=None, min_text_length=0)
+    spider.crawler = crawler
+    crawler.spider = spider
+    return spider
+
+
+class TestTooManyRequestsRetryMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.crawler = FakeCrawler({'RETRY_HTTP_CODES': [429], 'TOO_MANY_REQUESTS_BACKOFF_BASE': 10})
+        self.spider = get_spider(self.crawler, self.tmp.name)
+        self.middleware = TooManyRequestsRetryMiddleware.from_crawler(self.crawler)
+        # the reactor of the middleware, imported when a request is dropped, and its clock
+        self.clock = Clock()
+        for patcher in [mock.patch('twisted.internet.reactor', self.clock, create=True),
+                        mock.patch.object(middlewares, 'time', SimpleNamespace(time=self.clock.seconds))]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def get_request(self, url, article_id='1'):
+        return scrapy.Request(url, meta={'article_id': article_id})
+
+    def hit_429(self, request, retry_after='30'):
+        response = Response(request.url, status=429, headers={'Retry-After': retry_after}, request=request)
+        return self.middleware.process_response(request, response, self.spider)
+
+    def test_backoff_drops_and_crawls_later(self):
+        request = self.get_request(CDX_ENDPOINT + '?url=http://example.com/a')
+        self.assertIsNone(self.middleware.process_request(request, self.spider))
+        retried = self.hit_429(request)
+        self.assertEqual(retried.url, request.url)
+        self.assertEqual(self.crawler.stats.get_value('backoff/429_count'), 1)
+
+        # the retried request, and any other request to the same endpoint, leaves the downloader until the backoff
+        # expires
+        with self.assertRaises(BackedOff):
+            self.middleware.process_request(retried, self.spider)
+        other = self.get_request(CDX_ENDPOINT + '?url=http://example.com/b', '2')
+        with self.assertRaises(BackedOff):
+            self.middleware.process_request(other, self.spider)
+        self.assertEqual(self.middleware.backed_off, 2)
+        self.assertEqual(self.crawler.stats.get_value('backoff/dropped'), 2)
+        # other rate limits are not delayed
+        self.assertIsNone(self.middleware.process_request(self.get_request('http://example.com/a', '3'), self.spider))
+
+        # the spider stays open while dropped requests wait
+        with self.assertRaises(DontCloseSpider):
+            self.middleware.spider_idle(self.spider)
+        self.clock.advance(29)
+        self.assertEqual(self.crawler.engine.crawled, [])
+        self.clock.advance(2)
+        self.assertEqual(self.middleware.backed_off, 0)
+        self.middleware.spider_idle(self.spider)
+
+        crawled = self.crawler.engine.crawled
+        self.assertEqual(sorted(r.url for r in crawled), [retried.url, other.url])
+        # the scheduler has seen these requests before
+        self.assertTrue(all(r.dont_filter for r in crawled))
+        self.assertEqual(sorted(r.meta['article_id'] for r in crawled), ['1', '2'])
+        # the backoff expired
+        self.assertIsNone(self.middleware.process_request(crawled[0], self.spider))
+
+    def test_concurrent_429_extend_the_backoff_once(self):
+        requests = [self.get_request(CDX_ENDPOINT + '?url=http://example.com/{}'.format(i), str(i)) for i in range(3)]
+        for request in requests:
+            self.hit_429(request)
+        self.assertEqual(self.crawler.stats.get_value('backoff/429_count'), 3)
+        self.assertEqual(self.crawler.stats.get_value('backoff/seconds'), 30)
+        self.assertEqual(self.middleware.backoff_count, {'{}/cdx'.format(requests[0].url.split('/')[2]): 1})
+
+    def test_backoff_shared_by_crawler_processes(self):
+        # the middlewares of two crawler processes of the same dump, see `crawl.get_partition_settings`
+        settings = {'RETRY_HTTP_CODES': [429], 'SHARED_BACKOFF': True}
+        first, second = [TooManyRequestsRetryMiddleware.from_crawler(FakeCrawler(settings)) for _ in range(2)]
+        request = self.get_request(CDX_ENDPOINT + '?url=http://example.com/a')
+        other = self.get_request(CDX_ENDPOINT + '?url=http://example.com/b', '2')
+        self.assertIsNone(second.process_request(other, self.spider))
+
+        # the 429 hit by the first process holds back the second one, once it reads the shared backoff again
+        response = Response(request.url, status=429, headers={'Retry-After': '30'}, request=request)
+        first.process_response(request, response, self.spider)
+        self.assertIsNone(second.process_request(other, self.spider))
+        self.clock.advance(1)
+        with self.assertRaises(BackedOff):
+            second.process_request(other, self.spider)
+        # other rate limits are not delayed
+        self.assertIsNone(second.process_request(self.get_request('http://example.com/a', '3'), self.spider))
+        self.clock.advance(30)
+        self.assertEqual(len(second.crawler.engine.crawled), 1)
+        self.assertIsNone(second.process_request(other, self.spider))
+        # without SHARED_BACKOFF, as with a single crawler process, the backoff stays local
+        self.assertIsNone(self.middleware.process_request(other, self.spider))
+
+    def test_spider_ignores_backed_off_requests(self):
+        request = self.get_request('http://example.com/a')
+        failure = Failure(BackedOff('backs off'))
+        failure.request = request
+        self.spider.errback_httpbin(failure)
+        self.assertIsNone(get_state_index(self.tmp.name).get('1'))
+
+        # unlike other ignored requests, which are failures of the article
+        failure = Failure(IgnoreRequest('no snapshot'))
+        failure.request = request
+        self.spider.errback_httpbin(failure)
+        self.assertEqual(get_state_index(self.tmp.name).get('1')['status'], 'failed')
+
+
+class TestAdaptiveThrottleMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.crawler = FakeCrawler({'ADAPTIVE_THROTTLE_ENABLED': True, 'CONCURRENT_REQUESTS_PER_DOMAIN': 8,
+                                    'DOWNLOAD_DELAY': 0})
+        self.middleware = AdaptiveThrottleMiddleware.from_crawler(self.crawler)
+
+    def get_request(self):
+        request = scrapy.Request(CDX_ENDPOINT + '?url=http://example.com/a')
+        self.assertIsNone(self.middleware.process_request(request, None))
+        # sent after any earlier decrease
+        request.meta['adaptive_throttle_sent_at'] += 1
+        return request
+
+    def test_slots_follow_the_controller(self):
+        request = self.get_request()
+        slot = self.crawler.engine.downloader.slots[request.meta['download_slot']] = \
+            SimpleNamespace(concurrency=8, delay=0)
+        self.middleware.process_response(request, Response(request.url, status=429, request=request), None)
+        self.assertEqual(slot.concurrency, 4)
+        self.assertEqual(self.crawler.stats.get_value('adaptive_throttle/cdx/concurrency'), 4)
+        # refused connections say nothing about the load of the server, unlike timeouts
+        self.middleware.process_exception(self.get_request(), error.ConnectionRefusedError(), None)
+        self.assertEqual(slot.concurrency, 4)
+        self.middleware.process_exception(self.get_request(), error.TimeoutError(), None)
+        self.assertEqual(slot.concurrency, 2)
+        self.assertGreater(slot.delay, 0)
+
+
+class TestFirstSnapshotMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.crawler = FakeCrawler({'WAYBACK_MACHINE_TIME_RANGE': (20100101, 20210707),
+                                    'WAYBACK_MACHINE_MAX_SNAPSHOTS': 2})
+        self.spider = get_spider(self.crawler, self.tmp.name)
+        self.middleware = FirstSnapshotMiddleware.from_crawler(self.crawler)
+        self.middleware.spider_opened(self.spider)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def get_cdx_response(self, cdx_request, rows, status=200):
+        body = json.dumps([['timestamp', 'original', 'statuscode', 'digest']] + rows) if rows is not None else ''
+        return TextResponse(cdx_request.url, status=status, body=body.encode('utf8'), encoding='utf8',
+                            request=cdx_request)
+
+    def get_snapshot_requests(self, cdx_request, rows, status=200):
+        """
+        :return: the snapshot requests downloaded after the CDX response, or None if the article is ignored
+        """
+        try:
+            snapshot_request = self.middleware.process_response(
+                cdx_request, self.get_cdx_response(cdx_request, rows, status), self.spider)
+        except IgnoreRequest:
+            return None
+        self.assertIsInstance(snapshot_request, scrapy.Request)
+        return [snapshot_request]
+
+    def test_cdx_cache(self):
+        request = scrapy.Request('http://example.com/a', meta={'article_id': '1'})
+        cdx_request = self.middleware.process_request(request, self.spider)
+        self.assertTrue(cdx_request.meta['wayback_machine_cdx_request'])
+        self.assertEqual(self.crawler.stats.get_value('wayback_machine/cdx_cache/miss'), 1)
+        snapshot_requests = self.get_snapshot_requests(cdx_request, [
+            ['20120101000000', 'http://example.com/a', '200', 'A'],
+            ['20130101000000', 'http://example.com/a', '200', 'B'],
+            ['20140101000000', 'http://example.com/a', '200', 'C']])
+        self.assertEqual([r.url for r in snapshot_requests],
+                         [self.middleware.snapshot_url_template.format(timestamp='20120101000000',
+                                                                       original='http://example.com/a')])
+
+        # rerun: no CDX query, the same snapshots
+        cached = self.middleware.process_request(request, self.spider)
+        self.assertEqual(self.crawler.stats.get_value('wayback_machine/cdx_cache/hit'), 1)
+        self.assertEqual(cached.url, snapshot_requests[0].url)
+        self.assertEqual(cached.meta['wayback_machine_candidates'],
+                         snapshot_requests[0].meta['wayback_machine_candidates'])
+        self.assertEqual(cached.meta['article_id'], '1')
+
+    def test_cdx_cache_of_empty_listings(self):
+        request = scrapy.Request('http://example.com/a')
+        cdx_request = self.middleware.process_request(request, self.spider)
+        # only redirects
+        self.assertIsNone(self.get_snapshot_requests(cdx_request, [
+            ['20120101000000', 'http://example.com/a', '301', 'A']]))
+        with self.assertRaises(IgnoreRequest):
+            self.middleware.process_request(request, self.spider)
+
+    def test_errors_are_not_cached(self):
+        request = scrapy.Request('http://example.com/a')
+        cdx_request = self.middleware.process_request(request, self.spider)
+        # e.g., once the retries of a 429 error are exhausted
+        self.assertIsNone(self.get_snapshot_requests(cdx_request, None, status=429))
+        self.assertIsNone(self.middleware.cdx_cache.get(request.url, self.middleware.get_time_range_key()))
+        # requests dropped while the listing is parsed
+        with mock.patch.object(FirstSnapshotMiddleware, 'filter_snapshots', side_effect=BackedOff):
+            with self.assertRaises(BackedOff):
+                self.middleware.process_response(cdx_request, self.get_cdx_response(cdx_request, [
+                    ['20120101000000', 'http://example.com/a', '200', 'A']]), self.spider)
+        self.assertIsNone(self.middleware.cdx_cache.get(request.url, self.middleware.get_time_range_key()))
+        self.assertTrue(self.middleware.process_request(request, self.spider).meta['wayback_machine_cdx_request'])
+
+    def test_snapshot_live_at_the_start(self):
+        request = scrapy.Request('http://example.com/a')
+        cdx_request = self.middleware.process_request(request, self.spider)
+        self.assertIn('to=20210707000000', cdx_request.url)
+        self.assertNotIn('from=', cdx_request.url)
+        rows = [['20080101000000', 'http://example.com/a', '200', 'A'],
+                ['20120101000000', 'http://example.com/a', '200', 'B'],
+                ['20130101000000', 'http://example.com/a', '200', 'C']]
+        snapshot_request, = self.get_snapshot_requests(cdx_request, rows)
+        self.assertIn('/20080101000000', snapshot_request.url)
+
+    def test_same_snapshots_as_the_fetcher(self):
+        for i, rows in enumerate([[['20080101000000', 'http://example.com/a', '200', 'A'],
+                                   ['20090101000000', 'http://example.com/a', '404', 'B'],
+                                   ['20120101000000', 'http://example.com/a', '200', 'C']],
+                                  [['20080101000000', 'http://example.com/a', '-', 'A'],
+                                   ['20110101000000', 'http://example.com/a', '200', 'B'],
+                                   ['20120101000000', 'http://example.com/a', '200', 'B'],
+                                   ['20130101000000', 'http://example.com/a', '200', 'C']],
+                                  [['20080101000000', 'http://example.com/a', '200', 'A']]]):
+            with self.subTest(rows=rows):
+                cdx_request = self.middleware.process_request(scrapy.Request('http://example.com/{}'.format(i)),
+                                                              self.spider)
+                snapshot_requests = self.get_snapshot_requests(cdx_request, rows) or []
+                snapshot_urls = [url for snapshot_request in snapshot_requests for url in
+                                 [snapshot_request.url] + snapshot_request.meta['wayback_machine_candidates']]
+                expected = get_first_snapshots([dict(zip(['timestamp', 'original', 'statuscode', 'digest'], row))
+                                                for row in rows], self.middleware.cdx_time_range, 2)
+                self.assertEqual([get_wayback_timestamp(url) for url in snapshot_urls],
+                                 [snapshot['timestamp'] for snapshot in expected])
+
+    def test_fallback_to_the_next_snapshot(self):
+        request = scrapy.Request('http://example.com/a', meta={'article_id': '1'})
+        cdx_request = self.middleware.process_request(request, self.spider)
+        snapshot_request, = self.get_snapshot_requests(cdx_request, [
+            ['20120101000000', 'http://example.com/a', '200', 'A'],
+            ['20130101000000', 'http://example.com/a', '200', 'B']])
+        for status in [404, 429, 502]:
+            with self.subTest(status=status):
+                response = Response(snapshot_request.url, status=status, request=snapshot_request)
+                fallback = self.middleware.process_response(snapshot_request, response, self.spider)
+                self.assertIn('/20130101000000', fallback.url)
+                self.assertEqual(fallback.meta['wayback_machine_candidates'], [])
+                self.assertEqual(fallback.meta['article_id'], '1')
+                # no candidates left: the retry phases download the article
+                with self.assertRaises(IgnoreRequest):
+                    self.middleware.process_response(fallback, Response(fallback.url, status=status, request=fallback),
+                                                     self.spider)
+        self.assertEqual(self.crawler.stats.get_value('wayback_machine/snapshot_fallback'), 3)
+
+        response = Response(snapshot_request.url, status=200, request=snapshot_request)
+        self.assertEqual(self.middleware.process_response(snapshot_request, response, self.spider).url, request.url)
+
+
+class TestImports(unittest.TestCase):
+
+    def test_spider_does_not_install_a_reactor(self):
+        # the spider loader imports the spider before scrapy installs the reactor of TWISTED_REACTOR
+        code = ('import sys\n'
+                'import semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.spiders.ia_article_spider\n'
+                'import semeval_8_2022_ia_downloader.semeval_8_2022_ia_downloader.pipelines\n'
+                'sys.exit("twisted.internet.reactor" in sys.modules)\n')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+        self.assertEqual(subprocess.run([sys.executable, '-c', code], env=env).returncode, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Tests for `semeval_8_2022_ia_downloader.plan`."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from semeval_8_2022_ia_downloader import plan
+from semeval_8_2022_ia_downloader.plan import PLAN_COLUMNS, assign_fetch_ids, get_shards, load_plan, normalize_link
+
+
+class TestNormalizeLink(unittest.TestCase):
+
+    def test_variants(self):
+        variants = ['http://www.example.com/news/a?b=2&a=1',
+                    'https://WWW.Example.com:443/news/a/?a=1&b=2#comments',
+                    'http://www.example.com:80/news/a?utm_source=feed&a=1&b=2&fbclid=x']
+        self.assertEqual({normalize_link(link) for link in variants}, {'//www.example.com/news/a?a=1&b=2'})
+
+    def test_distinct(self):
+        self.assertNotEqual(normalize_link('http://example.com/a'), normalize_link('http://example.com/b'))
+        self.assertNotEqual(normalize_link('http://example.com/a?id=1'), normalize_link('http://example.com/a?id=2'))
+        self.assertNotEqual(normalize_link('http://example.com:8080/a'), normalize_link('http://example.com/a'))
+
+    def test_root(self):
+        self.assertEqual(normalize_link('http://example.com'), normalize_link('http://example.com/'))
+
+
+class TestAssignFetchIds(unittest.TestCase):
+
+    def test_first_article_of_each_link(self):
+        df = pd.DataFrame([['1', 'http://example.com/a', 'en', 'http://example.com/a', None],
+                           ['2', 'http://example.com/b', 'en', 'http://example.com/b', None],
+                           ['3', 'https://example.com/a/', 'de', 'https://example.com/a/', None],
+                           ['4', 'http://feedproxy.google.com/x', 'en', None, None],
+                           ['5', 'http://feedproxy.google.com/x', 'en', None, None]], columns=PLAN_COLUMNS)
+        assign_fetch_ids(df)
+        # links that are not resolved are not deduplicated
+        self.assertEqual(df['fetch_id'].tolist(), ['1', '2', '1', '4', '5'])
+
+
+class TestGetShards(unittest.TestCase):
+
+    def test_stable_and_in_range(self):
+        article_ids = pd.Series([str(1000000 + i) for i in range(200)])
+        shards = get_shards(article_ids, 4)
+        self.assertTrue(shards.between(0, 3).all())
+        self.assertEqual(set(shards), {0, 1, 2, 3})
+        self.assertTrue(shards.equals(get_shards(article_ids.copy(), 4)))
+        # the same article is in the same shard, whatever the other articles
+        self.assertEqual(get_shards(article_ids[:1], 4).iloc[0], shards.iloc[0])
+
+
+class TestLoadPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.links_file = os.path.join(self.tmp.name, 'links.csv')
+        with open(self.links_file, 'w', encoding='utf8') as f:
+            f.write('pair_id,url1_lang,link1,url2_lang,link2\n'
+                    '1_2,en,http://feedproxy.google.com/~r/a,en,http://example.com/b\n'
+                    '3_4,de,http://example.com/b/,en,http://example.com/c\n')
+        self.dump_dir = os.path.join(self.tmp.name, 'articles')
+
+    def tearDown(self):
+        plan._plans.clear()
+        self.tmp.cleanup()
+
+    def test_resolves_only_when_asked(self):
+        with mock.patch.object(plan, 'resolve_link', return_value='http://example.com/c') as resolve_link:
+            df = load_plan(self.links_file, self.dump_dir)
+            self.assertEqual(resolve_link.call_count, 0)
+            self.assertEqual(df['article_id'].tolist(), ['1', '2', '3', '4'])
+            self.assertTrue(df['resolved_link'].isna().any())
+            self.assertEqual(df['fetch_id'].tolist(), ['1', '2', '2', '4'])
+
+            df = load_plan(self.links_file, self.dump_dir, resolve=True)
+            self.assertEqual(resolve_link.call_count, 1)
+            self.assertFalse(df['resolved_link'].isna().any())
+            # the resolved link of the first article is the link of the fourth one
+            self.assertEqual(df['fetch_id'].tolist(), ['1', '2', '2', '1'])
+
+            # cached in the redirect cache, and in the plan on disk
+            plan._plans.clear()
+            df = load_plan(self.links_file, self.dump_dir, resolve=True)
+            self.assertEqual(resolve_link.call_count, 1)
+            self.assertEqual(df['resolved_link'].tolist()[0], 'http://example.com/c')
+
+    def test_memoised(self):
+        self.assertIs(load_plan(self.links_file, self.dump_dir), load_plan(self.links_file, self.dump_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Tests for `semeval_8_2022_ia_downloader.profiling`."""
+import os
+import pstats
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from semeval_8_2022_ia_downloader import profiling
+from semeval_8_2022_ia_downloader.profiling import PROFILE_DIR_ENV, enable_profiling, record_parse_time, \
+    start_thread_profiler, write_report
+
+
+def download_in_thread():
+    return sum(range(1000))
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        # even if the test failed before writing the report
+        if PROFILE_DIR_ENV in os.environ:
+            profiling.stop_profiler()
+        self.tmp.cleanup()
+
+    def test_downloader_threads_are_profiled(self):
+        enable_profiling(self.tmp.name)
+        # like the downloader threads of `fetcher.FetchEngine`
+        with ThreadPoolExecutor(max_workers=2, initializer=start_thread_profiler) as downloaders:
+            self.assertEqual(list(downloaders.map(lambda _: download_in_thread(), range(4))), [499500] * 4)
+        record_parse_time('example.com', 0.2, 'http://example.com/a')
+        path = write_report(self.tmp.name)
+
+        functions = {function for _, _, function in pstats.Stats(os.path.join(self.tmp.name,
+                                                                              'profile-main.pstats')).stats}
+        self.assertIn('download_in_thread', functions)
+        with open(path, encoding='utf8') as f:
+            report = f.read()
+        self.assertIn('example.com', report)
+
+    def test_not_profiled(self):
+        self.assertIsNone(write_report(self.tmp.name))
+        # threads of runs that are not profiled
+        start_thread_profiler()
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'profile.txt')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Tests for `semeval_8_2022_ia_downloader.state`."""
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from semeval_8_2022_ia_downloader.state import STATUS_DOWNLOADED, STATUS_FAILED, STATUS_REJECTED, BackoffIndex, \
+    CdxCache, get_plan_index, get_state_index
+
+
+class TestArticleStateIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump_dir = os.path.join(self.tmp.name, 'articles')
+        self.index = get_state_index(self.dump_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_completed_ids(self):
+        self.index.record_success('1', 'cdx', 1000, 'a')
+        self.index.record_success('2', 'cdx', 10, 'b')
+        self.index.record_failure('3', 'cdx', 'timeout')
+        # not articles: no other source serves them either
+        self.index.record_rejection('4', 'cdx', 'content_type: application/pdf')
+        self.assertEqual(self.index.get_completed_ids(), {'1', '2', '4'})
+        self.assertEqual(self.index.get_completed_ids(min_text_length=100), {'1', '4'})
+
+    def test_downloaded_articles_keep_their_status(self):
+        self.index.record_success('1', 'cdx', 1000, 'a')
+        self.index.record_failure('1', 'original', 'timeout')
+        self.index.record_rejection('1', 'original', 'size: more than 10 bytes')
+        state = self.index.get('1')
+        self.assertEqual((state['status'], state['phase'], state['last_error']),
+                         (STATUS_DOWNLOADED, 'cdx', 'timeout'))
+
+    def test_merge_from(self):
+        source_dir = os.path.join(self.tmp.name, 'shard')
+        source = get_state_index(source_dir)
+        self.index.record_failure('1', 'cdx', 'timeout')
+        self.index.record_success('2', 'cdx', 1000, 'a')
+        time.sleep(0.01)
+        source.record_failure('1', 'original', 'connection refused')
+        source.record_failure('2', 'original', 'timeout')
+        source.record_failure('3', 'cdx', 'timeout')
+        # downloaded articles are merged with their files, by `merge.merge_dump`
+        source.record_success('4', 'cdx', 1000, 'b')
+        source.record_rejection('5', 'original', 'content_type: application/pdf')
+
+        self.index.merge_from(source_dir)
+        self.assertEqual((self.index.get('1')['status'], self.index.get('1')['last_error']),
+                         (STATUS_FAILED, 'connection refused'))
+        self.assertEqual(self.index.get('2')['status'], STATUS_DOWNLOADED)
+        self.assertEqual(self.index.get('3')['status'], STATUS_FAILED)
+        self.assertIsNone(self.index.get('4'))
+        self.assertEqual(self.index.get('5')['status'], STATUS_REJECTED)
+
+
+class TestCdxCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump_dir = os.path.join(self.tmp.name, 'articles')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_put(self):
+        cache = CdxCache(self.dump_dir, ttl=60)
+        self.assertIsNone(cache.get('http://example.com/a', '2010-2021'))
+        cache.put('http://example.com/a', '2010-2021', ['https://web.archive.org/web/2012id_/http://example.com/a'])
+        cache.put('http://example.com/b', '2010-2021', [])
+        self.assertEqual(cache.get('http://example.com/a', '2010-2021'),
+                         ['https://web.archive.org/web/2012id_/http://example.com/a'])
+        # urls without snapshots are remembered too
+        self.assertEqual(cache.get('http://example.com/b', '2010-2021'), [])
+        # each time range has its own snapshots
+        self.assertIsNone(cache.get('http://example.com/a', '2015-2021'))
+        # shared by every process of the dump
+        self.assertEqual(CdxCache(self.dump_dir).get('http://example.com/b', '2010-2021'), [])
+
+    def test_expiry(self):
+        cache = CdxCache(self.dump_dir, ttl=60)
+        cache.put('http://example.com/a', '2010-2021', [])
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertIsNone(cache.get('http://example.com/a', '2010-2021'))
+
+
+class TestBackoffIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_put(self):
+        index = BackoffIndex(self.dump_dir)
+        self.assertEqual(index.get('web.archive.org/cdx'), 0)
+        index.put('web.archive.org/cdx', 100)
+        # a shorter backoff, recorded by another process, does not shorten the longer one
+        BackoffIndex(self.dump_dir).put('web.archive.org/cdx', 50)
+        self.assertEqual(index.get('web.archive.org/cdx'), 100)
+        BackoffIndex(self.dump_dir).put('web.archive.org/cdx', 200)
+        self.assertEqual(index.get('web.archive.org/cdx'), 200)
+        self.assertEqual(index.get('web.archive.org/wayback'), 0)
+
+
+class TestPlanIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_status_counts(self):
+        state_index = get_state_index(self.dump_dir)
+        state_index.record_success('1', 'cdx', 1000, 'a')
+        plan_index = get_plan_index(self.dump_dir)
+        plan_index.replace([('1', 'en', 'a.com'), ('2', 'en', 'a.com'), ('3', 'en', 'b.com'), ('4', 'de', 'a.com'),
+                            ('5', 'de', 'b.com')])
+        # recorded after the plan, through the triggers of the state database
+        state_index.record_success('2', 'cdx', 10, 'b')
+        state_index.record_failure('3', 'cdx', 'timeout')
+        state_index.record_rejection('4', 'original', 'size: more than 10 bytes')
+        # not in the plan
+        state_index.record_success('6', 'cdx', 1000, 'd')
+        self.assertEqual(plan_index.count(), 5)
+
+        self.assertEqual(plan_index.get_status_counts([], min_text_length=100), [
+            {'total': 5, 'downloaded': 1, 'short_text': 1, 'failed': 1, 'rejected': 1, 'missing': 1}])
+        counts = plan_index.get_status_counts(['lang'])
+        self.assertEqual(counts[0], {'lang': 'en', 'total': 3, 'downloaded': 2, 'short_text': 0, 'failed': 1,
+                                     'rejected': 0, 'missing': 0})
+        self.assertEqual(counts[1], {'lang': 'de', 'total': 2, 'downloaded': 0, 'short_text': 0, 'failed': 0,
+                                     'rejected': 1, 'missing': 1})
+        self.assertEqual(len(plan_index.get_status_counts(['lang', 'domain'])), 4)
+        with self.assertRaises(ValueError):
+            plan_index.get_status_counts(['status'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Tests for `semeval_8_2022_ia_downloader.storage`."""
+import os
+import tempfile
+import unittest
+
+from semeval_8_2022_ia_downloader.cli import convert
+from semeval_8_2022_ia_downloader.storage import LAYOUT_PACKED, LAYOUT_TREE, LAYOUTS, PackedStorage, TreeStorage, \
+    configure_storage, get_storage, zstandard
+
+HTML = '<html><body><p>Ünïcode article</p></body></html>'.encode('utf8')
+JSON = b'{"title": "a", "text": "Article"}'
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump_dir = self.tmp.name
+        self.dump_dirs = [self.dump_dir]
+
+    def tearDown(self):
+        for dump_dir in self.dump_dirs:
+            storage = get_storage(dump_dir)
+            for s in [storage, storage.fallback]:
+                if isinstance(s, PackedStorage):
+                    s.close()
+        self.tmp.cleanup()
+
+    def check_round_trip(self, layout, compression):
+        dump_dir = os.path.join(self.tmp.name, '{}-{}'.format(layout, compression))
+        self.dump_dirs.append(dump_dir)
+        configure_storage(dump_dir, compression, layout=layout)
+        storage = get_storage(dump_dir)
+        self.assertIsInstance(storage, PackedStorage if layout == LAYOUT_PACKED else TreeStorage)
+        self.assertIsNone(storage.read('123', '.html'))
+
+        storage.write('123', '.html', HTML, url='http://example.com/a')
+        storage.write('123', '.json', JSON)
+        storage.write('456', '.json', b'{}')
+        self.assertEqual(storage.read('123', '.html'), HTML)
+        self.assertEqual(storage.read('123', '.json'), JSON)
+        self.assertEqual(storage.find('123', '.json')[1], compression)
+        self.assertEqual(sorted(storage.iter_article_ids('.json')), ['123', '456'])
+        self.assertEqual(list(storage.iter_article_ids('.html')), ['123'])
+
+        # articles sharing their link share their files
+        self.assertTrue(storage.copy('123', '789', '.json'))
+        self.assertFalse(storage.copy('000', '789', '.html'))
+        self.assertEqual(storage.read('789', '.json'), JSON)
+        self.assertEqual(sorted(storage.iter_article_ids('.json')), ['123', '456', '789'])
+
+        # a later copy replaces the earlier one, and not the copies of other articles
+        storage.write('123', '.json', b'{"text": ""}')
+        self.assertEqual(storage.read('123', '.json'), b'{"text": ""}')
+        self.assertEqual(storage.read('789', '.json'), JSON)
+
+    def test_round_trip(self):
+        compressions = ['none', 'gzip'] + (['zstd'] if zstandard is not None else [])
+        for layout in LAYOUTS:
+            for compression in compressions:
+                with self.subTest(layout=layout, compression=compression):
+                    self.check_round_trip(layout, compression)
+
+    def test_reads_other_compressions(self):
+        configure_storage(self.dump_dir, 'gzip')
+        get_storage(self.dump_dir).write('123', '.json', JSON)
+        configure_storage(self.dump_dir, 'none')
+        storage = get_storage(self.dump_dir)
+        storage.write('456', '.json', b'{}')
+        self.assertEqual(storage.read('123', '.json'), JSON)
+        self.assertEqual(sorted(storage.iter_article_ids('.json')), ['123', '456'])
+        self.assertTrue(os.path.exists(os.path.join(self.dump_dir, '23', '123.json.gz')))
+
+    def test_reads_other_layouts(self):
+        configure_storage(self.dump_dir, 'gzip', layout=LAYOUT_TREE)
+        get_storage(self.dump_dir).write('123', '.json', JSON)
+        configure_storage(self.dump_dir, 'none', layout=LAYOUT_PACKED)
+        storage = get_storage(self.dump_dir)
+        storage.write('456', '.json', b'{}')
+        self.assertEqual(storage.read('123', '.json'), JSON)
+        self.assertEqual(sorted(storage.iter_article_ids('.json')), ['123', '456'])
+        self.assertTrue(os.path.exists(os.path.join(self.dump_dir, '23', '123.json.gz')))
+
+    def test_convert(self):
+        storage = get_storage(self.dump_dir)
+        storage.write('123', '.html', HTML, url='http://example.com/a')
+        storage.write('123', '.json', JSON)
+        self.assertEqual(convert(['--dump_dir', self.dump_dir, '--layout', LAYOUT_PACKED, '--compression', 'gzip']), 0)
+        storage = get_storage(self.dump_dir)
+        self.assertEqual(storage.locate('123', '.html')[1], 'gzip')
+        self.assertEqual(storage.read('123', '.html'), HTML)
+        self.assertEqual(storage.read('123', '.json'), JSON)
+        # the articles in the previous layout are deleted
+        self.assertIsNone(storage.fallback.locate('123', '.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Tests for `semeval_8_2022_ia_downloader.throttle`."""
+import time
+import unittest
+
+from semeval_8_2022_ia_downloader.throttle import MIN_BACKOFF_DELAY, AimdController, is_overloaded
+
+
+class TestIsOverloaded(unittest.TestCase):
+
+    def test_statuses(self):
+        for status in [None, 429, 500, 502, 503]:
+            self.assertTrue(is_overloaded(status), status)
+        for status in [200, 301, 404]:
+            self.assertFalse(is_overloaded(status), status)
+
+
+class TestAimdController(unittest.TestCase):
+
+    def test_additive_increase(self):
+        controller = AimdController(4, delay=1)
+        for _ in range(4):
+            self.assertTrue(controller.record('cdx', 200, 0.1))
+        self.assertEqual(controller.get_concurrency('cdx'), 4)
+        self.assertLess(controller.get_delay('cdx'), 1)
+        for _ in range(8):
+            controller.record('cdx', 200, 0.1)
+        self.assertEqual(controller.get_concurrency('cdx'), 6)
+        # each class of endpoint has its own values
+        self.assertEqual(controller.get_concurrency('web'), 4)
+
+    def test_multiplicative_decrease(self):
+        controller = AimdController(8)
+        self.assertTrue(controller.record('web', 429, 0.1))
+        self.assertEqual(controller.get_concurrency('web'), 4)
+        self.assertEqual(controller.get_delay('web'), MIN_BACKOFF_DELAY)
+        self.assertTrue(controller.record('web', None, None))
+        self.assertEqual(controller.get_concurrency('web'), 2)
+        self.assertEqual(controller.get_delay('web'), 2 * MIN_BACKOFF_DELAY)
+
+    def test_one_decrease_per_burst(self):
+        controller = AimdController(8)
+        sent_at = time.time() - 1
+        self.assertTrue(controller.record('web', 503, 1, sent_at=sent_at))
+        # requests in flight when the server got overloaded
+        self.assertFalse(controller.record('web', 503, 1, sent_at=sent_at))
+        self.assertEqual(controller.get_concurrency('web'), 4)
+        self.assertTrue(controller.record('web', 503, 0, sent_at=time.time() + 1))
+        self.assertEqual(controller.get_concurrency('web'), 2)
+
+    def test_bounds(self):
+        controller = AimdController(2, max_concurrency=3, max_delay=1, min_delays={'original': 0.5})
+        for _ in range(100):
+            controller.record('original', 200, 0.1)
+        self.assertEqual(controller.get_concurrency('original'), 3)
+        self.assertEqual(controller.get_delay('original'), 0.5)
+        for _ in range(10):
+            controller.record('original', 429, 0, sent_at=time.time() + 1)
+        self.assertEqual(controller.get_concurrency('original'), 1)
+        self.assertEqual(controller.get_delay('original'), 1)
+
+    def test_slow_responses(self):
+        controller = AimdController(4, target_latency=1)
+        self.assertFalse(controller.record('cdx', 200, 2))
+        self.assertFalse(controller.record('cdx', 200, None))
+        self.assertEqual(controller.get_concurrency('cdx'), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
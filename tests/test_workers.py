@@ -0,0 +1,46 @@
+"""Tests for the tasks of the parser processes, `semeval_8_2022_ia_downloader.workers`."""
+import os
+import tempfile
+import unittest
+
+from semeval_8_2022_ia_downloader.cli import get_extractor_version, parse_article
+from semeval_8_2022_ia_downloader.state import get_state_index
+from semeval_8_2022_ia_downloader.workers import REPARSE_MISSING, REPARSE_PARSED, REPARSE_SKIPPED, \
+    reparse_article_task
+
+HTML = ('<html><head><title>A title</title></head><body><article><h1>A title</h1><p>{}</p></article></body></html>'
+        .format(' '.join(['The mayor said that the city would open a new hospital.'] * 20)).encode('utf8'))
+
+
+class TestReparse(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dump_dir = os.path.join(self.tmp.name, 'articles')
+        parse_article(self.dump_dir, '1', 'http://example.com/a', 'en', html=HTML, phase='cdx')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def reparse(self, article_id='1', force=False):
+        outcome, _ = reparse_article_task((self.dump_dir, article_id, 'http://example.com/a', 'en', force))
+        return outcome
+
+    def test_offline_extractor_version(self):
+        state_index = get_state_index(self.dump_dir)
+        self.assertEqual(state_index.get('1')['extractor_version'], get_extractor_version())
+        # extracted again, as the offline extractor may extract other images
+        self.assertEqual(self.reparse(), REPARSE_PARSED)
+        state = state_index.get('1')
+        self.assertEqual(state['extractor_version'], get_extractor_version(offline=True))
+        self.assertEqual(state['phase'], 'cdx')
+        # neither the html nor the extractor changed since
+        self.assertEqual(self.reparse(), REPARSE_SKIPPED)
+        self.assertEqual(self.reparse(force=True), REPARSE_PARSED)
+
+    def test_missing_html(self):
+        self.assertEqual(self.reparse('2'), REPARSE_MISSING)
+
+
+if __name__ == '__main__':
+    unittest.main()